@@ -0,0 +1,97 @@
+"""Peak memory and wall time of the photo rendition pipeline
+
+Compares decoding the whole image before scaling it (the pipeline before draft mode)
+against utils.methods.save_renditions, which decodes JPEG at reduced resolution.
+Each run happens in a fresh process so its peak RSS is measured on its own.
+
+Usage (from the django/ directory):
+    python benchmarks/bench_decode.py --megapixels 50
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from utils.methods import save_renditions  # noqa: E402
+
+RENDITIONS = {"card": (480, 360), "grid": (640, 640), "detail": (1280, 1280), "full": (2560, 2560)}
+FORMATS = {"jpeg": "JPEG", "png": "PNG"}
+
+
+def make_image(directory, megapixels, image_format):
+    """Synthetic 4:3 photo with enough detail to not compress to nothing"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    image = Image.radial_gradient("L").resize((width, height)).convert("RGB")
+    path = os.path.join(directory, f"bench.{image_format.lower()}")
+    image.save(path, format=image_format, quality=90)
+    return path
+
+
+def full_decode(path, renditions):
+    """Decode at native resolution then scale, as the pipeline did before draft mode"""
+    with Image.open(path) as original:
+        image_format = original.format
+        image = original.copy()
+    for label, ((width, height), destination) in sorted(renditions.items(), key=lambda item: -item[1][0][0]):
+        image = image.copy()
+        image.thumbnail((width, height), Image.LANCZOS, reducing_gap=None)
+        image.save(destination, format=image_format)
+
+
+def child(method, path, directory):
+    renditions = {
+        label: (size, os.path.join(directory, f"out_{label}{os.path.splitext(path)[1]}"))
+        for label, size in RENDITIONS.items()
+    }
+    started = time.perf_counter()
+    if method == "full":
+        full_decode(path, renditions)
+    else:
+        save_renditions(path, renditions)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"seconds": elapsed, "peak_mb": peak}))
+
+
+def run(*args):
+    """Run this script in a new process
+
+    Linux keeps a process' peak RSS across fork/exec, so the parent must stay small:
+    even the source images are generated in a child process.
+    """
+    output = subprocess.run([sys.executable, __file__, *args], check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=50)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument("--make", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(*args.child)
+    if args.make:
+        return print(json.dumps(make_image(args.make[0], args.megapixels, args.make[1])))
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{args.megapixels:g} megapixel source images")
+        print(f"{'format':<8}{'path':<14}{'peak RSS (MB)':>15}{'wall (s)':>10}")
+        for name, image_format in FORMATS.items():
+            path = run("--megapixels", str(args.megapixels), "--make", directory, image_format)
+            for method, label in (("full", "full decode"), ("draft", "pipeline")):
+                result = run("--child", method, path, directory)
+                print(f"{name:<8}{label:<14}{result['peak_mb']:>15.0f}{result['seconds']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Rendition bytes and encode time by output format
+
+Encodes every rendition size of each image in tests/FakeImages and of a synthetic set
+(smooth gradients, fine texture, flat graphics) as the pipeline did before (original
+format, Pillow defaults) and as utils.methods.save_image does now: the original format
+with settings.PHOTO_ENCODER_OPTIONS, plus WebP and AVIF when this Pillow build can
+encode them. Reports total bytes against the old pipeline and mean encode time.
+
+Usage (from the django/ directory):
+    python benchmarks/bench_formats.py --repeat 3
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+from utils.methods import (  # noqa: E402
+    encodable_formats,
+    open_image,
+    resizeScale,
+    save_image,
+)
+
+RENDITIONS = {"card": (480, 360), "grid": (640, 640), "detail": (1280, 1280), "full": (2560, 2560)}
+# Same as settings.PHOTO_ENCODER_OPTIONS
+OPTIONS = {
+    "JPEG": {"quality": 75, "progressive": True, "optimize": True},
+    "PNG": {"optimize": True},
+    "WEBP": {"quality": 78, "method": 4},
+    "AVIF": {"quality": 55, "speed": 6},
+}
+FAKE_IMAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "FakeImages")
+
+
+def synthetic_images(size=(3000, 2000)):
+    """Photo-like images, compressed to JPEG like a camera upload"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    yield "gradient", Image.merge("RGB", (gradient, gradient.rotate(90).resize(size), Image.new("L", size, 90)))
+    yield "texture", Image.merge("RGB", (noise, Image.blend(noise, gradient, 0.5), gradient))
+
+    graphic = Image.new("RGB", size, (245, 245, 240))
+    draw = ImageDraw.Draw(graphic)
+    for index in range(40):
+        x, y = index * 70 % size[0], index * 131 % size[1]
+        draw.rectangle((x, y, x + 400, y + 250), fill=(index * 37 % 255, index * 91 % 255, 160))
+        draw.text((x + 20, y + 20), f"Gallery {index}", fill=(0, 0, 0))
+    yield "graphic", graphic
+
+
+def corpus():
+    for path in sorted(glob.glob(os.path.join(FAKE_IMAGES, "*"))):
+        with Image.open(path) as image:
+            image.load()
+            yield os.path.basename(path), image.format, image.copy()
+    for name, image in synthetic_images():
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=92)
+        buffer.seek(0)
+        yield f"{name} (synthetic)", "JPEG", Image.open(buffer)
+
+
+def encode(image, image_format, options, repeat, directory, old=False):
+    """Smallest time of `repeat` encodes, and the encoded size"""
+    path = os.path.join(directory, f"bench.{image_format.lower()}")
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        if old:
+            image.save(path, format=image_format)
+        else:
+            save_image(image, path, image_format, options)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return os.path.getsize(path), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Encodes timed per rendition, the fastest counts")
+    args = parser.parse_args()
+
+    others = encodable_formats(["AVIF", "WEBP"])
+    print(f"Formats: original (before), original (now), {', '.join(others)}")
+    totals = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, original_format, original in corpus():
+            buffer = io.BytesIO()
+            original.save(buffer, format=original_format)
+            with open_image(io.BytesIO(buffer.getvalue()), max(RENDITIONS.values())) as image:
+                if original_format == "JPEG" and image.mode != "RGB":
+                    image = image.convert("RGB")
+                for width, height in sorted(RENDITIONS.values(), reverse=True):
+                    image = resizeScale(image, width, height)
+                    variants = [("before", original_format, True), ("now", original_format, False)]
+                    variants += [(other, other, False) for other in others]
+                    for label, image_format, old in variants:
+                        size, elapsed = encode(
+                            image, image_format, OPTIONS.get(image_format), args.repeat, directory, old=old
+                        )
+                        entry = totals.setdefault(label, [0, 0.0, 0])
+                        entry[0] += size
+                        entry[1] += elapsed
+                        entry[2] += 1
+            print(f"  encoded {name} ({original.width}x{original.height} {original_format})")
+
+    baseline = totals["before"][0]
+    print(f"\n{'output':>8} {'total KB':>10} {'vs before':>10} {'ms/encode':>10}")
+    for label, (size, elapsed, count) in totals.items():
+        print(f"{label:>8} {size / 1024:>10.0f} {size / baseline - 1:>+10.1%} {elapsed / count * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Near duplicate query latency with the multi-index perceptual hash index
+
+Loads random 64 bit hashes into an SQLite table shaped like gallery_photo's phash
+columns (one index per 16 bit chunk) and times the query PhotoManager.near_duplicates
+runs against a full table scan computing every Hamming distance.
+
+Usage (from the django/ directory):
+    python benchmarks/bench_phash.py --photos 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.methods import hamming_distance, phash_chunks, phash_lookups  # noqa: E402
+
+
+def create_table(path, photos, seed):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE photo (id INTEGER PRIMARY KEY, phash TEXT, "
+        "phash_0 INTEGER, phash_1 INTEGER, phash_2 INTEGER, phash_3 INTEGER)"
+    )
+    rng = random.Random(seed)
+    batch = []
+    for pk in range(1, photos + 1):
+        value = rng.getrandbits(64)
+        batch.append((pk, f"{value:016x}", *phash_chunks(value)))
+        if len(batch) == 50_000:
+            connection.executemany("INSERT INTO photo VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    connection.executemany("INSERT INTO photo VALUES (?, ?, ?, ?, ?, ?)", batch)
+    for index in range(4):
+        connection.execute(f"CREATE INDEX photo_phash_{index} ON photo (phash_{index})")
+    connection.commit()
+    connection.execute("ANALYZE")
+    return connection
+
+
+def indexed_query(connection, value, distance):
+    """Same lookups as PhotoManager.near_duplicates"""
+    clauses, params = [], []
+    for index, chunks in enumerate(phash_lookups(value, distance)):
+        clauses.append(f"phash_{index} IN ({','.join('?' * len(chunks))})")
+        params += chunks
+    rows = connection.execute(f"SELECT id, phash FROM photo WHERE {' OR '.join(clauses)}", params)
+    return [(pk, d) for pk, phash in rows if (d := hamming_distance(value, int(phash, 16))) <= distance]
+
+
+def full_scan(connection, value, distance):
+    rows = connection.execute("SELECT id, phash FROM photo")
+    return [(pk, d) for pk, phash in rows if (d := hamming_distance(value, int(phash, 16))) <= distance]
+
+
+def near(value, rng, bits):
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--distances", type=int, nargs="+", default=[0, 4, 6, 8, 11])
+    parser.add_argument("--scan-queries", type=int, default=3, help="Queries checked against a full scan")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        connection = create_table(os.path.join(directory, "bench.sqlite3"), args.photos, seed=1)
+        print(f"Loaded {args.photos} hashes in {time.perf_counter() - started:.1f}s")
+
+        rng = random.Random(2)
+        stored = [int(phash, 16) for (phash,) in connection.execute("SELECT phash FROM photo LIMIT 1000")]
+        print(f"{'distance':>8} {'p50 ms':>9} {'p95 ms':>9} {'matches':>7} {'scan ms':>9}")
+        for distance in args.distances:
+            latencies, found = [], []
+            for _ in range(args.queries):
+                # A query near a stored hash, so every query has at least one match
+                value = near(rng.choice(stored), rng, rng.randint(0, distance))
+                elapsed, matches = timed(indexed_query, connection, value, distance)
+                latencies.append(elapsed * 1000)
+                found.append(len(matches))
+                if len(latencies) <= args.scan_queries:
+                    _, expected = timed(full_scan, connection, value, distance)
+                    assert sorted(matches) == sorted(expected), "index missed a match"
+
+            scans = [timed(full_scan, connection, rng.getrandbits(64), distance)[0] * 1000 for _ in range(2)]
+            latencies.sort()
+            print(
+                f"{distance:>8} {statistics.median(latencies):>9.2f} "
+                f"{latencies[int(len(latencies) * 0.95) - 1]:>9.2f} {max(found):>7} {min(scans):>9.0f}"
+            )
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
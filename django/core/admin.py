@@ -0,0 +1,12 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["task", "status", "attempts", "run_at", "updated"]
+    list_filter = ["status", "task"]
+    readonly_fields = ("created", "updated")
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from utils.pagination import CURSOR_PARAM, InvalidCursor, keyset_page
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination, newest first on (created, pk), see utils.pagination
+
+    Orderings asked for through OrderingFilter are paged by keyset too, with pk breaking
+    ties. Responses link to the next and previous pages and have no total count.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    ordering = ("-created", "-pk")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.get_ordering(request, queryset, view)
+        try:
+            self.page = keyset_page(
+                queryset, request.query_params.get(CURSOR_PARAM), self.page_size, ordering, request.query_params
+            )
+        except InvalidCursor:
+            raise NotFound("Invalid page cursor.")
+        return list(self.page)
+
+    def get_ordering(self, request, queryset, view):
+        for backend in getattr(view, "filter_backends", []):
+            if hasattr(backend, "get_ordering"):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return tuple(field for field in ordering if field.lstrip("-") not in ("pk", "id")) + ("-pk",)
+        return self.ordering
+
+    def get_link(self, query):
+        if query is None:
+            return None
+        return self.request.build_absolute_uri(f"{self.request.path}?{query}")
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_link(self.page.next_query)),
+                    ("previous", self.get_link(self.page.previous_query)),
+                    ("results", data),
+                ]
+            )
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
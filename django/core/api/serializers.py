@@ -1,6 +1,17 @@
+import os
+import re
+
+from django.conf import settings
 from django.contrib.auth import get_user_model, password_validation
 from django.db.models import Q
-from gallery.models import Category, Gallery, Photo
+from gallery.models import (
+    Category,
+    Gallery,
+    Photo,
+    Rate,
+    UploadSession,
+    validate_image_decode_size,
+)
 from rest_framework import serializers
 
 User = get_user_model()
@@ -60,7 +71,9 @@ class UserSerializer(serializers.ModelSerializer):
 
 class GallerySerializer(serializers.ModelSerializer):
     title = serializers.CharField(write_only=True)
-    image = serializers.ImageField(max_length=None, allow_empty_file=False, write_only=True)
+    image = serializers.ImageField(
+        max_length=None, allow_empty_file=False, write_only=True, validators=[validate_image_decode_size]
+    )
     is_cover = serializers.BooleanField(default=False, initial=False)
     category = serializers.ChoiceField(choices=Category.CATEGORY_LIST)
     photos = serializers.StringRelatedField(many=True, read_only=True)
@@ -144,12 +157,15 @@ class GallerySerializer(serializers.ModelSerializer):
 class PhotoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Photo
-        exclude = ("slug",)
+        exclude = ("slug", "phash_0", "phash_1", "phash_2", "phash_3")
         read_only_fields = ("views", "created", "pk", "updated", "downloads")
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation["gallery"] = {"id": instance.gallery.id, "name": instance.gallery.name}
+        request = self.context.get("request")
+        if request is None or not instance.location_visible_to(request.user):
+            representation["latitude"] = representation["longitude"] = None
         return representation
 
     def validate_title(self, value):
@@ -169,3 +185,60 @@ class PhotoSerializer(serializers.ModelSerializer):
         gallery, _ = Gallery.objects.get_or_create(name=str(gallery_data))
         photo = Photo.objects.create(title=title_data, image=image_data, gallery=gallery)
         return photo
+
+
+class RateSerializer(serializers.ModelSerializer):
+    like_count = serializers.IntegerField(source="photo.like_count", read_only=True)
+    star_count = serializers.IntegerField(source="photo.star_count", read_only=True)
+
+    class Meta:
+        model = Rate
+        fields = ["photo", "like", "star", "like_count", "star_count"]
+        read_only_fields = ["photo"]
+
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError("Set like, star or both.")
+        return data
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ["id", "gallery", "title", "filename", "size", "sha256", "offset", "expires_at"]
+        read_only_fields = ["id", "offset", "expires_at"]
+
+    def get_fields(self, *args, **kwargs):
+        # Photos can only be uploaded to the user's own galleries
+        fields = super().get_fields(*args, **kwargs)
+        request = self.context.get("request")
+        user = getattr(request, "user", None)
+        if user and user.is_authenticated:
+            fields["gallery"].queryset = Gallery.objects.filter(user=user)
+        else:
+            fields["gallery"].queryset = Gallery.objects.none()
+        return fields
+
+    def validate_title(self, value):
+        if Photo.objects.filter(title__iexact=value).exists():
+            raise serializers.ValidationError("Sorry, that photo title is already taken. Try again")
+        return value
+
+    def validate_filename(self, value):
+        filename = os.path.basename(value.replace("\\", "/"))
+        if not filename:
+            raise serializers.ValidationError("Must be the photo's file name.")
+        return filename
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.PHOTO_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f"Sorry, photos must be smaller than {settings.PHOTO_UPLOAD_MAX_BYTES // (1024 * 1024)}MB."
+            )
+        return value
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if not re.fullmatch(r"[0-9a-f]{64}", value):
+            raise serializers.ValidationError("Must be the file's sha256 digest in hex.")
+        return value
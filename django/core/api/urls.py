@@ -10,6 +10,7 @@ router = routers.DefaultRouter()
 router.register(r"user", views.UserViewSet)
 router.register(r"gallery", views.GalleryViewSet)
 router.register(r"photo", views.PhotoViewSet)
+router.register(r"upload", views.UploadSessionViewSet, basename="upload")
 
 urlpatterns = router.urls
 urlpatterns += [
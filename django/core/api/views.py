@@ -1,14 +1,47 @@
+import re
+from datetime import datetime, time, timedelta
+
 from allauth.account.models import EmailAddress
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db.models import Q
-from gallery.models import Gallery, Photo
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from gallery.models import (
+    DailyViewers,
+    Gallery,
+    Photo,
+    Rate,
+    StatsBucket,
+    UploadSession,
+)
+from rest_framework import mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import AllowAny
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
+from utils.methods import PHASH_MAX_DISTANCE
 
+from .pagination import KeysetPagination
 from .permissions import IsAuthOrStaff, IsOwnerOrReadOnly
-from .serializers import GallerySerializer, PhotoSerializer, UserSerializer
+from .serializers import (
+    GallerySerializer,
+    PhotoSerializer,
+    RateSerializer,
+    UploadSessionSerializer,
+    UserSerializer,
+)
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+# Days of statistics returned by default, and at most, per period
+STATS_DEFAULT_DAYS = {StatsBucket.HOUR: 2, StatsBucket.DAY: 30, StatsBucket.MONTH: 365}
+STATS_MAX_DAYS = {StatsBucket.HOUR: 31, StatsBucket.DAY: 366, StatsBucket.MONTH: 10 * 366}
+# Photos whose rates can be asked for at once, a page of them
+RATES_MAX_PHOTOS = 100
 
 User = get_user_model()
 
@@ -34,6 +67,7 @@ class GalleryViewSet(ModelViewSet):
     queryset = Gallery.objects.all()
     serializer_class = GallerySerializer
     permission_classes = [IsOwnerOrReadOnly, IsAuthOrStaff]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -65,10 +99,85 @@ class GalleryViewSet(ModelViewSet):
     def perform_update(self, serializer):
         return serializer.save(user=self.request.user)
 
+    @action(detail=True, permission_classes=[IsAuthenticated, IsOwnerOrReadOnly])
+    def stats(self, request, pk=None):
+        """Views and downloads of the gallery, or of one of its photos, over time. Owner only
+
+        e.g: ?period=day&start=2021-06-01&end=2021-06-30&photo=12. `start` and `end` are days,
+        both included, the last 30 days by default for a daily series.
+        """
+        gallery = self.get_object()
+        params = request.query_params
+        period = params.get("period", StatsBucket.DAY)
+        if period not in STATS_DEFAULT_DAYS:
+            raise ValidationError({"period": f"Must be one of {', '.join(STATS_DEFAULT_DAYS)}."})
+
+        days = {}
+        for param in ("start", "end"):
+            value = params.get(param)
+            if value is None:
+                continue
+            try:
+                days[param] = parse_date(value)
+            except ValueError:
+                days[param] = None
+            if days[param] is None:
+                raise ValidationError({param: "Must be a date, YYYY-MM-DD."})
+        end = days.get("end", timezone.localdate())
+        start = days.get("start", end - timedelta(days=STATS_DEFAULT_DAYS[period] - 1))
+        if not 0 <= (end - start).days < STATS_MAX_DAYS[period]:
+            raise ValidationError({"end": f"Must be on or after start, and {STATS_MAX_DAYS[period]} days at most."})
+
+        photo = params.get("photo")
+        if photo is not None:
+            if not photo.isdigit() or not gallery.photos.filter(pk=photo).exists():
+                raise ValidationError({"photo": "Must be a photo of the gallery."})
+            photo = int(photo)
+
+        series = StatsBucket.objects.series(
+            period,
+            timezone.make_aware(datetime.combine(start, time.min)),
+            timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+            photo=photo,
+            gallery=gallery,
+        )
+        return Response(
+            {
+                "period": period,
+                "start": start,
+                "end": end,
+                "photo": photo,
+                "series": [
+                    {"start": bucket, "views": views, "downloads": downloads} for bucket, views, downloads in series
+                ],
+                "totals": {
+                    "views": sum(views for _, views, _ in series),
+                    "downloads": sum(downloads for _, _, downloads in series),
+                    "unique_viewers": DailyViewers.objects.unique_viewers(start, end, photo=photo, gallery=gallery),
+                },
+            }
+        )
+
 
 class PhotoViewSet(ModelViewSet):
     queryset = Photo.objects.all()
     serializer_class = PhotoSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["created", "views", "downloads", "width", "height", "file_size", "taken_at"]
+
+    # Query parameter -> stored image metadata lookup. e.g: ?min_width=1920&max_size=5000000
+    METADATA_FILTERS = {
+        "min_width": "width__gte",
+        "max_width": "width__lte",
+        "min_height": "height__gte",
+        "max_height": "height__lte",
+        "min_size": "file_size__gte",
+        "max_size": "file_size__lte",
+        "taken_year": "taken_at__year",
+    }
+    # Query parameter -> EXIF metadata matched exactly. e.g: ?camera_model=iPhone 13
+    EXIF_FILTERS = ["camera_make", "camera_model", "lens_model"]
 
     def get_queryset(self):
         user = self.request.user
@@ -76,8 +185,78 @@ class PhotoViewSet(ModelViewSet):
             # Query Gallery album based on its public status.
             # If the gallery belongs to the logged in, disregard "public" state
             # include his/her private galleries as well.
-            return Photo.objects.filter(Q(gallery__public=True) | Q(gallery__user=user))
-        return Photo.objects.filter(gallery__public=True)
+            qs = Photo.objects.filter(Q(gallery__public=True) | Q(gallery__user=user))
+        else:
+            qs = Photo.objects.filter(gallery__public=True)
+        return self.filter_metadata(qs)
+
+    def filter_metadata(self, qs):
+        """Filter photos by their stored image metadata"""
+        params = self.request.query_params
+        for param, lookup in self.METADATA_FILTERS.items():
+            value = params.get(param)
+            if value is None:
+                continue
+            if not value.isdigit():
+                raise ValidationError({param: "Must be a positive integer."})
+            qs = qs.filter(**{lookup: int(value)})
+
+        content_type = params.get("content_type")
+        if content_type:
+            qs = qs.filter(content_type=content_type)
+        for param in self.EXIF_FILTERS:
+            value = params.get(param)
+            if value:
+                qs = qs.filter(**{param: value})
+        return qs
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        """Near duplicates of a photo, closest first. e.g: ?distance=4"""
+        photo = self.get_object()
+        distance = request.query_params.get("distance", str(settings.PHOTO_SIMILAR_DISTANCE))
+        if not distance.isdigit() or int(distance) > PHASH_MAX_DISTANCE:
+            raise ValidationError({"distance": f"Must be an integer between 0 and {PHASH_MAX_DISTANCE}."})
+
+        matches = photo.near_duplicates(int(distance), qs=self.get_queryset())
+        serializer = self.get_serializer([match for match, _ in matches], many=True)
+        for data, (_, match_distance) in zip(serializer.data, matches):
+            data["distance"] = match_distance
+        return Response(serializer.data)
+
+    @action(detail=True, methods=["put"], permission_classes=[IsAuthenticated])
+    def rate(self, request, pk=None):
+        """Like and, or, star a photo, or take them back. e.g: like=true
+
+        Sets the values sent rather than toggling them, so sending the same request again
+        changes nothing.
+        """
+        photo = self.get_object()
+        serializer = RateSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        rate = Rate.objects.rate(request.user, photo, **serializer.validated_data)
+        photo.refresh_from_db(fields=["like_count", "star_count"])
+        rate.photo = photo
+        return Response(RateSerializer(rate).data)
+
+    @action(detail=False)
+    def rates(self, request):
+        """Whether the user likes and stars each of a list of photos, with their counts. e.g: ?ids=4,8,15
+
+        One query for the whole list. Photos the user can't see are left out.
+        """
+        ids = request.query_params.get("ids", "").split(",")
+        if not all(pk.isdigit() for pk in ids) or len(ids) > RATES_MAX_PHOTOS:
+            raise ValidationError({"ids": f"Must be up to {RATES_MAX_PHOTOS} photo ids separated by commas."})
+
+        photos = Photo.objects.with_rates(request.user, self.get_queryset().filter(pk__in=ids))
+        rows = photos.values_list("pk", "liked", "starred", "like_count", "star_count")
+        return Response(
+            [
+                {"photo": pk, "like": liked, "star": starred, "like_count": likes, "star_count": stars}
+                for pk, liked, starred, likes, stars in rows
+            ]
+        )
 
     def perform_destroy(self, instance):
         instance.delete()
@@ -85,3 +264,62 @@ class PhotoViewSet(ModelViewSet):
         photo_count = instance.gallery.photos.count()
         if photo_count == 0:
             instance.gallery.delete()
+
+
+class UploadSessionViewSet(
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, GenericViewSet
+):
+    """Resumable photo upload in chunks, for large photos and unreliable connections
+
+    1. POST gallery, title, filename, size and sha256 (hex digest of the file) to create a session.
+    2. PUT each chunk as the raw request body with `Content-Range: bytes <first>-<last>/<size>`,
+       starting at the session's offset. Sending a chunk at another offset returns 409 and the
+       offset to resume from, which GET on the session also returns.
+    3. POST to `finalize` once every byte is sent, to create the photo.
+
+    Sessions expire settings.PHOTO_UPLOAD_SESSION_TTL seconds after their last chunk.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user, expires_at__gt=timezone.now())
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def update(self, request, pk=None):
+        """Write a chunk of the file, sent as the raw request body"""
+        session = self.get_object()
+        match = CONTENT_RANGE_RE.match(request.META.get("HTTP_CONTENT_RANGE", ""))
+        if not match:
+            raise ValidationError({"Content-Range": "Must be `bytes <first byte>-<last byte>/<file size>`."})
+        first, last, size = (int(value) for value in match.groups())
+        if size != session.size or first > last or last >= size:
+            raise ValidationError({"Content-Range": f"Must be a range of the {session.size} bytes of the file."})
+        if last - first + 1 > settings.PHOTO_UPLOAD_CHUNK_MAX_BYTES:
+            raise ValidationError(
+                {"Content-Range": f"Chunks must be at most {settings.PHOTO_UPLOAD_CHUNK_MAX_BYTES} bytes."}
+            )
+
+        # Read as a stream, chunks are never parsed or held in memory
+        if not session.write_chunk(first, request.stream, last - first + 1):
+            session.refresh_from_db()
+            return Response(self.get_serializer(session).data, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        """Create the photo once every chunk was received"""
+        session = self.get_object()
+        try:
+            photo = session.finish()
+        except FileNotFoundError:
+            raise ValidationError("The chunks received are missing. Please upload the photo again.")
+        except DjangoValidationError as error:
+            raise ValidationError(error.messages)
+        except UploadSession.DoesNotExist:
+            raise NotFound
+        serializer = PhotoSerializer(photo, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
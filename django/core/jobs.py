@@ -0,0 +1,118 @@
+"""Database backed job queue
+
+Jobs are rows in the `core.Job` table, so the queue works with any database Django
+supports and needs no message broker. Work is registered with the `task` decorator,
+queued with `enqueue` and processed by `python manage.py runworker`.
+
+    @task("gallery.process_photo")
+    def process_photo(photo_id):
+        ...
+
+    enqueue("gallery.process_photo", photo_id=photo.pk)
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+TASKS = {}
+
+
+def task(name):
+    """Register a function as a job task under `name`"""
+
+    def decorator(func):
+        TASKS[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name, run_at=None, max_attempts=None, **payload):
+    """Queue task `name` to be called with **payload by a worker
+
+    Enqueuing inside a transaction makes the job visible to workers only once it commits.
+    """
+    if name not in TASKS:
+        raise KeyError(f"Unknown job task: {name}")
+    return Job.objects.create(
+        task=name,
+        payload=payload,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def claim_job():
+    """Lock the next available job for this worker
+
+    A job is available when it is pending and due, or when its worker stopped
+    responding and the visibility timeout has passed. The lock is a conditional UPDATE,
+    so only one worker can claim a job on both SQLite and PostgreSQL.
+    """
+    now = timezone.now()
+    available = Q(status=Job.PENDING, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+    for job in Job.objects.filter(available).order_by("run_at", "pk")[:10]:
+        if job.status == Job.RUNNING and job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk, attempts=job.attempts, status=Job.RUNNING).update(
+                status=Job.FAILED, locked_until=None, last_error="Visibility timeout expired"
+            )
+            continue
+
+        locked_until = now + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT)
+        claimed = Job.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+            status=Job.RUNNING, locked_until=locked_until, attempts=F("attempts") + 1, updated=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome, rescheduling it on failure
+
+    The outcome is only recorded while this worker still owns the job: once its visibility
+    timeout passed and another worker reclaimed it, that worker records the outcome.
+    """
+    owned = Job.objects.filter(pk=job.pk, attempts=job.attempts, status=Job.RUNNING)
+    try:
+        TASKS[job.task](**job.payload)
+    except Exception:  # noqa: B902 - any task error is recorded on the job
+        outcome = {"last_error": traceback.format_exc(), "locked_until": None, "updated": timezone.now()}
+        if job.attempts < job.max_attempts:
+            # back off exponentially between retries
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            outcome.update(status=Job.PENDING, run_at=timezone.now() + timedelta(seconds=delay))
+        else:
+            outcome.update(status=Job.FAILED)
+        owned.update(**outcome)
+        return False
+
+    owned.update(status=Job.DONE, locked_until=None, updated=timezone.now())
+    return True
+
+
+def run_pending(limit=None):
+    """Process available jobs until the queue is empty or `limit` jobs ran
+
+    Returns the number of jobs processed.
+    """
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
+
+
+def purge_jobs(days):
+    """Delete finished jobs older than `days` days"""
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status=Job.DONE, updated__lt=cutoff).delete()[0]
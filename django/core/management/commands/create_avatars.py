@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Create the small avatar of profile images uploaded before avatars existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recreate existing avatars too")
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(image="").exclude(image__isnull=True)
+        if not options["all"]:
+            users = users.filter(Q(avatar__isnull=True) | Q(avatar=""))
+        created = failed = 0
+        for user in users.only("pk", "image", "avatar").order_by("pk").iterator():
+            try:
+                with user.image.open("rb"):
+                    avatar = user.create_avatar()
+            except OSError:
+                avatar = None
+            if avatar is None:
+                failed += 1
+                self.stderr.write(f"User #{user.pk} failed: unreadable profile image")
+                continue
+            old_avatar = user.avatar.name
+            user.avatar.save(avatar.name, avatar, save=False)
+            User.objects.filter(pk=user.pk).update(avatar=user.avatar.name)
+            if old_avatar:
+                user.avatar.storage.delete(old_avatar)
+            created += 1
+        self.stdout.write(self.style.SUCCESS(f"Created {created} avatars, {failed} failed"))
@@ -0,0 +1,31 @@
+import time
+
+from core.jobs import TASKS, claim_job, purge_jobs, run_job
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    help = "Process background jobs queued in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Worker started, tasks: {', '.join(sorted(TASKS))}")
+        while True:
+            close_old_connections()
+            job = claim_job()
+            if job is None:
+                purge_jobs(settings.JOB_KEEP_DONE_DAYS)
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+
+            started = time.monotonic()
+            succeeded = run_job(job)
+            status = self.style.SUCCESS("done") if succeeded else self.style.ERROR(job.status)
+            self.stdout.write(f"{job.task} #{job.pk} {status} in {time.monotonic() - started:.2f}s")
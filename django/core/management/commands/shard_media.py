@@ -0,0 +1,137 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from gallery.models import Blob, Photo, Rendition
+from users.models import user_image_upload_to
+from utils.methods import format_name, rendition_name
+
+User = get_user_model()
+
+# Names already in the sharded layout, e.g: "gallery/3f/9a/3f9a....jpg"
+SHARDED_RE = r"^[^/]+/[0-9a-f]{2}/[0-9a-f]{2}/"
+
+
+class Command(BaseCommand):
+    help = "Move photos and profile images stored flat in MEDIA_ROOT into sharded directories"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Files moved per batch")
+        parser.add_argument("--pause", type=float, default=0, help="Seconds to wait between batches")
+        parser.add_argument("--only", choices=["photos", "users"], help="Only move photo images or profile images")
+        parser.add_argument("--dry-run", action="store_true", help="Report the files that would be moved")
+
+    def handle(self, *args, **options):
+        """Files are copied to their new name, the row is pointed at it, then the old file is deleted
+
+        Each step is safe to interrupt: moved rows no longer match the flat layout, so running
+        the command again resumes with the remaining files. Old files are only deleted once
+        the transaction pointing rows at the new ones has committed, so every name a page
+        may reference exists throughout the move.
+        """
+        sources = {"photos": (Photo, self.move_photo), "users": (User, self.move_user_image)}
+        for name, (model, move) in sources.items():
+            if options["only"] not in (None, name):
+                continue
+            queryset = model.objects.exclude(image="").exclude(image__isnull=True).exclude(image__regex=SHARDED_RE)
+            moved = failed = 0
+            started = time.monotonic()
+            for batch in self.batches(queryset.only("pk", "image").order_by("pk"), options["batch_size"]):
+                if options["dry_run"]:
+                    moved += len(batch)
+                    continue
+                for obj in batch:
+                    try:
+                        moved += move(obj)
+                    except OSError as error:
+                        failed += 1
+                        self.stderr.write(f"{model._meta.verbose_name.title()} #{obj.pk} failed: {error}")
+                self.stdout.write(f"Moved {name} up to #{batch[-1].pk}")
+                time.sleep(options["pause"])
+
+            prefix = "Dry run: would move" if options["dry_run"] else "Moved"
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f"{prefix} {moved} {name}, {failed} failed, in {elapsed:.1f}s"))
+
+    def batches(self, queryset, size):
+        """Yield rows in primary key order, `size` at a time, without OFFSET scans"""
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def move_photo(self, photo):
+        """Copy a photo's image into content addressed storage along with its renditions"""
+        old_name = photo.image.name
+        with photo.image.open("rb") as original:
+            # Hashed while copied, identical images end up sharing one file
+            new_name = photo.image.storage.save(old_name, original)
+
+        renditions = {}
+        for rendition in Rendition.objects.filter(photo=photo):
+            destination = rendition_name(new_name, rendition.name)
+            storage = rendition.image.storage
+            try:
+                self.copy_file(rendition.image.path, storage.path(destination))
+                for image_format, name in rendition.format_names().items():
+                    self.copy_file(storage.path(name), storage.path(format_name(destination, image_format)))
+            except FileNotFoundError:
+                destination = None
+            renditions[rendition] = destination
+
+        with transaction.atomic():
+            # Skip photos whose image was replaced since they were read
+            if not Photo.objects.filter(pk=photo.pk, image=old_name).update(image=new_name):
+                if not Blob.objects.filter(name=new_name).exists():
+                    self.delete_copies(photo.image.storage, new_name, renditions.values())
+                return False
+            Blob.objects.acquire(new_name)
+            for rendition, destination in renditions.items():
+                if destination is None:
+                    # Broken rendition, the photo falls back to its original until rerendered
+                    rendition.delete()
+                else:
+                    Rendition.objects.filter(pk=rendition.pk).update(image=destination)
+            # Deletes the old image and renditions after commit, once no photo uses them
+            photo.release_image(old_name)
+        return True
+
+    def delete_copies(self, storage, name, renditions):
+        """Delete an image copied to `name` and the rendition copies made for it, in every format"""
+        storage.delete(name)
+        for destination in renditions:
+            if destination is None:
+                continue
+            storage.delete(destination)
+            for image_format in settings.PHOTO_RENDITION_FORMATS:
+                storage.delete(format_name(destination, image_format))
+
+    def move_user_image(self, user):
+        """Copy a profile image to a sharded name, see users.models.user_image_upload_to"""
+        old_name = user.image.name
+        storage = user.image.storage
+        with user.image.open("rb") as original:
+            new_name = storage.save(user_image_upload_to(user, old_name), original)
+
+        with transaction.atomic():
+            if not User.objects.filter(pk=user.pk, image=old_name).update(image=new_name):
+                storage.delete(new_name)
+                return False
+            transaction.on_commit(lambda: storage.delete(old_name))
+        return True
+
+    def copy_file(self, source, destination):
+        """Copy a file unless `destination` exists, never leaving a partial file behind"""
+        if os.path.exists(destination):
+            return
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temp_path = f"{destination}.tmp"
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
@@ -1,5 +1,6 @@
 from django.db import models
 from django.db.models.deletion import DO_NOTHING
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from simple_history import register
 
@@ -32,6 +33,38 @@ class FAQ(models.Model):
         verbose_name_plural = "FAQS"
 
 
+class Job(models.Model):
+    """Background job processed by `manage.py runworker`, see core.jobs"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "pending"),
+        (RUNNING, "running"),
+        (DONE, "done"),
+        (FAILED, "failed"),
+    )
+
+    task = models.CharField(max_length=100, db_index=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now=False, auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True, auto_now_add=False)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_at"])]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+
 # ********************************#
 # ---TRACK CHANGES IN MODELS ---- #
 # ********************************#
@@ -1,6 +1,19 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.http import HttpResponseRedirect
+from django.urls import reverse
 
-from .models import Category, Gallery, Photo, Rate, Tag
+from .models import (
+    Blob,
+    Category,
+    DailyViewers,
+    Gallery,
+    Photo,
+    Rate,
+    Rendition,
+    StatsBucket,
+    Tag,
+    UploadSession,
+)
 
 
 class DateCreatedAdmin(admin.ModelAdmin):
@@ -11,11 +24,56 @@ class DateCreatedAdmin(admin.ModelAdmin):
 
 
 class GalleryAdmin(DateCreatedAdmin):
-    list_display = ["name", "user", "public", "category"]
+    list_display = ["name", "user", "public", "category", "photo_count"]
+    readonly_fields = DateCreatedAdmin.readonly_fields + ("photo_count", "total_views", "total_downloads", "cover")
+
+
+class RenditionInline(admin.TabularInline):
+    model = Rendition
+    extra = 0
+    readonly_fields = ("name", "image", "width", "height")
 
 
 class PhotoAdmin(admin.ModelAdmin):
-    list_display = ["title", "gallery", "is_cover"]
+    list_display = ["title", "gallery", "is_cover", "taken_at"]
+    list_filter = [("taken_at", admin.DateFieldListFilter), "camera_make"]
+    inlines = [RenditionInline]
+    actions = ["find_near_duplicates"]
+
+    @admin.action(description="Find near duplicates of selected photos")
+    def find_near_duplicates(self, request, queryset):
+        duplicates = set()
+        for photo in queryset:
+            duplicates.update(match.pk for match, _ in photo.near_duplicates())
+        if not duplicates:
+            self.message_user(request, "No near duplicates found.", messages.INFO)
+            return None
+        pks = ",".join(str(pk) for pk in sorted(duplicates | {photo.pk for photo in queryset}))
+        return HttpResponseRedirect(f"{reverse('admin:gallery_photo_changelist')}?id__in={pks}")
+
+
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ["name", "ref_count", "created"]
+    readonly_fields = ("name", "ref_count", "created")
+    search_fields = ["name"]
+
+
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ["filename", "user", "gallery", "offset", "size", "expires_at"]
+    readonly_fields = ("user", "gallery", "title", "filename", "size", "sha256", "offset", "expires_at", "created")
+
+
+class DailyViewersAdmin(admin.ModelAdmin):
+    list_display = ["day", "gallery", "photo", "viewers"]
+    list_filter = [("day", admin.DateFieldListFilter)]
+    readonly_fields = ("gallery", "photo", "day", "viewers")
+    exclude = ("sketch",)
+
+
+class StatsBucketAdmin(admin.ModelAdmin):
+    list_display = ["start", "period", "gallery", "photo", "views", "downloads"]
+    list_filter = ["period", ("start", admin.DateFieldListFilter)]
+    readonly_fields = ("gallery", "photo", "period", "start", "views", "downloads")
 
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -28,3 +86,7 @@ admin.site.register(Tag)
 admin.site.register(Rate)
 admin.site.register(Gallery, GalleryAdmin)
 admin.site.register(Photo, PhotoAdmin)
+admin.site.register(Blob, BlobAdmin)
+admin.site.register(UploadSession, UploadSessionAdmin)
+admin.site.register(DailyViewers, DailyViewersAdmin)
+admin.site.register(StatsBucket, StatsBucketAdmin)
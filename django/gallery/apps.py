@@ -7,3 +7,4 @@ class galleryConfig(AppConfig):
 
     def ready(self):
         import gallery.signals  # noqa
+        import gallery.tasks  # noqa
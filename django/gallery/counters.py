@@ -0,0 +1,200 @@
+"""Write-behind photo view counts
+
+Photo pages used to count each view with a full row save of the photo, which lost
+increments under concurrency and ran every Photo post_save receiver. Views are now
+added to a buffer and written to the database in batches:
+
+- a Redis hash, HINCRBY photo pk, when the default cache is django-redis, shared by every
+  process. Views counted while Redis is unreachable go to the in-process buffer instead
+- a Counter in this process's memory otherwise
+
+The Redis buffer is flushed every settings.PHOTO_VIEW_FLUSH_INTERVAL seconds by the
+gallery.flush_view_counts job, never by a page view. Buffers in a process's memory can only
+be flushed by that process: by the first view it counts once the interval has passed
+since its previous flush, or once they hold settings.PHOTO_VIEW_FLUSH_MAX photos.
+A flush is a single transaction of one UPDATE ... SET views = views + n per distinct n,
+for photos, their galleries' totals and trending scores, and the views are added to the
+photos' hourly StatsBucket. Views stay in the buffer, not in Photo.views, for up to the
+flush interval, and views buffered in memory are lost if the process stops before its
+next flush. The flush_view_counts command flushes the Redis buffer and the buffer of the
+process running it.
+
+Distinct viewers of each photo and gallery per day are counted in HyperLogLog sketches
+kept in this process's memory, merged into DailyViewers rows by the same flushes. Viewers
+are identified by viewer_key, and views from user agents matching
+settings.PHOTO_VIEW_BOT_AGENTS are not counted at all, see is_bot.
+
+    if not counters.is_bot(request):
+        counters.count_view(photo.pk, viewer=counters.viewer_key(request))
+    counters.flush()
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+from utils.hyperloglog import HyperLogLog
+from utils.methods import batches
+
+from . import trending
+from .models import DailyViewers, Gallery, Photo, StatsBucket
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:  # Without redis only the in-process buffer is used
+    RedisError = ()
+
+logger = logging.getLogger(__name__)
+
+KEY = "photo-views"
+
+lock = threading.Lock()
+pending = Counter()
+# (photo pk, day) -> HyperLogLog sketch of the photo's viewers that day
+viewers = {}
+last_flush = time.monotonic()
+
+
+def redis_connection():
+    """The default cache's Redis client, or None when the cache is not django-redis"""
+    if not settings.CACHES["default"]["BACKEND"].startswith("django_redis."):
+        return None
+    from django_redis import get_redis_connection
+
+    return get_redis_connection("default")
+
+
+def is_bot(request):
+    """Whether the request comes from a crawler or script, by its user agent"""
+    user_agent = request.META.get("HTTP_USER_AGENT", "")
+    return not user_agent or re.search(settings.PHOTO_VIEW_BOT_AGENTS, user_agent, re.IGNORECASE) is not None
+
+
+def viewer_key(request):
+    """The same key for every request of a viewer: their user, session or, lacking both, a salted hash of their IP"""
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    session_key = getattr(getattr(request, "session", None), "session_key", None)
+    if session_key:
+        return f"session:{session_key}"
+    address = request.META.get("REMOTE_ADDR", "")
+    return "ip:" + hashlib.sha256(f"{settings.SECRET_KEY}:{address}".encode()).hexdigest()
+
+
+def count_view(photo_id, count=1, viewer=None):
+    """Buffer `count` views of a photo by `viewer`, a viewer_key, flushing this process's buffers when due
+
+    A failed flush is logged rather than raised, its views stay buffered.
+    """
+    connection = redis_connection()
+    flush_due = False
+    if connection is not None:
+        try:
+            connection.hincrby(KEY, photo_id, count)
+        except RedisError:
+            connection = None
+
+    with lock:
+        if connection is None:
+            pending[photo_id] += count
+        if viewer is not None:
+            viewers.setdefault((photo_id, timezone.localdate()), HyperLogLog()).add(viewer)
+        if (pending or viewers) and (
+            max(len(pending), len(viewers)) >= settings.PHOTO_VIEW_FLUSH_MAX
+            or time.monotonic() - last_flush >= settings.PHOTO_VIEW_FLUSH_INTERVAL
+        ):
+            flush_due = True
+    if flush_due:
+        try:
+            # The Redis buffer is left to the gallery.flush_view_counts job
+            flush(shared=False)
+        except (DatabaseError, RedisError):
+            # The views are kept for the next flush, the page view itself succeeded
+            logger.exception("Flushing photo view counts failed")
+
+
+def flush(shared=True):
+    """Write the buffered views of this process, and of Redis unless `shared` is False, to the database
+
+    Returns the number of views written.
+    """
+    global pending, viewers, last_flush
+    with lock:
+        counts, pending = pending, Counter()
+        sketches, viewers = viewers, {}
+        last_flush = time.monotonic()
+
+    connection, flushing = redis_connection() if shared else None, None
+    if connection is not None:
+        # Renamed away first, so views counted meanwhile go to a new hash and no other
+        # process flushes these ones too
+        flushing = f"{KEY}:{uuid.uuid4().hex}"
+        try:
+            connection.rename(KEY, flushing)
+            for photo_id, count in connection.hgetall(flushing).items():
+                counts[int(photo_id)] += int(count)
+        except RedisError:
+            # Nothing counted since the last flush, or Redis is unreachable
+            flushing = None
+
+    try:
+        with transaction.atomic():
+            written = write(counts)
+            write_viewers(sketches)
+    except Exception:
+        # Put them back for the next flush
+        with lock:
+            pending.update(counts)
+            for key, sketch in sketches.items():
+                viewers.setdefault(key, HyperLogLog()).merge(sketch)
+        raise
+    if flushing is not None:
+        connection.delete(flushing)
+    return written
+
+
+def write(counts):
+    """Add {photo pk: views} to the photos' views and hourly StatsBucket, and to their galleries' totals and scores
+
+    Queries do not grow with the number of photos and galleries, only with their distinct counts.
+    """
+    if not counts:
+        return 0
+    photo_galleries = dict(Photo.objects.filter(pk__in=counts).values_list("pk", "gallery_id"))
+    galleries = Counter()
+    for photo_id, gallery_id in photo_galleries.items():
+        galleries[gallery_id] += counts[photo_id]
+
+    with transaction.atomic():
+        for count, photo_ids in batches(counts).items():
+            Photo.objects.filter(pk__in=photo_ids).update(views=F("views") + count)
+        for count, gallery_ids in batches(galleries).items():
+            Gallery.objects.filter(pk__in=gallery_ids).update(total_views=F("total_views") + count)
+        trending.record_events("view", galleries)
+        StatsBucket.objects.add(
+            {(photo_id, gallery_id): (counts[photo_id], 0) for photo_id, gallery_id in photo_galleries.items()}
+        )
+    return sum(counts.values())
+
+
+def write_viewers(sketches):
+    """Merge {(photo pk, day): viewers sketch} into the photos' and their galleries' DailyViewers"""
+    photo_galleries = dict(
+        Photo.objects.filter(pk__in={photo_id for photo_id, _ in sketches}).values_list("pk", "gallery_id")
+    )
+    merged = {}
+    for (photo_id, day), sketch in sketches.items():
+        gallery_id = photo_galleries.get(photo_id)
+        if gallery_id is None:
+            # Deleted since
+            continue
+        merged[day, gallery_id, photo_id] = sketch
+        merged.setdefault((day, gallery_id, None), HyperLogLog()).merge(sketch)
+    DailyViewers.objects.merge(merged)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from gallery.models import Photo
+
+METADATA_FIELDS = [
+    "width",
+    "height",
+    "content_type",
+    "file_size",
+    "content_hash",
+    "camera_make",
+    "camera_model",
+    "lens_model",
+    "taken_at",
+    "latitude",
+    "longitude",
+]
+
+
+class Command(BaseCommand):
+    help = "Store image metadata (dimensions, type, size, hash and EXIF) for photos uploaded before it was recorded"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Photos read and updated per batch")
+        parser.add_argument("--all", action="store_true", help="Recompute metadata for photos that already have it")
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.exclude(image="").only("pk", "image", *METADATA_FIELDS).order_by("pk")
+        if not options["all"]:
+            photos = photos.filter(content_hash="")
+
+        updated = failed = last_pk = 0
+        while True:
+            chunk = list(photos.filter(pk__gt=last_pk)[: options["chunk_size"]])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            backfilled = []
+            for photo in chunk:
+                try:
+                    with photo.image.open("rb"):
+                        photo.update_image_metadata()
+                except OSError as error:
+                    failed += 1
+                    self.stderr.write(f"Photo #{photo.pk} failed: {error}")
+                    continue
+                backfilled.append(photo)
+
+            # bulk_update skips save(), so `updated` timestamps and signals are left alone
+            Photo.objects.bulk_update(backfilled, METADATA_FIELDS)
+            updated += len(backfilled)
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} photos, {failed} failed"))
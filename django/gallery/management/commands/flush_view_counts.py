@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from gallery import counters
+
+
+class Command(BaseCommand):
+    help = "Write the photo views buffered in Redis to the database now, see gallery.counters"
+
+    def handle(self, *args, **options):
+        views = counters.flush()
+        self.stdout.write(self.style.SUCCESS(f"Flushed {views} photo views"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from gallery import trending
+
+
+class Command(BaseCommand):
+    help = "Scale stored trending scores down and restart their epoch now, see gallery.trending"
+
+    def handle(self, *args, **options):
+        factor = trending.rebase()
+        self.stdout.write(self.style.SUCCESS(f"Trending scores rebased, scaled by {factor:.6g}"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from gallery.models import Gallery
+
+
+class Command(BaseCommand):
+    help = "Recompute the photo count, view and download totals and cover of every gallery from its photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Galleries updated per UPDATE statement")
+
+    def handle(self, *args, **options):
+        galleries = Gallery.objects.values_list("pk", flat=True).order_by("pk")
+        updated = last_pk = 0
+        while True:
+            chunk = list(galleries.filter(pk__gt=last_pk)[: options["chunk_size"]])
+            if not chunk:
+                break
+            last_pk = chunk[-1]
+            updated += Gallery.objects.recount(Gallery.objects.filter(pk__gte=chunk[0], pk__lte=last_pk))
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted {updated} galleries"))
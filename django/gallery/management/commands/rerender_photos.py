@@ -0,0 +1,119 @@
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from gallery.models import PREVIEW_FIELDS, Photo, Rendition
+from utils.methods import render_photo
+
+
+class Command(BaseCommand):
+    help = "Regenerate every photo's renditions in parallel, e.g after changing settings.PHOTO_RENDITIONS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+        parser.add_argument("--chunk-size", type=int, default=200, help="Photos fetched and processed per batch")
+        parser.add_argument("--checkpoint", help="File recording the last processed photo")
+        parser.add_argument(
+            "--restart", action="store_true", help="Ignore the checkpoint and start from the first photo"
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report the photos that would be processed")
+
+    def handle(self, *args, **options):
+        checkpoint = options["checkpoint"] or os.path.join(settings.MEDIA_ROOT, ".rerender_photos.checkpoint")
+        last_pk = 0 if options["restart"] else self.read_checkpoint(checkpoint)
+        if last_pk:
+            self.stdout.write(f"Resuming after photo #{last_pk}")
+
+        processed = failed = source_bytes = 0
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            for chunk in self.chunks(last_pk, options["chunk_size"]):
+                if options["dry_run"]:
+                    processed += len(chunk)
+                    source_bytes += sum(self.file_size(photo) for photo in chunk)
+                    continue
+
+                # Photos sharing an image file are rendered once, see gallery.storage
+                duplicates = defaultdict(list)
+                for photo in chunk:
+                    duplicates[photo.image.name].append(photo)
+                tasks = [
+                    (
+                        photos[0].pk,
+                        photos[0].image.path,
+                        photos[0].rendition_targets(),
+                        settings.PHOTO_MAX_DECODE_BYTES,
+                        settings.PHOTO_ENCODER_OPTIONS,
+                        settings.PHOTO_RENDITION_FORMATS,
+                    )
+                    for photos in duplicates.values()
+                ]
+                names = {photos[0].pk: name for name, photos in duplicates.items()}
+                results, previewed = {}, []
+                for pk, size, renditions, preview, error in executor.map(render_photo, tasks):
+                    photos = duplicates[names[pk]]
+                    if error:
+                        failed += len(photos)
+                        self.stderr.write(f"Photo #{pk} failed: {error}")
+                        continue
+                    processed += len(photos)
+                    source_bytes += size
+                    for photo in photos:
+                        results[(photo.pk, photo.image.name)] = renditions
+                        photo.set_preview(preview)
+                        previewed.append(photo)
+
+                Rendition.objects.sync(results)
+                Photo.objects.bulk_update(previewed, PREVIEW_FIELDS)
+                self.write_checkpoint(checkpoint, chunk[-1].pk)
+                self.stdout.write(f"Processed up to photo #{chunk[-1].pk}")
+
+        if not options["dry_run"] and os.path.exists(checkpoint):
+            # Finished, the next run starts from the beginning
+            os.remove(checkpoint)
+        self.report(processed, failed, source_bytes, time.monotonic() - started, options["dry_run"])
+
+    def chunks(self, last_pk, size):
+        """Yield photos in primary key order, `size` at a time, without OFFSET scans"""
+        photos = Photo.objects.exclude(image="").only("pk", "image").order_by("pk")
+        while True:
+            chunk = list(photos.filter(pk__gt=last_pk)[:size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1].pk
+
+    def file_size(self, photo):
+        try:
+            return photo.image.size
+        except OSError:
+            return 0
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, pk):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as checkpoint:
+            checkpoint.write(str(pk))
+        os.replace(temp_path, path)
+
+    def report(self, processed, failed, source_bytes, elapsed, dry_run):
+        megabytes = source_bytes / (1024 * 1024)
+        if dry_run:
+            self.stdout.write(f"Dry run: {processed} photos ({megabytes:.1f} MB) would be processed")
+            return
+        elapsed = max(elapsed, 1e-6)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {processed} photos, {failed} failed, in {elapsed:.1f}s "
+                f"({processed / elapsed:.1f} images/sec, {megabytes / elapsed:.2f} MB/sec)"
+            )
+        )
@@ -1,13 +1,440 @@
-from django.db import models
-from django.db.models import Q
+import math
+import random
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    BooleanField,
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce, Greatest, Trunc
+from django.utils import timezone
+from utils.hyperloglog import HyperLogLog
+from utils.methods import (
+    format_name,
+    hamming_distance,
+    phash_lookups,
+    rendition_name,
+    weighted_shuffle,
+)
 
 
 class GalleryManager(models.Manager):
     def query_search(self, query=None, qs=None):
-        qs = qs or self.get_queryset()
+        qs = self.get_queryset() if qs is None else qs
         if query is not None:
             gallery_lookups = (
                 Q(name__icontains=query) | Q(user__username__icontains=query) | Q(category__slug__icontains=query)
             )
             return qs.filter(gallery_lookups).distinct()
         return qs
+
+    def for_cards(self, qs=None):
+        """Galleries with everything gallery/snippets/gallery_cards.html shows of them
+
+        Owner, category and cover are joined, the cover's renditions and the owner's Google
+        account, for its avatar, are prefetched: 3 queries whatever the number of galleries.
+        """
+        qs = self.get_queryset() if qs is None else qs
+        google_accounts = apps.get_model("socialaccount", "SocialAccount").objects.filter(provider="google")
+        return qs.select_related("user", "category", "cover").prefetch_related(
+            "cover__renditions",
+            Prefetch("user__socialaccount_set", queryset=google_accounts, to_attr="google_accounts"),
+        )
+
+    def count_photos(self, gallery_id, photos=0, views=0, downloads=0):
+        """Add to a gallery's photo_count, total_views and total_downloads, negative counts subtract"""
+        counts = {"photo_count": photos, "total_views": views, "total_downloads": downloads}
+        changes = {field: Greatest(F(field) + count, 0) for field, count in counts.items() if count}
+        if changes:
+            self.filter(pk=gallery_id).update(**changes)
+
+    def recount(self, qs=None):
+        """Recompute the photo counters and cover of the galleries in `qs` from their photos
+
+        One UPDATE for any number of galleries. Returns the number of galleries updated.
+        """
+        photos = apps.get_model("gallery", "Photo").objects.filter(gallery=OuterRef("pk")).order_by()
+        totals = photos.values("gallery")
+        qs = self.get_queryset() if qs is None else qs
+        return qs.update(
+            photo_count=Coalesce(Subquery(totals.annotate(total=Count("pk")).values("total")), 0),
+            total_views=Coalesce(Subquery(totals.annotate(total=Sum("views")).values("total")), 0),
+            total_downloads=Coalesce(Subquery(totals.annotate(total=Sum("downloads")).values("total")), 0),
+            cover=Subquery(photos.filter(is_cover=True).order_by("pk").values("pk")[:1]),
+        )
+
+
+class GalleryFeedManager(models.Manager):
+    def build(self, variants, keep=2, scale=1.0, rng=random):
+        """Materialise a new feed of every public gallery, in `variants` weighted shuffles
+
+        Trending galleries tend to come first, see utils.methods.weighted_shuffle. Stored trending
+        scores are multiplied by `scale`, see gallery.trending.decay_factor. The `keep` newest feeds
+        are kept, so sessions paging through the previous one can finish.
+        """
+        galleries = list(
+            apps.get_model("gallery", "Gallery").objects.filter(public=True).values_list("pk", "trending_score")
+        )
+        weights = [1 + math.log1p(score * scale) for _, score in galleries]
+        with transaction.atomic():
+            feed = self.create(size=len(galleries), variants=variants)
+            entries = []
+            for variant in range(variants):
+                for position, (pk, _) in enumerate(weighted_shuffle(galleries, weights, rng)):
+                    entries.append(feed.entries.model(feed=feed, variant=variant, position=position, gallery_id=pk))
+            feed.entries.model.objects.bulk_create(entries, batch_size=1000)
+            self.filter(pk__in=list(self.order_by("-pk").values_list("pk", flat=True)[keep:])).delete()
+        return feed
+
+
+class PhotoManager(models.Manager):
+    def count_rates(self, photo_id, likes=0, stars=0):
+        """Add to a photo's like_count and star_count, negative counts subtract"""
+        counts = {"like_count": likes, "star_count": stars}
+        changes = {field: Greatest(F(field) + count, 0) for field, count in counts.items() if count}
+        if changes:
+            self.filter(pk=photo_id).update(**changes)
+
+    def recount_rates(self, qs=None):
+        """Recompute the like_count and star_count of the photos in `qs` from their Rate rows
+
+        One UPDATE for any number of photos. Returns the number of photos updated.
+        """
+        rates = apps.get_model("gallery", "Rate").objects.filter(photo=OuterRef("pk")).order_by().values("photo")
+        qs = self.get_queryset() if qs is None else qs
+        return qs.update(
+            like_count=Coalesce(Subquery(rates.filter(like=True).annotate(total=Count("pk")).values("total")), 0),
+            star_count=Coalesce(Subquery(rates.filter(star=True).annotate(total=Count("pk")).values("total")), 0),
+        )
+
+    def with_rates(self, user, qs=None):
+        """Photos annotated with whether `user` likes and stars them, `liked` and `starred`, in the same query"""
+        qs = self.get_queryset() if qs is None else qs
+        if not user.is_authenticated:
+            return qs.annotate(liked=Value(False, BooleanField()), starred=Value(False, BooleanField()))
+        rates = apps.get_model("gallery", "Rate").objects.filter(photo=OuterRef("pk"), user=user)
+        return qs.annotate(liked=Exists(rates.filter(like=True)), starred=Exists(rates.filter(star=True)))
+
+    def near_duplicates(self, phash, distance, qs=None):
+        """Photos whose perceptual hash is within `distance` bits of `phash`
+
+        Candidates sharing a close enough chunk are fetched through the phash_N indexes,
+        see utils.methods.phash_lookups, then checked against the full hash.
+
+        Returns:
+            list: (photo, distance) tuples, closest first
+        """
+        qs = self.get_queryset() if qs is None else qs
+        value = int(phash, 16)
+        lookups = Q()
+        for index, chunks in enumerate(phash_lookups(value, distance)):
+            lookups |= Q(**{f"phash_{index}__in": chunks})
+
+        matches = []
+        for photo in qs.filter(lookups):
+            photo_distance = hamming_distance(value, int(photo.phash, 16))
+            if photo_distance <= distance:
+                matches.append((photo, photo_distance))
+        return sorted(matches, key=lambda match: (match[1], match[0].pk))
+
+
+class RenditionManager(models.Manager):
+    def sync(self, renditions):
+        """Create or update rendition rows in bulk from `save_renditions` results
+
+        Renditions no longer listed in settings.PHOTO_RENDITIONS are removed.
+
+        Args:
+            renditions (dict): (photo pk, original image name) -> save_renditions results
+        """
+        photo_ids = [photo_id for photo_id, _ in renditions]
+        existing = {
+            (rendition.photo_id, rendition.name): rendition for rendition in self.filter(photo_id__in=photo_ids)
+        }
+        created, updated, obsolete_files = [], [], []
+        for (photo_id, image_name), results in renditions.items():
+            for label, (width, height, _, formats) in results.items():
+                name = rendition_name(image_name, label)
+                formats = ",".join(formats)
+                rendition = existing.pop((photo_id, label), None)
+                if rendition is None:
+                    created.append(
+                        self.model(
+                            photo_id=photo_id, name=label, image=name, width=width, height=height, formats=formats
+                        )
+                    )
+                    continue
+                if rendition.image.name != name:
+                    obsolete_files.append(rendition.image.name)
+                rendition.image, rendition.width, rendition.height, rendition.formats = name, width, height, formats
+                updated.append(rendition)
+
+        obsolete_files += [rendition.image.name for rendition in existing.values()]
+        with transaction.atomic():
+            self.bulk_create(created)
+            self.bulk_update(updated, ["image", "width", "height", "formats"])
+            self.filter(pk__in=[rendition.pk for rendition in existing.values()]).delete()
+        self.delete_unused_files(obsolete_files)
+
+    def copy_from_duplicate(self, photo):
+        """Give `photo` the renditions and preview metadata of an already processed photo with the same content
+
+        Returns False when no other photo with the same content has every rendition yet.
+        """
+        if not photo.content_hash:
+            return False
+        copies, source = {}, None
+        renditions = (
+            self.filter(photo__content_hash=photo.content_hash)
+            .exclude(photo=photo)
+            .exclude(photo__phash="")
+            .select_related("photo")
+        )
+        for rendition in renditions:
+            source = rendition.photo
+            copies.setdefault(
+                rendition.name,
+                self.model(
+                    photo=photo,
+                    name=rendition.name,
+                    image=rendition.image.name,
+                    width=rendition.width,
+                    height=rendition.height,
+                    formats=rendition.formats,
+                ),
+            )
+        if not copies or set(copies) != set(settings.PHOTO_RENDITIONS):
+            return False
+        self.bulk_create(copies.values())
+        photo.save_preview(source.preview())
+        return True
+
+    def delete_unused_files(self, names):
+        """Delete rendition files, and their other formats, no rendition references anymore
+
+        Duplicate photos share rendition files.
+        """
+        used = set(self.filter(image__in=names).values_list("image", flat=True))
+        storage = self.model._meta.get_field("image").storage
+        for name in set(names) - used:
+            storage.delete(name)
+            for image_format in settings.PHOTO_RENDITION_FORMATS:
+                storage.delete(format_name(name, image_format))
+
+
+class BlobManager(models.Manager):
+    def acquire(self, name):
+        """Count one more reference to the stored file `name`
+
+        Waits for a deletion of the file in progress, see delete_unused, so the caller can
+        then check the file is still stored.
+        """
+        with transaction.atomic():
+            if self.filter(name=name).update(ref_count=F("ref_count") + 1):
+                return
+            try:
+                with transaction.atomic():
+                    self.create(name=name, ref_count=1)
+            except IntegrityError:
+                # Created by another upload meanwhile
+                self.filter(name=name).update(ref_count=F("ref_count") + 1)
+
+    def release(self, name):
+        """Count one reference less to the stored file `name`
+
+        Returns True when it was the last reference, the file is then unused and can be
+        deleted with delete_unused. Files without a blob row are never reported unused.
+        """
+        with transaction.atomic():
+            self.filter(name=name, ref_count__gt=0).update(ref_count=F("ref_count") - 1)
+            return self.filter(name=name, ref_count=0).exists()
+
+    def delete_unused(self, name, delete_files):
+        """Call `delete_files` and forget `name` if it is still unreferenced
+
+        The blob row stays locked while the files are deleted, so an upload of the same
+        content acquiring it meanwhile waits and stores the file again, see Photo.store_image.
+        Returns whether the files were deleted.
+        """
+        with transaction.atomic():
+            blob = self.select_for_update().filter(name=name, ref_count=0).first()
+            if blob is None:
+                # Referenced again since
+                return False
+            delete_files()
+            blob.delete()
+            return True
+
+
+class RateManager(models.Manager):
+    def rate(self, user, photo, **values):
+        """Set `like` and, or, `star` of a user's Rate of a photo, creating it if needed
+
+        Idempotent, setting the values a rate already has changes nothing, so requests can
+        be retried. The photo's counters follow on save, see gallery.signals.
+
+        Returns:
+            Rate: the user's rate of the photo
+        """
+        rates = self.filter(user=user, photo=photo)
+        with transaction.atomic():
+            rate = rates.select_for_update().first()
+            if rate is None:
+                try:
+                    with transaction.atomic():
+                        return self.create(user=user, photo=photo, **values)
+                except IntegrityError:
+                    # Created by another request meanwhile
+                    rate = rates.select_for_update().get()
+            changed = [field for field, value in values.items() if getattr(rate, field) != value]
+            if changed:
+                for field in changed:
+                    setattr(rate, field, values[field])
+                rate.save(update_fields=changed)
+            return rate
+
+
+class DailyViewersManager(models.Manager):
+    def merge(self, sketches):
+        """Add {(day, gallery pk, photo pk): HyperLogLog sketch} to the viewers of photos' days, of galleries' when photo pk is None
+
+        Missing rows are created empty, skipping those created meanwhile, then every row is
+        locked, merged in Python and written back: 3 queries whatever the number of sketches.
+        """
+        if not sketches:
+            return
+        with transaction.atomic():
+            self.bulk_create(
+                [
+                    self.model(day=day, gallery_id=gallery_id, photo_id=photo_id)
+                    for day, gallery_id, photo_id in sketches
+                ],
+                ignore_conflicts=True,
+            )
+            # Also locks the other photos of these galleries on these days, rather than one OR per row
+            days, gallery_ids = {key[0] for key in sketches}, {key[1] for key in sketches}
+            rows = self.select_for_update().filter(day__in=days, gallery_id__in=gallery_ids).order_by("pk")
+            merged = []
+            for row in rows:
+                sketch = sketches.get((row.day, row.gallery_id, row.photo_id))
+                if sketch is not None:
+                    sketch = row.get_sketch().merge(sketch)
+                    row.sketch, row.viewers = sketch.to_bytes(), sketch.count()
+                    merged.append(row)
+            self.bulk_update(merged, ["sketch", "viewers"])
+
+    def unique_viewers(self, start, end, photo=None, gallery=None):
+        """Estimated distinct viewers of a photo, or of a gallery's photos, from day `start` to `end` included"""
+        rows = self.filter(day__range=(start, end))
+        rows = rows.filter(photo=photo) if photo is not None else rows.filter(gallery=gallery, photo=None)
+        sketch = HyperLogLog()
+        for data in rows.values_list("sketch", flat=True):
+            sketch.merge(HyperLogLog.from_bytes(data))
+        return sketch.count()
+
+
+class StatsBucketManager(models.Manager):
+    def add(self, counts, when=None):
+        """Count {(photo pk, gallery pk): (views, downloads)} in the hour of `when`, now by default
+
+        Counts are added to the photos' buckets and, summed, to their galleries' buckets.
+        """
+        start = (when or timezone.now()).replace(minute=0, second=0, microsecond=0)
+        buckets = {}
+        for (photo_id, gallery_id), (views, downloads) in counts.items():
+            buckets[photo_id, gallery_id, start] = (views, downloads)
+            gallery_views, gallery_downloads = buckets.get((None, gallery_id, start), (0, 0))
+            buckets[None, gallery_id, start] = (gallery_views + views, gallery_downloads + downloads)
+        self.add_to_buckets(self.model.HOUR, buckets)
+
+    def add_to_buckets(self, period, counts):
+        """Add {(photo pk or None, gallery pk, bucket start): (views, downloads)} to `period` buckets
+
+        Missing buckets are created empty, skipping those created meanwhile, then counted by
+        one UPDATE per distinct start and counts, with F() so concurrent additions add up.
+        """
+        if not counts:
+            return
+        batches = defaultdict(lambda: ([], []))
+        for (photo_id, gallery_id, start), (views, downloads) in counts.items():
+            photo_ids, gallery_ids = batches[start, views, downloads]
+            if photo_id is None:
+                gallery_ids.append(gallery_id)
+            else:
+                photo_ids.append(photo_id)
+
+        with transaction.atomic():
+            self.bulk_create(
+                [
+                    self.model(photo_id=photo_id, gallery_id=gallery_id, period=period, start=start)
+                    for photo_id, gallery_id, start in counts
+                ],
+                ignore_conflicts=True,
+            )
+            for (start, views, downloads), (photo_ids, gallery_ids) in batches.items():
+                buckets = self.filter(period=period, start=start)
+                counted = {"views": F("views") + views, "downloads": F("downloads") + downloads}
+                if photo_ids:
+                    buckets.filter(photo_id__in=photo_ids).update(**counted)
+                if gallery_ids:
+                    buckets.filter(photo=None, gallery_id__in=gallery_ids).update(**counted)
+
+    def downsample(self, period, coarser, before):
+        """Sum the `period` buckets starting before `before` into `coarser` buckets and delete them
+
+        Returns the number of buckets deleted.
+        """
+        buckets = self.filter(period=period, start__lt=before)
+        totals = (
+            buckets.annotate(bucket=Trunc("start", coarser))
+            .values("photo_id", "gallery_id", "bucket")
+            .annotate(total_views=Sum("views"), total_downloads=Sum("downloads"))
+            .order_by()
+        )
+        with transaction.atomic():
+            self.add_to_buckets(
+                coarser,
+                {
+                    (row["photo_id"], row["gallery_id"], row["bucket"]): (row["total_views"], row["total_downloads"])
+                    for row in totals
+                },
+            )
+            return buckets.delete()[0]
+
+    def series(self, period, start, end, photo=None, gallery=None):
+        """Views and downloads of a photo, or of a gallery, per `period` from `start` to `end` excluded
+
+        Buckets of `period` are read along with the finer ones not downsampled yet, one query
+        each. Coarser buckets can't be split, so a series only reaches back as far as the
+        retention of its period's buckets.
+
+        Returns:
+            list: (bucket start, views, downloads) of buckets with any, oldest first
+        """
+        periods = [value for value, _ in self.model.PERIODS]
+        rows = self.filter(start__gte=start, start__lt=end)
+        rows = rows.filter(photo=photo) if photo is not None else rows.filter(gallery=gallery, photo=None)
+        totals = defaultdict(lambda: (0, 0))
+        for stored in periods[: periods.index(period) + 1]:
+            buckets = (
+                rows.filter(period=stored)
+                .annotate(bucket=Trunc("start", period))
+                .values_list("bucket")
+                .annotate(total_views=Sum("views"), total_downloads=Sum("downloads"))
+                .order_by()
+            )
+            for bucket, views, downloads in buckets:
+                bucket_views, bucket_downloads = totals[bucket]
+                totals[bucket] = (bucket_views + views, bucket_downloads + downloads)
+        return [(bucket, views, downloads) for bucket, (views, downloads) in sorted(totals.items())]
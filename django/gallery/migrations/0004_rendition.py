@@ -0,0 +1,34 @@
+# Generated by Django 3.2 on 2026-10-18 19:06
+
+import django.db.models.deletion
+import gallery.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0003_alter_category_id_alter_gallery_id_alter_photo_id_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Rendition",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=20)),
+                ("image", models.ImageField(upload_to=gallery.models.rendition_upload_to)),
+                ("width", models.PositiveIntegerField(default=0)),
+                ("height", models.PositiveIntegerField(default=0)),
+                (
+                    "photo",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="renditions", to="gallery.photo"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("photo", "name")},
+            },
+        ),
+    ]
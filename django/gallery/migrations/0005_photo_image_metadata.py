@@ -0,0 +1,38 @@
+# Generated by Django 3.2 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0004_rendition"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="content_type",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="file_size",
+            field=models.PositiveBigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
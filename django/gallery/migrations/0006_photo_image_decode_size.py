@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 19:12
+
+import gallery.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0005_photo_image_metadata"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="photo",
+            name="image",
+            field=models.ImageField(upload_to="gallery", validators=[gallery.models.validate_image_decode_size]),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2 on 2026-10-18 19:17
+
+import gallery.models
+import gallery.storage
+from django.db import migrations, models
+
+
+def count_photo_images(apps, schema_editor):
+    """Create a blob for every image file photos already use"""
+    Blob = apps.get_model("gallery", "Blob")
+    Photo = apps.get_model("gallery", "Photo")
+    images = Photo.objects.exclude(image="").values("image").annotate(ref_count=models.Count("pk")).order_by()
+    Blob.objects.bulk_create(
+        (Blob(name=image["image"], ref_count=image["ref_count"]) for image in images.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0006_photo_image_decode_size"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="photo",
+            name="image",
+            field=models.ImageField(
+                storage=gallery.storage.ContentAddressedStorage(),
+                upload_to="gallery",
+                validators=[gallery.models.validate_image_decode_size],
+            ),
+        ),
+        migrations.RunPython(count_photo_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0007_photo_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="phash",
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="phash_0",
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="phash_1",
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="phash_2",
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="phash_3",
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0008_photo_perceptual_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="blurhash",
+            field=models.CharField(blank=True, editable=False, max_length=60),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="dominant_color",
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+    ]
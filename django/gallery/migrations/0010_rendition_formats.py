@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0009_photo_placeholders"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rendition",
+            name="formats",
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0010_rendition_formats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="camera_make",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="camera_model",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="latitude",
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="lens_model",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="longitude",
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="taken_at",
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2 on 2026-10-18 19:55
+
+import uuid
+
+import django.core.validators
+import django.db.models.deletion
+import gallery.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("gallery", "0011_photo_exif_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadSession",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ("title", models.CharField(max_length=80, validators=[django.core.validators.MinLengthValidator(3)])),
+                ("filename", models.CharField(max_length=255)),
+                ("size", models.PositiveBigIntegerField()),
+                ("sha256", models.CharField(max_length=64)),
+                ("offset", models.PositiveBigIntegerField(default=0)),
+                ("expires_at", models.DateTimeField(db_index=True, default=gallery.models.upload_session_expiry)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "gallery",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="upload_sessions",
+                        to="gallery.gallery",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="upload_sessions",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2 on 2026-10-18 20:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0012_uploadsession"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GalleryFeed",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("size", models.PositiveIntegerField(default=0)),
+                ("variants", models.PositiveSmallIntegerField(default=1)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="FeedEntry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("variant", models.PositiveSmallIntegerField()),
+                ("position", models.PositiveIntegerField()),
+                (
+                    "feed",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="entries", to="gallery.galleryfeed"
+                    ),
+                ),
+                (
+                    "gallery",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="feed_entries", to="gallery.gallery"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Feed entries",
+                "unique_together": {("feed", "variant", "position")},
+            },
+        ),
+    ]
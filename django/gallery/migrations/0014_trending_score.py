@@ -0,0 +1,50 @@
+# Generated by Django 3.2 on 2026-10-18 20:03
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+
+def seed_trending_scores(apps, schema_editor):
+    """Start scores from all time photo views and downloads, as if they all happened when the epoch starts"""
+    TrendingEpoch = apps.get_model("gallery", "TrendingEpoch")
+    Gallery = apps.get_model("gallery", "Gallery")
+    Category = apps.get_model("gallery", "Category")
+    TrendingEpoch.objects.create()
+    # TRENDING_WEIGHTS when this migration was written, later settings must not change what it does
+    score = Coalesce(Sum("photos__views") * 1 + Sum("photos__downloads") * 3, 0)
+    for gallery in Gallery.objects.annotate(score=score).values("pk", "score").iterator():
+        Gallery.objects.filter(pk=gallery["pk"]).update(trending_score=gallery["score"])
+    for category in Category.objects.annotate(score=Coalesce(Sum("gallery__trending_score"), 0.0)).values(
+        "pk", "score"
+    ):
+        Category.objects.filter(pk=category["pk"]).update(trending_score=category["score"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0013_gallery_feed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingEpoch",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("started", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="trending_score",
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="gallery",
+            name="trending_score",
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(seed_trending_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2 on 2026-10-18 20:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_gallery_photos(apps, schema_editor):
+    """Same as GalleryManager.recount, historical models have no custom managers"""
+    Gallery = apps.get_model("gallery", "Gallery")
+    Photo = apps.get_model("gallery", "Photo")
+    photos = Photo.objects.filter(gallery=OuterRef("pk")).order_by()
+    totals = photos.values("gallery")
+    Gallery.objects.update(
+        photo_count=Coalesce(Subquery(totals.annotate(total=Count("pk")).values("total")), 0),
+        total_views=Coalesce(Subquery(totals.annotate(total=Sum("views")).values("total")), 0),
+        total_downloads=Coalesce(Subquery(totals.annotate(total=Sum("downloads")).values("total")), 0),
+        cover=Subquery(photos.filter(is_cover=True).order_by("pk").values("pk")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0014_trending_score"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gallery",
+            name="cover",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="gallery.photo",
+            ),
+        ),
+        migrations.AddField(
+            model_name="gallery",
+            name="photo_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="gallery",
+            name="total_downloads",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="gallery",
+            name="total_views",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_gallery_photos, migrations.RunPython.noop),
+    ]
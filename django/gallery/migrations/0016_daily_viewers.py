@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 20:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0015_gallery_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyViewers",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField(db_index=True)),
+                ("sketch", models.BinaryField(default=bytes)),
+                ("viewers", models.PositiveIntegerField(default=0)),
+                (
+                    "gallery",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="daily_viewers", to="gallery.gallery"
+                    ),
+                ),
+                (
+                    "photo",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_viewers",
+                        to="gallery.photo",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Daily viewers",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="dailyviewers",
+            constraint=models.UniqueConstraint(fields=("photo", "day"), name="unique_photo_daily_viewers"),
+        ),
+        migrations.AddConstraint(
+            model_name="dailyviewers",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(photo=None), fields=("gallery", "day"), name="unique_gallery_daily_viewers"
+            ),
+        ),
+    ]
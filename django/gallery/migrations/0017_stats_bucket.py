@@ -0,0 +1,59 @@
+# Generated by Django 3.2 on 2026-10-18 20:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0016_daily_viewers"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatsBucket",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "period",
+                    models.CharField(choices=[("hour", "Hour"), ("day", "Day"), ("month", "Month")], max_length=5),
+                ),
+                ("start", models.DateTimeField()),
+                ("views", models.PositiveIntegerField(default=0)),
+                ("downloads", models.PositiveIntegerField(default=0)),
+                (
+                    "gallery",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="stats", to="gallery.gallery"
+                    ),
+                ),
+                (
+                    "photo",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stats",
+                        to="gallery.photo",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="statsbucket",
+            index=models.Index(fields=["period", "start"], name="gallery_sta_period_1b709d_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="statsbucket",
+            constraint=models.UniqueConstraint(fields=("photo", "period", "start"), name="unique_photo_stats_bucket"),
+        ),
+        migrations.AddConstraint(
+            model_name="statsbucket",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(photo=None),
+                fields=("gallery", "period", "start"),
+                name="unique_gallery_stats_bucket",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2 on 2026-10-18 20:38
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicate_rates(apps, schema_editor):
+    """Keep one rate per user and photo, liked or starred if any of theirs was"""
+    Rate = apps.get_model("gallery", "Rate")
+    duplicates = (
+        Rate.objects.values("user", "photo")
+        .annotate(
+            rates=Count("pk"),
+            first=Min("pk"),
+            likes=Count("pk", filter=Q(like=True)),
+            stars=Count("pk", filter=Q(star=True)),
+        )
+        .filter(rates__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates:
+        Rate.objects.filter(pk=duplicate["first"]).update(like=duplicate["likes"] > 0, star=duplicate["stars"] > 0)
+        Rate.objects.filter(user=duplicate["user"], photo=duplicate["photo"]).exclude(pk=duplicate["first"]).delete()
+
+
+def count_photo_rates(apps, schema_editor):
+    """Same as PhotoManager.recount_rates, historical models have no custom managers"""
+    Photo = apps.get_model("gallery", "Photo")
+    Rate = apps.get_model("gallery", "Rate")
+    rates = Rate.objects.filter(photo=OuterRef("pk")).order_by().values("photo")
+    Photo.objects.update(
+        like_count=Coalesce(Subquery(rates.filter(like=True).annotate(total=Count("pk")).values("total")), 0),
+        star_count=Coalesce(Subquery(rates.filter(star=True).annotate(total=Count("pk")).values("total")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0017_stats_bucket"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="star_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(merge_duplicate_rates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="rate",
+            constraint=models.UniqueConstraint(fields=("user", "photo"), name="unique_user_photo_rate"),
+        ),
+        migrations.RunPython(count_photo_rates, migrations.RunPython.noop),
+    ]
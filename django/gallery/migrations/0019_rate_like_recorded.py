@@ -0,0 +1,25 @@
+# Generated by Django 3.2 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+def mark_recorded_likes(apps, schema_editor):
+    """Current likes were counted towards trending scores already"""
+    Rate = apps.get_model("gallery", "Rate")
+    Rate.objects.filter(like=True).update(like_recorded=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0018_rate_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rate",
+            name="like_recorded",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_recorded_likes, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.db.models import QuerySet
+from django.http import Http404
 from django.shortcuts import redirect
+from utils.pagination import CURSOR_PARAM, InvalidCursor, keyset_page, offset_page
 
 from .forms import GalleryForm, GalleryFormSet
 from .models import Gallery, Photo
@@ -20,6 +23,27 @@ class UserAccessPermissionMixin(PermissionRequiredMixin):
         return obj.public or user == obj.user
 
 
+class CursorPaginationMixin:
+    """Paginate a list view by cursor instead of page number, see utils.pagination
+
+    Querysets are paged by keyset on `cursor_ordering`, other sequences by position.
+    Templates get `page_obj` with next_query and previous_query, there is no page count.
+    """
+
+    cursor_ordering = ("-created", "-pk")
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(CURSOR_PARAM)
+        try:
+            if isinstance(queryset, QuerySet):
+                page = keyset_page(queryset, cursor, page_size, self.cursor_ordering, params=self.request.GET)
+            else:
+                page = offset_page(queryset, cursor, page_size, params=self.request.GET)
+        except InvalidCursor:
+            raise Http404("Invalid page cursor")
+        return None, page, page.object_list, page.has_other_pages()
+
+
 class GalleryFormMixin(LoginRequiredMixin):
     """Mixin handles Gallery Create and Update View"""
 
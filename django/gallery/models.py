@@ -1,20 +1,74 @@
+import hashlib
+import os
 import re
+import uuid
+from datetime import timedelta
 
+from core.jobs import enqueue
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files import File
 from django.core.validators import MinLengthValidator
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
 from django.templatetags.static import static
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import slugify
+from django_cleanup import cleanup
 from PIL import Image
 from rest_framework.reverse import reverse as api_reverse
-
-from .managers import GalleryManager
+from utils.hyperloglog import HyperLogLog
+from utils.methods import (
+    CHUNK_SIZE,
+    decoded_size,
+    format_name,
+    image_metadata,
+    phash_chunks,
+    preview_metadata,
+    rendition_name,
+    save_renditions,
+)
+
+from .managers import (
+    BlobManager,
+    DailyViewersManager,
+    GalleryFeedManager,
+    GalleryManager,
+    PhotoManager,
+    RateManager,
+    RenditionManager,
+    StatsBucketManager,
+)
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
+# Photo fields holding the perceptual hash, see Photo.set_perceptual_hash
+PHASH_FIELDS = ["phash", "phash_0", "phash_1", "phash_2", "phash_3"]
+# Photo fields computed from a small rendition, see Photo.set_preview
+PREVIEW_FIELDS = PHASH_FIELDS + ["blurhash", "dominant_color"]
+
+
+def validate_image_decode_size(image):
+    """Reject uploads needing more than settings.PHOTO_MAX_DECODE_BYTES to decode
+
+    Only the image header is read, stored images are not checked again.
+    """
+    if getattr(image, "_committed", False):
+        return
+    try:
+        image.seek(0)
+        with Image.open(image) as header:
+            size = decoded_size(header)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError("Upload a valid image. The file you uploaded was not an image or is corrupted.")
+    finally:
+        image.seek(0)
+    if size > settings.PHOTO_MAX_DECODE_BYTES:
+        raise ValidationError("Sorry, this image's resolution is too large. Please upload a smaller image.")
+
 
 class Category(models.Model):
 
@@ -88,6 +142,8 @@ class Category(models.Model):
     name = models.IntegerField(choices=CATEGORY_LIST, default=0, unique=True, db_index=True)
     label = models.CharField(max_length=80, choices=CATEGORY_LABEL, default="bgc-black text-white")
     slug = models.SlugField(blank=False, editable=False, db_index=True)
+    # Time decayed photo views, downloads and likes of the category's galleries, see gallery.trending
+    trending_score = models.FloatField(default=0, editable=False, db_index=True)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -138,8 +194,20 @@ class Gallery(models.Model):
     slug = models.SlugField(editable=False, db_index=True)
     created = models.DateTimeField(auto_now=False, auto_now_add=True, db_index=True)
     updated = models.DateTimeField(auto_now=True, auto_now_add=False)
+    # Time decayed views, downloads and likes of the gallery's photos, see gallery.trending
+    trending_score = models.FloatField(default=0, editable=False, db_index=True)
+    # Totals of the gallery's photos and its cover, kept as photos are saved and deleted so
+    # gallery cards render without querying photos. See gallery.signals and GalleryManager.recount
+    photo_count = models.PositiveIntegerField(default=0, editable=False)
+    total_views = models.PositiveBigIntegerField(default=0, editable=False)
+    total_downloads = models.PositiveBigIntegerField(default=0, editable=False)
+    cover = models.ForeignKey(
+        "Photo", related_name="+", null=True, blank=True, editable=False, on_delete=models.SET_NULL
+    )
 
     REQUIRED_FIELDS = ["name"]
+    # Only ever written by queryset updates, saving a loaded gallery must not overwrite them
+    DERIVED_FIELDS = ["trending_score", "photo_count", "total_views", "total_downloads", "cover"]
 
     class Meta:
         ordering = ["-created"]
@@ -148,13 +216,26 @@ class Gallery(models.Model):
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
+    def get_cover(self):
+        """The gallery's cover Photo, or None"""
+        cover = self.cover
+        if cover is not None:
+            # Its renditions' urls depend on this gallery, see Rendition.get_absolute_url
+            cover.gallery = self
+        return cover
+
     def cover_photo(self):
-        if self.photos:
-            cover = self.photos.filter(is_cover=True)
-            if cover.exists():
-                return cover.first().image.url
+        cover = self.get_cover()
+        if cover is not None:
+            return cover.rendition_url("card")
         return static("assets/defaults/default_image.jpg")
 
     def get_absolute_url(self):
@@ -166,6 +247,9 @@ class Gallery(models.Model):
     def get_delete_url(self):
         return reverse("gallery:gallery-delete", kwargs={"slug": self.slug})
 
+    def get_download_url(self):
+        return reverse("gallery:gallery-download", kwargs={"pk": self.pk})
+
     def get_api_url(self, request=None):
         return api_reverse("api:gallery-detail", kwargs={"pk": self.pk}, request=request)
 
@@ -173,9 +257,68 @@ class Gallery(models.Model):
         return self.name
 
 
+class TrendingEpoch(models.Model):
+    """Time trending scores are stored relative to, moved forward by gallery.trending.rebase"""
+
+    started = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Trending scores since {self.started:%Y-%m-%d %H:%M}"
+
+
+class GalleryFeed(models.Model):
+    """Public galleries in shuffled order, rebuilt every settings.GALLERY_FEED_INTERVAL seconds
+
+    Each feed holds `variants` shuffles of the same galleries. A browsing session pages
+    through one of them, so its pages are stable while sessions see different orders.
+    See gallery.views.GalleryListView
+    """
+
+    objects = GalleryFeedManager()
+    size = models.PositiveIntegerField(default=0)
+    variants = models.PositiveSmallIntegerField(default=1)
+    created = models.DateTimeField(auto_now=False, auto_now_add=True)
+
+    def __str__(self):
+        return f"Gallery feed #{self.pk} ({self.size} galleries)"
+
+
+class FeedEntry(models.Model):
+    """Gallery at `position` of one of a feed's shuffles"""
+
+    feed = models.ForeignKey(GalleryFeed, related_name="entries", on_delete=models.CASCADE)
+    variant = models.PositiveSmallIntegerField()
+    position = models.PositiveIntegerField()
+    gallery = models.ForeignKey(Gallery, related_name="feed_entries", on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ["feed", "variant", "position"]
+        verbose_name_plural = "Feed entries"
+
+
+class Blob(models.Model):
+    """Reference count of a stored image file shared by photos with identical content
+
+    See gallery.storage.ContentAddressedStorage
+    """
+
+    objects = BlobManager()
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
+# Image files are shared between photos, Blob deletes them once unused instead of django_cleanup
+@cleanup.ignore
 class Photo(models.Model):
+    objects = PhotoManager()
     title = models.CharField(max_length=80, validators=[MinLengthValidator(3)])
-    image = models.ImageField(upload_to="gallery")
+    image = models.ImageField(
+        upload_to="gallery", storage=ContentAddressedStorage(), validators=[validate_image_decode_size]
+    )
     gallery = models.ForeignKey(
         Gallery,
         related_name="photos",
@@ -186,17 +329,125 @@ class Photo(models.Model):
     is_cover = models.BooleanField(default=False)
     views = models.PositiveIntegerField(default=0)
     downloads = models.PositiveIntegerField(default=0)
+    # Likes and stars of the photo's Rate rows, kept by gallery.signals
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    star_count = models.PositiveIntegerField(default=0, editable=False)
     tags = models.ManyToManyField(Tag, blank=True)
     created = models.DateTimeField(auto_now=False, auto_now_add=True, db_index=True)
     updated = models.DateTimeField(auto_now=True, auto_now_add=False)
     slug = models.SlugField(blank=False, editable=False, db_index=True)
 
+    # Image metadata, read once when the image is uploaded. See update_image_metadata
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    content_type = models.CharField(max_length=50, blank=True, editable=False, db_index=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False, db_index=True)
+
+    # Capture metadata from the image's EXIF, read with the rest of the image metadata.
+    # Latitude and longitude are only shown to the owner, see location_visible_to
+    camera_make = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
+    camera_model = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
+    lens_model = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
+    taken_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    latitude = models.FloatField(null=True, blank=True, editable=False, db_index=True)
+    longitude = models.FloatField(null=True, blank=True, editable=False, db_index=True)
+
+    # Perceptual hash (64 bit dHash) as hex, and split in 16 bit chunks indexed for
+    # near duplicate searches. See PhotoManager.near_duplicates
+    phash = models.CharField(max_length=16, blank=True, editable=False)
+    phash_0 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    phash_1 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    phash_2 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    phash_3 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+
+    # Placeholders shown while the image loads: a BlurHash and the most common colour as "#rrggbb"
+    blurhash = models.CharField(max_length=60, blank=True, editable=False)
+    dominant_color = models.CharField(max_length=7, blank=True, editable=False)
+
+    # Only ever written by queryset updates, saving a loaded photo must not overwrite them
+    DERIVED_FIELDS = ["views", "downloads", "like_count", "star_count"]
+
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+            ]
+        # Along with the gallery counters and cover updated on post_save, see gallery.signals
+        with transaction.atomic():
+            if not self.image:
+                return super().save(*args, **kwargs)
+
+            previous = Photo.objects.filter(pk=self.pk).values_list("image", flat=True).first() if self.pk else None
+            if not self.image._committed:
+                self.store_image()
+            elif previous and previous != self.image.name:
+                # Set to another stored file, which is read like an upload
+                Blob.objects.acquire(self.image.name)
+                with self.image.open("rb"):
+                    self.update_image_metadata()
+            else:
+                # Saving a photo with the same image never opens its file
+                return super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
+            if previous and previous != self.image.name:
+                # Its renditions are replaced on post_save, see gallery.signals.process_new_photo
+                self.release_image(previous)
+
+    def store_image(self):
+        """Write a new upload to storage, or reference the stored copy of identical content"""
+        content = self.image.file
+        self.image.save(self.image.name, content, save=False)
+        Blob.objects.acquire(self.image.name)
+        if not self.image.storage.exists(self.image.name):
+            # Found stored, then deleted as unused before the reference above was counted
+            content.seek(0)
+            self.image.storage.save(self.image.name, content)
+        with self.image.open("rb"):
+            self.update_image_metadata()
+
+    def process_image(self):
+        """Reuse the renditions of an already processed duplicate of the image, or queue its post-processing"""
+        if not Rendition.objects.copy_from_duplicate(self):
+            enqueue("gallery.process_photo", photo_id=self.pk)
+
+    def release_image(self, name):
+        """Drop this photo's reference to a stored image, deleting it and its renditions if it was the last"""
+        if not Blob.objects.release(name):
+            return
+        storage = self._meta.get_field("image").storage
+
+        def delete_files():
+            storage.delete(name)
+            for label in settings.PHOTO_RENDITIONS:
+                storage.delete(rendition_name(name, label))
+                for image_format in settings.PHOTO_RENDITION_FORMATS:
+                    storage.delete(format_name(rendition_name(name, label), image_format))
+
+        # Unless the same content is uploaded again meanwhile
+        transaction.on_commit(lambda: Blob.objects.delete_unused(name, delete_files))
+
+    def update_image_metadata(self):
+        """Store the image's dimensions, type, size, hash and EXIF capture metadata on the photo"""
+        content_hash = getattr(self.image.storage, "digest", lambda name: None)(self.image.name)
+        metadata = image_metadata(self.image, content_hash)
+        if metadata["taken_at"] and timezone.is_naive(metadata["taken_at"]):
+            # No UTC offset recorded, the camera's clock is taken to be in the site's timezone
+            metadata["taken_at"] = timezone.make_aware(metadata["taken_at"])
+        for field, value in metadata.items():
+            setattr(self, field, value)
+
+    def location_visible_to(self, user):
+        """Whether `user` may see where the photo was taken, see settings.PHOTO_PUBLIC_LOCATION"""
+        if self.latitude is None:
+            return False
+        return settings.PHOTO_PUBLIC_LOCATION or (user.is_authenticated and self.gallery.user_id == user.pk)
 
     def get_absolute_url(self):
         return reverse("gallery:photo-detail", kwargs={"slug": self.slug})
@@ -207,6 +458,13 @@ class Photo(models.Model):
     def get_delete_url(self):
         return reverse("gallery:photo-delete", kwargs={"slug": self.slug})
 
+    def get_download_url(self):
+        return reverse("gallery:photo-download", kwargs={"pk": self.pk})
+
+    def get_thumbnail_url(self, width, height):
+        """Url of this photo scaled on demand to one of settings.PHOTO_THUMBNAIL_SIZES"""
+        return reverse("photo-thumbnail", kwargs={"width": width, "height": height, "pk": self.pk})
+
     def get_download_title(self):
         """Creates filename for download from photo title"""
         user = self.gallery.user
@@ -214,25 +472,305 @@ class Photo(models.Model):
         photo = re.sub(" ", "_", str(self))
         return f"{app_name}_{photo}_by_{user}.jpg"
 
+    def rendition_targets(self):
+        """Map each rendition in settings.PHOTO_RENDITIONS to its size and file path"""
+        storage = self.image.storage
+        return {
+            label: (size, storage.path(rendition_name(self.image.name, label)))
+            for label, size in settings.PHOTO_RENDITIONS.items()
+        }
+
+    def create_renditions(self):
+        """Generate every rendition in settings.PHOTO_RENDITIONS, then the perceptual hash and placeholders"""
+        targets = self.rendition_targets()
+        results = save_renditions(
+            self.image.path,
+            targets,
+            settings.PHOTO_MAX_DECODE_BYTES,
+            settings.PHOTO_ENCODER_OPTIONS,
+            settings.PHOTO_RENDITION_FORMATS,
+        )
+        Rendition.objects.sync({(self.pk, self.image.name): results})
+        self.save_preview(preview_metadata(targets))
+
+    def set_perceptual_hash(self, value):
+        """Set a 64 bit perceptual hash as hex and as its indexed chunks"""
+        self.phash = f"{value:016x}"
+        self.phash_0, self.phash_1, self.phash_2, self.phash_3 = phash_chunks(value)
+
+    def preview(self):
+        """This photo's stored preview metadata, as returned by utils.methods.preview_metadata"""
+        return {"dhash": int(self.phash, 16), "blurhash": self.blurhash, "dominant_color": self.dominant_color}
+
+    def set_preview(self, metadata):
+        """Set the perceptual hash and placeholders from utils.methods.preview_metadata"""
+        self.set_perceptual_hash(metadata["dhash"])
+        self.blurhash = metadata["blurhash"]
+        self.dominant_color = metadata["dominant_color"]
+
+    def save_preview(self, metadata):
+        """Set and store preview metadata without saving, or signalling, the rest of the photo"""
+        self.set_preview(metadata)
+        Photo.objects.filter(pk=self.pk).update(**{field: getattr(self, field) for field in PREVIEW_FIELDS})
+
+    def near_duplicates(self, distance=None, qs=None):
+        """Other photos within `distance` bits of this photo's perceptual hash, closest first"""
+        if not self.phash:
+            return []
+        qs = Photo.objects.all() if qs is None else qs
+        distance = settings.PHOTO_SIMILAR_DISTANCE if distance is None else distance
+        return Photo.objects.near_duplicates(self.phash, distance, qs=qs.exclude(pk=self.pk))
+
+    def rendition_url(self, label):
+        """Return the url of a rendition, falling back to the original image"""
+        # Iterating over .all() uses the prefetch cache when renditions are prefetched
+        for rendition in self.renditions.all():
+            if rendition.name == label:
+                return rendition.get_absolute_url()
+        return self.image.url
+
     def mime_type(self):
-        image = Image.open(self.image.path)
-        return image.get_format_mimetype() or "unknown"
+        return self.content_type or "unknown"
 
     def dimension(self):
-        return f"{self.image.height} X {self.image.width}"
+        if self.width is None or self.height is None:
+            return "unknown"
+        return f"{self.height} X {self.width}"
 
     def total_likes(self):
-        return self.rate_set.like.filter(like=True).count()
+        return self.like_count
 
     def total_stars(self):
-        return self.rate_set.like.filter(star=True).count()
+        return self.star_count
+
+
+def rendition_upload_to(instance, filename):
+    """Store renditions in the same directory as their original photo"""
+    return os.path.join(os.path.dirname(instance.photo.image.name), filename)
+
+
+# Photos with the same image share rendition files, see RenditionManager.delete_unused_files
+@cleanup.ignore
+class Rendition(models.Model):
+    """Scaled copy of a photo, see settings.PHOTO_RENDITIONS"""
+
+    objects = RenditionManager()
+    photo = models.ForeignKey(Photo, related_name="renditions", on_delete=models.CASCADE)
+    name = models.CharField(max_length=20)
+    image = models.ImageField(upload_to=rendition_upload_to)
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField(default=0)
+    # Comma separated Pillow formats the rendition is also stored in, see utils.methods.format_name
+    formats = models.CharField(max_length=50, blank=True)
+
+    class Meta:
+        unique_together = ["photo", "name"]
+
+    def get_absolute_url(self):
+        """Url of the rendition, in the best format the browser accepts
+
+        Renditions of public galleries are files served by the front proxy, which picks the
+        format from the Accept header, see nginx/. Those of private galleries are served by
+        gallery.views.photo_rendition, which checks the viewer. Reads the photo's gallery:
+        join it when listing photos.
+        """
+        if self.photo.gallery.public:
+            return self.image.url
+        return self.get_view_url()
+
+    def get_view_url(self):
+        """Url serving the rendition through django, see gallery.views.photo_rendition
+
+        The version parameter changes with the image, so responses can be cached for long.
+        """
+        url = reverse("photo-rendition", kwargs={"label": self.name, "pk": self.photo_id})
+        return f"{url}?v={hashlib.sha1(self.image.name.encode()).hexdigest()[:10]}"
+
+    def format_names(self):
+        """Pillow format -> file name of each other format the rendition is stored in, most preferred first"""
+        return {
+            image_format: format_name(self.image.name, image_format)
+            for image_format in self.formats.split(",")
+            if image_format
+        }
+
+    def __str__(self):
+        return f"{self.photo.title} - {self.name} ({self.width} X {self.height})"
+
+
+def upload_session_expiry():
+    return timezone.now() + timedelta(seconds=settings.PHOTO_UPLOAD_SESSION_TTL)
+
+
+class UploadSession(models.Model):
+    """Photo uploaded through the API in chunks, see core.api.views.UploadSessionViewSet
+
+    Chunks are written at their offset in a temporary file in settings.PHOTO_UPLOAD_TEMP_DIR,
+    so an interrupted upload resumes from the last byte received. Sessions without a new
+    chunk for settings.PHOTO_UPLOAD_SESSION_TTL seconds are deleted by the
+    gallery.expire_upload_session job.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name="upload_sessions", on_delete=models.CASCADE)
+    gallery = models.ForeignKey(Gallery, related_name="upload_sessions", on_delete=models.CASCADE)
+    title = models.CharField(max_length=80, validators=[MinLengthValidator(3)])
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    # Bytes received so far, the offset of the next chunk
+    offset = models.PositiveBigIntegerField(default=0)
+    expires_at = models.DateTimeField(default=upload_session_expiry, db_index=True)
+    created = models.DateTimeField(auto_now=False, auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size} bytes)"
+
+    @property
+    def path(self):
+        return os.path.join(settings.PHOTO_UPLOAD_TEMP_DIR, f"{self.pk.hex}.part")
+
+    def write_chunk(self, start, stream, length):
+        """Write `length` bytes read from `stream` at byte `start` of the upload
+
+        Nothing is written unless `start` is the current offset. Bytes read before the
+        client disconnects are kept, the client resumes from the offset after them.
+
+        Returns:
+            bool: whether the chunk was written
+        """
+        if start != self.offset:
+            return False
+        os.makedirs(settings.PHOTO_UPLOAD_TEMP_DIR, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+        received = 0
+        with os.fdopen(fd, "wb") as file:
+            file.seek(start)
+            while received < length:
+                chunk = stream.read(min(CHUNK_SIZE, length - received))
+                if not chunk:
+                    break
+                file.write(chunk)
+                received += len(chunk)
+
+        # Conditional update, a chunk sent twice at once only moves the offset once
+        expires_at = upload_session_expiry()
+        updated = UploadSession.objects.filter(pk=self.pk, offset=start).update(
+            offset=start + received, expires_at=expires_at
+        )
+        if updated:
+            self.offset, self.expires_at = start + received, expires_at
+        return bool(updated)
+
+    def finish(self):
+        """Create the photo from the complete upload and delete the session
+
+        The file is checked against the sha256 digest given when the session was created,
+        then saved like an image uploaded in a single request. A corrupted upload restarts
+        from the first byte.
+
+        Raises:
+            ValidationError: the upload is incomplete, corrupted or not a valid image
+        """
+        if self.offset != self.size:
+            raise ValidationError(f"The upload is incomplete, {self.offset} of {self.size} bytes were received.")
+        with open(self.path, "rb") as file:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+            if digest.hexdigest() != self.sha256:
+                UploadSession.objects.filter(pk=self.pk).update(offset=0)
+                self.offset = 0
+                raise ValidationError("The uploaded file does not match its sha256 digest. Please upload it again.")
+
+            image = File(file, name=self.filename)
+            validate_image_decode_size(image)
+            with transaction.atomic():
+                # Only one of concurrent requests finishing the upload creates the photo
+                if not UploadSession.objects.filter(pk=self.pk).delete()[0]:
+                    raise UploadSession.DoesNotExist
+                return Photo.objects.create(title=self.title, gallery=self.gallery, image=image)
 
 
 class Rate(models.Model):
+    """A user's like and star of a photo, one per user and photo. See RateManager.rate"""
+
+    objects = RateManager()
     like = models.BooleanField(default=False)
     star = models.BooleanField(default=False)
+    # Set by the first like, which alone counts towards trending scores, see gallery.signals.record_like
+    like_recorded = models.BooleanField(default=False, editable=False)
     photo = models.ForeignKey(Photo, on_delete=models.CASCADE)
     user = models.ForeignKey(User, blank=True, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "photo"], name="unique_user_photo_rate")]
+
     def __str__(self):
         return f"{self.user} {self.photo.title} - Like: {int(self.like)} Star: {int(self.star)}"
+
+
+class DailyViewers(models.Model):
+    """Distinct viewers of a photo on a day, or of any of a gallery's photos when `photo` is None
+
+    Viewers are counted in `sketch`, a utils.hyperloglog sketch, as gallery.counters flushes
+    views, and `viewers` is its estimate. Sketches of several days merge into the distinct
+    viewers of the whole range, see DailyViewersManager.unique_viewers
+    """
+
+    objects = DailyViewersManager()
+    gallery = models.ForeignKey(Gallery, related_name="daily_viewers", on_delete=models.CASCADE)
+    photo = models.ForeignKey(Photo, related_name="daily_viewers", null=True, blank=True, on_delete=models.CASCADE)
+    day = models.DateField(db_index=True)
+    sketch = models.BinaryField(default=bytes)
+    viewers = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["photo", "day"], name="unique_photo_daily_viewers"),
+            models.UniqueConstraint(
+                fields=["gallery", "day"], condition=Q(photo=None), name="unique_gallery_daily_viewers"
+            ),
+        ]
+        verbose_name_plural = "Daily viewers"
+
+    def get_sketch(self):
+        return HyperLogLog.from_bytes(self.sketch) if self.sketch else HyperLogLog()
+
+    def __str__(self):
+        return f"{self.photo or self.gallery} on {self.day}: {self.viewers} viewers"
+
+
+class StatsBucket(models.Model):
+    """Views and downloads of a photo in an hour, day or month, or of any of a gallery's photos when `photo` is None
+
+    Counts are added to hourly buckets as they happen, gallery.tasks.downsample_stats sums
+    hourly buckets into daily ones after settings.STATS_HOUR_RETENTION and daily ones into
+    monthly ones after settings.STATS_DAY_RETENTION. Statistics are read from these rows
+    alone, see StatsBucketManager.series
+    """
+
+    HOUR, DAY, MONTH = "hour", "day", "month"
+    # Finest first
+    PERIODS = [(HOUR, "Hour"), (DAY, "Day"), (MONTH, "Month")]
+
+    objects = StatsBucketManager()
+    # The photo's gallery when counted, gallery rows outlive the photos they counted
+    gallery = models.ForeignKey(Gallery, related_name="stats", on_delete=models.CASCADE)
+    photo = models.ForeignKey(Photo, related_name="stats", null=True, blank=True, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=PERIODS)
+    start = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    downloads = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["photo", "period", "start"], name="unique_photo_stats_bucket"),
+            models.UniqueConstraint(
+                fields=["gallery", "period", "start"], condition=Q(photo=None), name="unique_gallery_stats_bucket"
+            ),
+        ]
+        indexes = [models.Index(fields=["period", "start"])]
+
+    def __str__(self):
+        return f"{self.photo or self.gallery} {self.period} of {self.start:%Y-%m-%d %H:%M}"
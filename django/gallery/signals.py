@@ -1,14 +1,84 @@
-from django.db.models.signals import post_save
+import os
+
+from core.jobs import enqueue
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from utils.methods import resizeScale
 
-from .models import Photo
+from . import trending
+from .models import Gallery, Photo, Rate, UploadSession
+
+# Photo fields the gallery counters are kept from
+COUNTED_FIELDS = ("gallery_id", "views", "downloads")
+# Rate fields the photo counters are kept from
+RATED_FIELDS = ("photo_id", "like", "star")
 
 
 @receiver(post_save, sender=Photo)
-def resizePhoto(sender, created, instance, **kwargs):
-    if created and instance.image:
-        resizeScale(instance.image)
+def process_new_photo(sender, created, instance, raw=False, **kwargs):
+    """Queue image post-processing so the upload request does not wait on it
+
+    Also when the photo's image changed, the renditions of the previous image are deleted.
+    Duplicates of an already processed image reuse its renditions instead.
+    """
+    previous = instance.__dict__.pop("_image_name", None)
+    if raw or not instance.image:
+        return
+    if not created:
+        if previous is None or previous == instance.image.name:
+            return
+        instance.renditions.all().delete()
+    instance.process_image()
+
+
+@receiver(post_delete, sender=Photo)
+def release_photo_image(sender, instance, **kwargs):
+    """Delete the image file once no photo uses it anymore"""
+    if instance.image:
+        instance.release_image(instance.image.name)
+
+
+@receiver(pre_save, sender=Photo)
+def load_counted_fields(sender, instance, raw=False, **kwargs):
+    """Remember what the gallery counters hold, and the image, for a photo about to be updated"""
+    if instance.pk and not raw:
+        instance._counted = Photo.objects.filter(pk=instance.pk).values(*COUNTED_FIELDS, "image").first()
+        if instance._counted is not None:
+            instance._image_name = instance._counted.pop("image")
+
+
+@receiver(post_save, sender=Photo)
+def update_gallery_counters(sender, created, instance, raw=False, **kwargs):
+    """Count the photo, or the change in its views and downloads, in its gallery's totals
+
+    A photo transferred to another gallery is taken out of the old gallery's totals.
+    """
+    if raw:
+        # Loaded fixtures, recount from what is loaded so far
+        Gallery.objects.recount(Gallery.objects.filter(pk=instance.gallery_id))
+        return
+    previous = instance.__dict__.pop("_counted", None)
+    if previous is None:
+        Gallery.objects.count_photos(instance.gallery_id, 1, instance.views, instance.downloads)
+        return
+    # Views and downloads are only written when asked for, see Photo.DERIVED_FIELDS
+    update_fields = kwargs.get("update_fields") or ()
+    views = instance.views if "views" in update_fields else previous["views"]
+    downloads = instance.downloads if "downloads" in update_fields else previous["downloads"]
+    if previous["gallery_id"] != instance.gallery_id:
+        Gallery.objects.count_photos(previous["gallery_id"], -1, -previous["views"], -previous["downloads"])
+        Gallery.objects.filter(pk=previous["gallery_id"], cover=instance.pk).update(cover=None)
+        Gallery.objects.count_photos(instance.gallery_id, 1, views, downloads)
+    else:
+        Gallery.objects.count_photos(
+            instance.gallery_id, 0, views - previous["views"], downloads - previous["downloads"]
+        )
+
+
+@receiver(post_delete, sender=Photo)
+def uncount_photo(sender, instance, **kwargs):
+    """Take a deleted photo out of its gallery's totals, the cover is unset by on_delete"""
+    Gallery.objects.count_photos(instance.gallery_id, -1, -instance.views, -instance.downloads)
 
 
 @receiver(post_save, sender=Photo)
@@ -17,11 +87,76 @@ def set_gallery_cover(sender, created, instance, **kwargs):
     photos = instance.gallery.photos
     if created and photos.count() == 1:
         # Save first and only photo as the gallery album cover
-        photo = photos.first()
         instance.is_cover = True
-        instance.save()
+        photos.filter(pk=instance.pk).update(is_cover=True)
     elif instance.is_cover:
-        photos = photos.filter(is_cover=True).exclude(pk=instance.id)
-        for photo in photos:
-            photo.is_cover = False
-            photo.save()
+        photos.filter(is_cover=True).exclude(pk=instance.pk).update(is_cover=False)
+
+    gallery = Gallery.objects.filter(pk=instance.gallery_id)
+    if instance.is_cover:
+        gallery.update(cover=instance)
+    else:
+        gallery.filter(cover=instance).update(cover=None)
+
+
+@receiver(post_save, sender=UploadSession)
+def schedule_upload_session_expiry(sender, created, instance, raw=False, **kwargs):
+    """Delete the upload session once it expires, unless it is finished first"""
+    if created and not raw:
+        enqueue("gallery.expire_upload_session", run_at=instance.expires_at, session_id=str(instance.pk))
+
+
+@receiver(post_delete, sender=UploadSession)
+def delete_upload_file(sender, instance, **kwargs):
+    """Delete the chunks received for a finished, cancelled or expired upload"""
+    path = instance.path
+
+    def delete_file():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    transaction.on_commit(delete_file)
+
+
+@receiver(pre_save, sender=Rate)
+def load_rated_fields(sender, instance, raw=False, **kwargs):
+    """Remember what the photo counters hold for a rate about to be updated"""
+    if instance.pk and not raw:
+        instance._rated = Rate.objects.filter(pk=instance.pk).values(*RATED_FIELDS).first()
+
+
+@receiver(post_save, sender=Rate)
+def update_rate_counters(sender, created, instance, raw=False, **kwargs):
+    """Count the rate, or the change in its like and star, in its photo's like_count and star_count"""
+    if raw:
+        Photo.objects.recount_rates(Photo.objects.filter(pk=instance.photo_id))
+        return
+    previous = instance.__dict__.pop("_rated", None)
+    if previous is not None and previous["photo_id"] != instance.photo_id:
+        Photo.objects.count_rates(previous["photo_id"], -previous["like"], -previous["star"])
+        previous = None
+    if previous is None:
+        previous = {"like": False, "star": False}
+    Photo.objects.count_rates(instance.photo_id, instance.like - previous["like"], instance.star - previous["star"])
+
+
+@receiver(post_delete, sender=Rate)
+def uncount_rate(sender, instance, **kwargs):
+    """Take a deleted rate out of its photo's like_count and star_count"""
+    Photo.objects.count_rates(instance.photo_id, -instance.like, -instance.star)
+
+
+@receiver(post_save, sender=Rate)
+def record_like(sender, created, instance, raw=False, **kwargs):
+    """Count the first like of each rate towards the photo's gallery trending score
+
+    Liking again after unliking adds nothing, so toggling the like cannot inflate the score.
+    """
+    if raw or not instance.like or instance.like_recorded:
+        return
+    # Conditional, so concurrent saves of the rate record its like once
+    if Rate.objects.filter(pk=instance.pk, like_recorded=False).update(like_recorded=True):
+        trending.record_event(instance.photo.gallery_id, "like")
+    instance.like_recorded = True
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from PIL import Image
+from utils.methods import shard_name
+
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+# Extension of stored images by the format detected in their content
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "MPO": ".jpg",
+    "PNG": ".png",
+    "GIF": ".gif",
+    "WEBP": ".webp",
+    "AVIF": ".avif",
+    "BMP": ".bmp",
+    "TIFF": ".tif",
+}
+# Spellings of the same extension, for files no image format is detected in
+EXTENSION_ALIASES = {".jpeg": ".jpg", ".jpe": ".jpg", ".tiff": ".tif"}
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage keeping a single copy of each distinct file
+
+    Files are hashed while they are written and stored under their sha256 digest,
+    e.g. "gallery/photo.jpg" is saved as "gallery/ab/cd/abcd...ef.jpg". Saving content
+    that is already stored returns the existing name without writing a second copy,
+    so several photos can share one file. See gallery.models.Blob for how shared files
+    are reference counted and deleted. The extension comes from the image format of the
+    content, not from the uploaded name, so the same bytes uploaded as "a.JPG" and
+    "b.jpeg" are stored once.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name depends on the content, it is only known once hashed in _save
+        return name
+
+    def digest_name(self, name, digest, extension=None):
+        """Build the name content with `digest` is stored under, in `name`'s directory
+
+        `extension` defaults to `name`'s, lower-cased and with one spelling per format.
+        """
+        directory, filename = os.path.split(name)
+        if extension is None:
+            extension = os.path.splitext(filename)[1].lower()
+            extension = EXTENSION_ALIASES.get(extension, extension)
+        return shard_name(directory.replace("\\", "/"), digest, extension)
+
+    def content_extension(self, path):
+        """Extension of the image format of the file at `path`, None when it is not a known image"""
+        try:
+            with Image.open(path) as image:
+                return FORMAT_EXTENSIONS.get(image.format)
+        except (OSError, Image.DecompressionBombError):
+            return None
+
+    def digest(self, name):
+        """Return the sha256 digest of a stored file from its name, None for files saved by another storage"""
+        digest = os.path.splitext(os.path.basename(name))[0]
+        return digest if DIGEST_RE.fullmatch(digest) else None
+
+    def _save(self, name, content):
+        directory = self.path(os.path.dirname(name))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}")
+
+        digest = hashlib.sha256()
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            name = self.digest_name(name, digest.hexdigest(), self.content_extension(temp_path))
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # Identical content is already stored
+                os.remove(temp_path)
+                return name
+
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            # Atomic, concurrent uploads of the same content both end up with a complete file
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from core.jobs import enqueue, task
+from core.models import Job
+from django.conf import settings
+from django.utils import timezone
+
+from . import counters, trending
+from .models import GalleryFeed, Photo, StatsBucket, UploadSession
+
+
+@task("gallery.process_photo")
+def process_photo(photo_id):
+    """Post-process an uploaded photo outside of the upload request"""
+    photo = Photo.objects.filter(pk=photo_id).first()
+    # Photo may have been deleted before a worker got to it
+    if photo is None or not photo.image:
+        return
+    photo.create_renditions()
+
+
+@task("gallery.expire_upload_session")
+def expire_upload_session(session_id):
+    """Delete an upload session and its chunks once no chunk was received for its time to live"""
+    session = UploadSession.objects.filter(pk=session_id).first()
+    # Finished or cancelled since
+    if session is None:
+        return
+    if session.expires_at > timezone.now():
+        # Chunks received since extended it, check again when it expires
+        enqueue("gallery.expire_upload_session", run_at=session.expires_at, session_id=session_id)
+        return
+    session.delete()
+
+
+@task("gallery.build_gallery_feed")
+def build_gallery_feed():
+    """Rebuild the shuffled gallery feed, then schedule the next rebuild
+
+    Trending scores are rebased first once their epoch is settings.TRENDING_REBASE_AFTER seconds old.
+    """
+    if trending.current_epoch().started < timezone.now() - timedelta(seconds=settings.TRENDING_REBASE_AFTER):
+        trending.rebase()
+    GalleryFeed.objects.build(
+        settings.GALLERY_FEED_VARIANTS, keep=settings.GALLERY_FEED_KEEP, scale=trending.decay_factor()
+    )
+    enqueue("gallery.build_gallery_feed", run_at=timezone.now() + timedelta(seconds=settings.GALLERY_FEED_INTERVAL))
+    schedule_stats_downsampling()
+    schedule_view_count_flushing()
+
+
+def schedule_gallery_feed():
+    """Queue a feed rebuild now unless one is queued, for the first feed or once rebuilds stopped"""
+    building = Job.objects.filter(task="gallery.build_gallery_feed", status__in=[Job.PENDING, Job.RUNNING])
+    if not building.exists():
+        enqueue("gallery.build_gallery_feed")
+
+
+@task("gallery.downsample_stats")
+def downsample_stats():
+    """Sum hourly and daily StatsBucket past their retention into coarser buckets, then schedule the next run"""
+    now = timezone.now()
+    StatsBucket.objects.downsample(
+        StatsBucket.HOUR, StatsBucket.DAY, now - timedelta(seconds=settings.STATS_HOUR_RETENTION)
+    )
+    StatsBucket.objects.downsample(
+        StatsBucket.DAY, StatsBucket.MONTH, now - timedelta(seconds=settings.STATS_DAY_RETENTION)
+    )
+    enqueue("gallery.downsample_stats", run_at=now + timedelta(seconds=settings.STATS_DOWNSAMPLE_INTERVAL))
+
+
+def schedule_stats_downsampling():
+    """Queue stats downsampling now unless it is queued, started along with the gallery feed rebuilds"""
+    downsampling = Job.objects.filter(task="gallery.downsample_stats", status__in=[Job.PENDING, Job.RUNNING])
+    if not downsampling.exists():
+        enqueue("gallery.downsample_stats")
+
+
+@task("gallery.flush_view_counts")
+def flush_view_counts():
+    """Write the photo views buffered in Redis to the database, then schedule the next flush, see gallery.counters"""
+    counters.flush()
+    enqueue("gallery.flush_view_counts", run_at=timezone.now() + timedelta(seconds=settings.PHOTO_VIEW_FLUSH_INTERVAL))
+
+
+def schedule_view_count_flushing():
+    """Queue a view count flush now unless one is queued, started along with the gallery feed rebuilds"""
+    flushing = Job.objects.filter(task="gallery.flush_view_counts", status__in=[Job.PENDING, Job.RUNNING])
+    if not flushing.exists():
+        enqueue("gallery.flush_view_counts")
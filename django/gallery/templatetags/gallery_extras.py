@@ -1,9 +1,14 @@
+import base64
+import io
 import os
 import re
+from functools import lru_cache
 
 from django import template
 from django.conf import settings
+from django.utils.html import format_html, format_html_join
 from gallery.models import Gallery
+from utils.methods import blurhash_image
 
 register = template.Library()
 
@@ -24,6 +29,95 @@ def get_user_gallery(context):
     return ""
 
 
+@register.filter("rendition")
+def rendition_url(photo, label):
+    """Url of a photo's rendition, e.g: {{ photo|rendition:"grid" }}"""
+    return photo.rendition_url(label)
+
+
+@lru_cache(maxsize=1024)
+def blurhash_data_uri(value, width, height):
+    """Decode a BlurHash into a tiny PNG data uri, browsers scale it up smoothly"""
+    buffer = io.BytesIO()
+    blurhash_image(value, width, height).save(buffer, format="PNG", optimize=True)
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+@register.simple_tag
+def placeholder_style(photo):
+    """Inline style painting a photo's dominant colour and blurred preview until the image loads
+
+    e.g: <img src="{{ photo|rendition:'grid' }}" style="{% placeholder_style photo %}" loading="lazy">
+    """
+    if photo is None:
+        return ""
+    styles = []
+    if photo.dominant_color:
+        styles.append(f"background-color:{photo.dominant_color}")
+    if photo.blurhash:
+        # 16 pixels across, as many down as keeps the photo's aspect ratio
+        ratio = photo.height / photo.width if photo.width and photo.height else 1
+        height = min(max(round(16 * ratio), 1), 32)
+        try:
+            uri = blurhash_data_uri(photo.blurhash, 16, height)
+        except ValueError:
+            uri = None
+        if uri:
+            styles.append(f"background-image:url({uri});background-size:cover;background-position:center")
+    return ";".join(styles)
+
+
+def html_attrs(attrs):
+    """Escaped html attributes, skipping None values. Underscores in names become dashes"""
+    return format_html_join(
+        " ", '{}="{}"', ((name.replace("_", "-"), value) for name, value in attrs.items() if value is not None)
+    )
+
+
+@register.simple_tag
+def responsive_img(photo, sizes, src="grid", **attrs):
+    """<img> letting the browser download the smallest rendition covering its displayed width
+
+    e.g: {% responsive_img photo sizes="(min-width: 640px) 33vw, 100vw" class="w-full" alt=photo.title %}
+
+    Urls and dimensions come from the renditions table, no file is opened: prefetch
+    `renditions` and join `gallery` when listing photos. `src` is the rendition browsers without srcset load,
+    its dimensions are the width and height reserving the image's space before it loads.
+    Images load lazily unless loading="eager" is given.
+    """
+    renditions = {rendition.name: rendition for rendition in photo.renditions.all() if rendition.width}
+    fallback = renditions.get(src)
+    if fallback is not None:
+        url, width, height = fallback.get_absolute_url(), fallback.width, fallback.height
+    else:
+        url, width, height = photo.image.url, photo.width, photo.height
+
+    srcset = {}
+    for rendition in sorted(renditions.values(), key=lambda rendition: rendition.width):
+        # Renditions of small photos are never upscaled, several may share a width
+        srcset.setdefault(rendition.width, f"{rendition.get_absolute_url()} {rendition.width}w")
+    style = ";".join(filter(None, [attrs.pop("style", ""), placeholder_style(photo)]))
+    attrs = {
+        "src": url,
+        "srcset": ", ".join(srcset.values()) or None,
+        "sizes": sizes if srcset else None,
+        "width": width,
+        "height": height,
+        "loading": "lazy",
+        "decoding": "async",
+        **attrs,
+        "style": style or None,
+    }
+    return format_html("<img {}>", html_attrs(attrs))
+
+
+@register.simple_tag
+def avatar_img(user, size, **attrs):
+    """Square <img> of a user's avatar shown at `size` css pixels, e.g: {% avatar_img request.user 40 %}"""
+    attrs = {"src": user.get_avatar_url(), "width": size, "height": size, "decoding": "async", **attrs}
+    return format_html("<img {}>", html_attrs(attrs))
+
+
 @register.filter("random_cover")
 def random_cover(gallery_pk):
     """random select a photo from gallery"""
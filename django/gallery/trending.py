@@ -0,0 +1,85 @@
+"""Time decayed trending scores of galleries and categories
+
+Each photo view, download and like adds its weight from settings.TRENDING_WEIGHTS to the
+trending score of the photo's gallery and category, and counts half as much every
+settings.TRENDING_HALF_LIFE seconds. Rather than decaying every stored score as time
+passes, new events are scaled up instead: an event at time t adds
+
+    weight * 2 ** ((t - epoch) / half life)
+
+so an event counts twice as much as one a half life earlier, stored scores keep their
+relative order without ever being rewritten and an index on the score column serves the
+top N directly. Stored scores grow with time, `rebase` scales them back down and moves the
+epoch forward, the gallery.build_gallery_feed job does so every settings.TRENDING_REBASE_AFTER
+seconds.
+
+    record_event(photo.gallery_id, "view")
+    record_events("view", {gallery_1.pk: 12, gallery_2.pk: 3})
+    Gallery.objects.order_by("-trending_score")[:10]
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from utils.methods import batches
+
+from .models import Category, Gallery, TrendingEpoch
+
+
+def current_epoch():
+    epoch = TrendingEpoch.objects.order_by("-pk").first()
+    return epoch if epoch is not None else TrendingEpoch.objects.create()
+
+
+def growth(when, epoch):
+    """How much more an event at `when` counts than one at the start of `epoch`"""
+    return 2 ** ((when - epoch.started).total_seconds() / settings.TRENDING_HALF_LIFE)
+
+
+def decay_factor(now=None):
+    """Factor turning stored scores into the scores of events decayed up to `now`"""
+    return 1 / growth(now or timezone.now(), current_epoch())
+
+
+def record_event(gallery_id, event, count=1, when=None):
+    """Add `count` "view", "download" or "like" events to a gallery's and its category's scores"""
+    increment = settings.TRENDING_WEIGHTS[event] * count * growth(when or timezone.now(), current_epoch())
+    Gallery.objects.filter(pk=gallery_id).update(trending_score=F("trending_score") + increment)
+    Category.objects.filter(gallery=gallery_id).update(trending_score=F("trending_score") + increment)
+
+
+def record_events(event, counts, when=None):
+    """Add {gallery pk: count} "view", "download" or "like" events to the galleries' and their categories' scores
+
+    The epoch is read once, and galleries, then categories, with the same count share an UPDATE.
+    """
+    if not counts:
+        return
+    unit = settings.TRENDING_WEIGHTS[event] * growth(when or timezone.now(), current_epoch())
+    categories = Counter()
+    for gallery_id, category_id in Gallery.objects.filter(pk__in=counts, category__isnull=False).values_list(
+        "pk", "category_id"
+    ):
+        categories[category_id] += counts[gallery_id]
+    for count, gallery_ids in batches(counts).items():
+        Gallery.objects.filter(pk__in=gallery_ids).update(trending_score=F("trending_score") + unit * count)
+    for count, category_ids in batches(categories).items():
+        Category.objects.filter(pk__in=category_ids).update(trending_score=F("trending_score") + unit * count)
+
+
+def rebase(now=None):
+    """Move the epoch to `now`, scaling stored scores down to keep them far from float overflow
+
+    Events recorded while this runs may count with the previous epoch, run it when traffic is low.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        epoch = TrendingEpoch.objects.select_for_update().order_by("-pk").first() or TrendingEpoch.objects.create()
+        factor = 1 / growth(now, epoch)
+        Gallery.objects.update(trending_score=F("trending_score") * factor)
+        Category.objects.update(trending_score=F("trending_score") * factor)
+        epoch.started = now
+        epoch.save(update_fields=["started"])
+    return factor
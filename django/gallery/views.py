@@ -1,11 +1,32 @@
 import json
-
+import mimetypes
+import os
+import random
+import re
+from datetime import timedelta
+from functools import cached_property, lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Count, Q, Sum
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.http.response import JsonResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from django.utils.text import slugify
+from django.views.decorators.http import require_safe
 from django.views.generic import (
     CreateView,
     DeleteView,
@@ -14,12 +35,29 @@ from django.views.generic import (
     UpdateView,
 )
 from django.views.generic.list import MultipleObjectMixin
+from utils.disk_cache import DiskCache
+from utils.methods import encodable_formats, mime_type, save_renditions
+from utils.pagination import CURSOR_PARAM
+from utils.zipstream import ZipStream
+
+from . import counters, trending
+from .mixins import CursorPaginationMixin, GalleryFormMixin, UserAccessPermissionMixin
+from .models import (
+    Category,
+    FeedEntry,
+    Gallery,
+    GalleryFeed,
+    Photo,
+    Rendition,
+    StatsBucket,
+)
+from .tasks import schedule_gallery_feed
 
-from .mixins import GalleryFormMixin, UserAccessPermissionMixin
-from .models import Category, Gallery, Photo
+# Seconds browsers and proxies may cache a rendition, their urls change with the image
+RENDITION_MAX_AGE = 30 * 24 * 60 * 60
 
 
-class GalleryDetailView(DetailView, MultipleObjectMixin):
+class GalleryDetailView(CursorPaginationMixin, DetailView, MultipleObjectMixin):
     model = Gallery
     template_name = "gallery/gallery_detail.html"
     object_list = None
@@ -35,49 +73,121 @@ class GalleryDetailView(DetailView, MultipleObjectMixin):
 
     def get_context_data(self, **kwargs):
         obj = self.get_object()
-        object_list = obj.photos.order_by("-pk")
+        object_list = obj.photos.prefetch_related("renditions")
         context = super().get_context_data(object_list=object_list, **kwargs)
         related_gallery = self.object.category.gallery
         user = self.request.user
-        if related_gallery.exists():
-            # Filter galleries by owner or its public state
-            # Only display galleries if user is the owner or gallery is public
-            if user.is_authenticated:
-                related_gallery = related_gallery.filter(
-                    Q(public=True) | Q(user=self.request.user),
-                ).exclude(pk=self.object.pk)
-            else:
-                related_gallery = related_gallery.filter(public=True).exclude(pk=self.object.pk)
+        # Filter galleries by owner or its public state
+        # Only display galleries if user is the owner or gallery is public
+        if user.is_authenticated:
+            related_gallery = related_gallery.filter(
+                Q(public=True) | Q(user=self.request.user),
+            ).exclude(pk=self.object.pk)
+        else:
+            related_gallery = related_gallery.filter(public=True).exclude(pk=self.object.pk)
 
-        context["related_gallery"] = related_gallery[:20]
+        context["related_gallery"] = Gallery.objects.for_cards(related_gallery)[:20]
         context["is_user"] = obj.user == self.request.user
-        context["cover_photo"] = obj.photos.filter(is_cover=True).last()
+        context["cover_photo"] = obj.cover
         return context
 
 
-class GalleryListView(ListView):
+class FeedList:
+    """Galleries of one shuffle of a GalleryFeed, after the galleries of `first`
+
+    Paged by position, see utils.pagination.offset_page, a page is read from the feed's index in O(page size).
+    Galleries deleted or made private since the feed was built are left out of their page.
+    """
+
+    model = Gallery
+
+    def __init__(self, feed, variant, first):
+        self.feed = feed
+        self.variant = variant
+        self.first = first
+
+    @cached_property
+    def first_count(self):
+        return self.first.count()
+
+    def count(self):
+        return self.first_count + self.feed.size
+
+    def __getitem__(self, index):
+        start, stop = index.start or 0, index.stop
+        galleries = list(self.first[start:stop]) if start < self.first_count else []
+        start, stop = max(start - self.first_count, 0), stop - self.first_count
+        if stop > start:
+            entries = FeedEntry.objects.filter(
+                feed=self.feed, variant=self.variant, position__gte=start, position__lt=stop
+            ).order_by("position")
+            gallery_ids = list(entries.values_list("gallery_id", flat=True))
+            found = Gallery.objects.for_cards(Gallery.objects.filter(pk__in=gallery_ids, public=True)).in_bulk()
+            galleries += [found[pk] for pk in gallery_ids if pk in found]
+        return galleries
+
+
+class GalleryListView(CursorPaginationMixin, ListView):
     model = Gallery
     template_name = "gallery/gallery_list.html"
     paginate_by = 25
 
     def get_queryset(self):
-        if self.request.user.is_authenticated:
-            qs = Gallery.objects.filter(Q(public=True) | Q(user=self.request.user))
+        user = self.request.user
+        if user.is_authenticated:
+            qs = Gallery.objects.for_cards().filter(Q(public=True) | Q(user=user))
         else:
-            qs = Gallery.objects.filter(public=True)
+            qs = Gallery.objects.for_cards().filter(public=True)
 
         search = self.request.GET.get("q")
         if search:
             return Gallery.objects.query_search(search, qs)
 
-        # TODO order by datetime range  - one to two week newest
-        return qs.annotate(photo_views=Sum("photos__views")).order_by("?", "-photo_views")
+        feed, variant = self.get_feed()
+        if feed is None:
+            # Until the first feed is built
+            return qs.order_by("-created")
+        # The user's private galleries are not in the feed, they are listed first
+        private = qs.filter(user=user, public=False) if user.is_authenticated else Gallery.objects.none()
+        return FeedList(feed, variant, private)
+
+    def get_feed(self):
+        """The feed this session pages through and which of its shuffles, (None, None) until one is built
+
+        A session keeps its feed from page to page while it is kept, and gets the newest
+        one back on the first page, the one without a cursor. Its shuffle is picked from a
+        seed kept in the session.
+        """
+        # Without the session middleware, every request gets a shuffle of its own
+        session = getattr(self.request, "session", {})
+        if "gallery_feed_seed" not in session:
+            session["gallery_feed_seed"] = random.getrandbits(31)
+
+        feed = None
+        if self.request.GET.get(CURSOR_PARAM):
+            feed = GalleryFeed.objects.filter(pk=session.get("gallery_feed")).first()
+        if feed is None:
+            feed = GalleryFeed.objects.order_by("-pk").first()
+            stale = timezone.now() - timedelta(seconds=2 * settings.GALLERY_FEED_INTERVAL)
+            if feed is None or feed.created < stale:
+                schedule_gallery_feed()
+            if feed is None:
+                return None, None
+            if session.get("gallery_feed") != feed.pk:
+                session["gallery_feed"] = feed.pk
+        return feed, session["gallery_feed_seed"] % feed.variants
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Show top 20 trending category
         context["by_search"] = self.request.GET.get("q", False)
-        context["top_category"] = Category.objects.alias(c=Count("gallery")).order_by("-c")[:20]
+        context["top_category"] = Category.objects.order_by("-trending_score")[:20]
+        if not context["by_search"]:
+            context["trending_galleries"] = (
+                Gallery.objects.filter(public=True)
+                .select_related("category")
+                .order_by("-trending_score")[: settings.TRENDING_GALLERIES]
+            )
         return context
 
 
@@ -129,13 +239,14 @@ class PhotoDetailView(UserAccessPermissionMixin, DetailView):
         context = super().get_context_data(**kwargs)
         obj = self.get_object()
         context["is_user"] = obj.gallery.user == self.request.user
+        context["show_location"] = obj.location_visible_to(self.request.user)
         context["galleries"] = Gallery.objects.filter(user=obj.gallery.user).exclude(pk=obj.gallery.pk)
         return context
 
     def get(self, *args, **kwargs):
         self.object = self.get_object()
-        self.object.views += 1
-        self.object.save()
+        if not counters.is_bot(self.request):
+            counters.count_view(self.object.pk, viewer=counters.viewer_key(self.request))
         context = self.get_context_data()
         return self.render_to_response(context)
 
@@ -218,6 +329,304 @@ def photo_transfer(request, pk=None):
     return redirect(obj.gallery.get_absolute_url())  # core:index")
 
 
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """Parse a single range `Range` header into (start, end) inclusive byte positions
+
+    Returns None when the header is absent or not a single byte range, the whole file is
+    then served, and raises ValueError when the range lies outside the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Suffix range, the last `end` bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
+
+
+def negotiate_format(accept, formats):
+    """First of `formats`, Pillow formats in order of preference, the `Accept` header lists
+
+    Only types listed explicitly with a non zero quality count: browsers unable to decode
+    WebP or AVIF send image/* too. Returns None when none of them is listed.
+    """
+    accepted = set()
+    for media_range in (accept or "").split(","):
+        media_type, *params = media_range.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(media_type.strip().lower())
+    for image_format in formats:
+        if mime_type(image_format) in accepted:
+            return image_format
+    return None
+
+
+class FileRange:
+    """Read only `length` bytes of a file from its current position, see FileResponse"""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def attachment_header(filename):
+    """Content-Disposition header downloading a file as `filename`"""
+    filename = filename.replace('"', "").replace("\\", "")
+    try:
+        filename.encode("ascii")
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+@require_safe
+def photo_download(request, pk=None):
+    """Serve a photo's original image as an attachment
+
+    Supports conditional GET from the stored content hash, and single byte ranges so
+    interrupted downloads can resume. With settings.PHOTO_DOWNLOAD_ACCEL the bytes are
+    sent by the front proxy instead of this worker.
+    """
+    if request.user.is_authenticated:
+        photos = Photo.objects.filter(Q(gallery__public=True) | Q(gallery__user=request.user))
+    else:
+        photos = Photo.objects.filter(gallery__public=True)
+    photo = get_object_or_404(photos.select_related("gallery__user").exclude(image=""), pk=pk)
+
+    etag = quote_etag(photo.content_hash) if photo.content_hash else None
+    last_modified = int(photo.updated.timestamp())
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    size = photo.file_size if photo.file_size is not None else photo.image.size
+    byte_range = None
+    # If-Range: only resume when the file is still the one the client started downloading
+    if_range = request.headers.get("If-Range")
+    if if_range is None or if_range in (etag, http_date(last_modified)):
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    accel = settings.PHOTO_DOWNLOAD_ACCEL
+    if accel:
+        # The proxy serves the file, and the range, itself
+        response = HttpResponse(content_type=photo.content_type or "application/octet-stream")
+        if accel == "nginx":
+            response["X-Accel-Redirect"] = settings.PHOTO_DOWNLOAD_ACCEL_PREFIX + photo.image.name
+        else:
+            response["X-Sendfile"] = photo.image.path
+    else:
+        file = photo.image.open("rb")
+        start, end = byte_range or (0, size - 1)
+        file.seek(start)
+        response = FileResponse(
+            FileRange(file, end - start + 1),
+            as_attachment=True,
+            content_type=photo.content_type or "application/octet-stream",
+            status=206 if byte_range else 200,
+        )
+        response["Content-Length"] = end - start + 1
+        if byte_range:
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["Content-Disposition"] = attachment_header(photo.get_download_title())
+    response["Accept-Ranges"] = "bytes"
+    response["Last-Modified"] = http_date(last_modified)
+    if etag:
+        response["ETag"] = etag
+
+    # Count downloads once, not for each resumed part or HEAD request
+    if request.method == "GET" and (byte_range is None or byte_range[0] == 0):
+        with transaction.atomic():
+            Photo.objects.filter(pk=photo.pk).update(downloads=F("downloads") + 1)
+            Gallery.objects.count_photos(photo.gallery_id, downloads=1)
+            StatsBucket.objects.add({(photo.pk, photo.gallery_id): (0, 1)})
+        trending.record_event(photo.gallery_id, "download")
+    return response
+
+
+def acquire_gallery_zip_slot(user):
+    """Count one more gallery download in progress for `user`
+
+    Returns False, counting nothing, when the user already has settings.GALLERY_ZIP_MAX_CONCURRENT
+    downloads in progress.
+    """
+    key = f"gallery-zip:{user.pk}"
+    cache.add(key, 0, settings.GALLERY_ZIP_SLOT_TIMEOUT)
+    if cache.incr(key) > settings.GALLERY_ZIP_MAX_CONCURRENT:
+        cache.decr(key)
+        return False
+    return True
+
+
+def release_gallery_zip_slot(user):
+    try:
+        cache.decr(f"gallery-zip:{user.pk}")
+    except ValueError:
+        # Expired, see settings.GALLERY_ZIP_SLOT_TIMEOUT
+        pass
+
+
+@login_required
+@require_safe
+def gallery_download(request, pk=None):
+    """Stream all of an owner's gallery photos as a ZIP archive"""
+    gallery = get_object_or_404(Gallery, pk=pk, user=request.user)
+    if not acquire_gallery_zip_slot(request.user):
+        return HttpResponse("Too many downloads in progress, try again later.", status=429)
+
+    def files(chunk_size=100):
+        """Read photos in primary key order, `chunk_size` at a time, as the archive is sent"""
+        photos = gallery.photos.exclude(image="").only("pk", "title", "image", "created").order_by("pk")
+        last_pk = 0
+        while True:
+            chunk = list(photos.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                return
+            for photo in chunk:
+                extension = os.path.splitext(photo.image.name)[1]
+                yield f"{slugify(photo.title) or 'photo'}-{photo.pk}{extension}", photo.image.path, photo.created
+            last_pk = chunk[-1].pk
+
+    stream = ZipStream(files(), on_close=lambda: release_gallery_zip_slot(request.user))
+    response = StreamingHttpResponse(stream, content_type="application/zip")
+    response["Content-Disposition"] = attachment_header(f"{slugify(gallery.name) or 'gallery'}.zip")
+    return response
+
+
+@require_safe
+def photo_rendition(request, label, pk):
+    """Serve a photo's rendition in the best format the browser accepts
+
+    The first of the rendition's other formats, see settings.PHOTO_RENDITION_FORMATS, the
+    Accept header lists is sent, the original's format otherwise. Responses vary on Accept
+    so caches keep each format apart. With settings.PHOTO_DOWNLOAD_ACCEL the bytes are sent
+    by the front proxy instead of this worker.
+    """
+    rendition = get_object_or_404(Rendition.objects.select_related("photo__gallery"), photo_id=pk, name=label)
+    gallery = rendition.photo.gallery
+    if not gallery.public and gallery.user_id != request.user.pk:
+        raise Http404("No Photo matches the given query.")
+
+    names = rendition.format_names()
+    image_format = negotiate_format(request.headers.get("Accept"), names)
+    if image_format:
+        name, content_type = names[image_format], mime_type(image_format)
+    else:
+        name = rendition.image.name
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    # Rendition names change with the image's content
+    etag = quote_etag(os.path.basename(name))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        storage = rendition.image.storage
+        accel = settings.PHOTO_DOWNLOAD_ACCEL
+        if accel:
+            response = HttpResponse(content_type=content_type)
+            if accel == "nginx":
+                response["X-Accel-Redirect"] = settings.PHOTO_DOWNLOAD_ACCEL_PREFIX + name
+            else:
+                response["X-Sendfile"] = storage.path(name)
+        else:
+            try:
+                response = FileResponse(storage.open(name, "rb"), content_type=content_type)
+            except FileNotFoundError:
+                raise Http404("Rendition image is missing")
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Accept"])
+    patch_cache_control(response, max_age=RENDITION_MAX_AGE, **{"public" if gallery.public else "private": True})
+    return response
+
+
+@lru_cache(maxsize=None)
+def thumbnail_cache(directory, max_bytes):
+    return DiskCache(directory, max_bytes)
+
+
+@require_safe
+def photo_thumbnail(request, width, height, pk):
+    """Serve a photo scaled to fit width x height, one of settings.PHOTO_THUMBNAIL_SIZES
+
+    Thumbnails are generated on first request and then served from a disk cache.
+    """
+    size = (int(width), int(height))
+    if size not in {tuple(allowed) for allowed in settings.PHOTO_THUMBNAIL_SIZES}:
+        raise Http404("Unsupported thumbnail size")
+    photo = get_object_or_404(Photo.objects.select_related("gallery").exclude(image=""), pk=pk)
+    if not photo.gallery.public and photo.gallery.user != request.user:
+        raise Http404("No Photo matches the given query.")
+
+    # Encoded in the first of settings.PHOTO_RENDITION_FORMATS the browser accepts
+    image_format = negotiate_format(request.headers.get("Accept"), encodable_formats(settings.PHOTO_RENDITION_FORMATS))
+    variant = f"{width}x{height}-{image_format.lower()}" if image_format else f"{width}x{height}"
+    etag = quote_etag(f"{photo.content_hash}-{variant}") if photo.content_hash else None
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        patch_vary_headers(not_modified, ["Accept"])
+        return not_modified
+
+    cache = thumbnail_cache(settings.PHOTO_THUMBNAIL_CACHE_DIR, settings.PHOTO_THUMBNAIL_CACHE_BYTES)
+    key = f"{photo.pk}-{photo.content_hash or photo.image.name}-{variant}"
+
+    def create(path):
+        save_renditions(
+            photo.image.path,
+            {"thumbnail": (size, path)},
+            settings.PHOTO_MAX_DECODE_BYTES,
+            settings.PHOTO_ENCODER_OPTIONS,
+            output_format=image_format,
+        )
+
+    # The file may be evicted between being cached and opened, generate it again then
+    for _ in range(2):
+        try:
+            thumbnail = open(cache.get_or_create(key, create), "rb")
+            break
+        except FileNotFoundError:
+            if not os.path.exists(photo.image.path):
+                raise Http404("Photo image is missing")
+    else:
+        raise Http404("Thumbnail could not be generated")
+
+    content_type = mime_type(image_format) if image_format else photo.content_type
+    response = FileResponse(thumbnail, content_type=content_type or "application/octet-stream")
+    if etag:
+        response["ETag"] = etag
+    patch_vary_headers(response, ["Accept"])
+    patch_cache_control(response, max_age=24 * 60 * 60, **{"public" if photo.gallery.public else "private": True})
+    return response
+
+
 class CategoryDetailView(DetailView):
     slug_url_kwarg = "slug"
     pass
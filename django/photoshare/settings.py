@@ -190,6 +190,86 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, "static/photoshare"),)
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"
 
+# Photo renditions generated from every uploaded photo - label: (max width, max height)
+# Renditions are stored next to the original upload, which is always kept as is.
+PHOTO_RENDITIONS = {
+    "card": (480, 360),
+    "grid": (640, 640),
+    "detail": (1280, 1280),
+    "full": (2560, 2560),
+}
+# Other formats renditions and thumbnails are also encoded in, most preferred first. Browsers
+# get the first one their Accept header lists, or the original's format. Formats this Pillow
+# build can't encode are skipped, AVIF needs pillow-avif-plugin.
+PHOTO_RENDITION_FORMATS = ["AVIF", "WEBP"]
+# Encoder options by Pillow format for renditions and thumbnails. EXIF metadata is never copied.
+PHOTO_ENCODER_OPTIONS = {
+    "JPEG": {"quality": 75, "progressive": True, "optimize": True},
+    "PNG": {"optimize": True},
+    "WEBP": {"quality": 78, "method": 4},
+    "AVIF": {"quality": 55, "speed": 6},
+}
+# Largest decoded image, in bytes, the photo pipeline accepts (~64 megapixel RGB photo).
+# Checked from the image header, so decompression bombs are rejected before decoding.
+PHOTO_MAX_DECODE_BYTES = int(os.getenv("PHOTO_MAX_DECODE_BYTES", 256 * 1024 * 1024))
+# Show where photos were taken, from their EXIF GPS position, to everyone instead of only
+# their owner. Renditions and thumbnails never keep EXIF, originals are downloaded as uploaded.
+PHOTO_PUBLIC_LOCATION = False
+# Photos whose perceptual hashes differ by at most this many bits (of 64) are near duplicates
+PHOTO_SIMILAR_DISTANCE = 6
+# Photo downloads are streamed by django unless handed off to the front proxy:
+# "nginx" sends X-Accel-Redirect to PHOTO_DOWNLOAD_ACCEL_PREFIX + image name, which must be an
+# `internal` location aliasing MEDIA_ROOT. "sendfile" sends X-Sendfile (Apache, lighttpd).
+PHOTO_DOWNLOAD_ACCEL = os.getenv("PHOTO_DOWNLOAD_ACCEL", "")
+PHOTO_DOWNLOAD_ACCEL_PREFIX = "/protected-media/"
+# Gallery ZIP downloads a user may have in progress at once, and how long, in seconds,
+# a download counts towards that limit if its worker dies without releasing it.
+GALLERY_ZIP_MAX_CONCURRENT = 2
+GALLERY_ZIP_SLOT_TIMEOUT = 60 * 60
+# The gallery list pages through a feed of public galleries shuffled GALLERY_FEED_VARIANTS ways,
+# rebuilt every GALLERY_FEED_INTERVAL seconds. The GALLERY_FEED_KEEP newest feeds are kept so
+# sessions paging through an older one see stable pages. See gallery.models.GalleryFeed
+GALLERY_FEED_INTERVAL = 15 * 60
+GALLERY_FEED_VARIANTS = 8
+GALLERY_FEED_KEEP = 2
+# Trending scores of galleries and categories, see gallery.trending. Photo views, downloads and
+# likes add their weight, halved every TRENDING_HALF_LIFE seconds. Scores are rebased by the
+# gallery feed job every TRENDING_REBASE_AFTER seconds, TRENDING_GALLERIES are listed as trending.
+TRENDING_WEIGHTS = {"view": 1, "download": 3, "like": 5}
+TRENDING_HALF_LIFE = 3 * 24 * 60 * 60
+TRENDING_REBASE_AFTER = 7 * 24 * 60 * 60
+TRENDING_GALLERIES = 10
+# Photo views are buffered, in Redis when it is the cache, and written to the database every
+# PHOTO_VIEW_FLUSH_INTERVAL seconds, by the gallery.flush_view_counts job for Redis, or once
+# PHOTO_VIEW_FLUSH_MAX photos have views buffered in a process's memory. See gallery.counters
+PHOTO_VIEW_FLUSH_INTERVAL = 60
+PHOTO_VIEW_FLUSH_MAX = 1000
+# Views from user agents matching this are not counted, nor are views without a user agent
+PHOTO_VIEW_BOT_AGENTS = (
+    r"bot|crawl|spider|slurp|archiver|facebookexternalhit|embedly|preview|headless|lighthouse"
+    r"|python-requests|python-urllib|curl|wget|httpclient|okhttp|go-http-client|scrapy|java/"
+)
+# Photo views and downloads are counted in hourly buckets, summed into daily buckets after
+# STATS_HOUR_RETENTION seconds and into monthly ones after STATS_DAY_RETENTION seconds, by a
+# job running every STATS_DOWNSAMPLE_INTERVAL seconds. See gallery.models.StatsBucket
+STATS_HOUR_RETENTION = 7 * 24 * 60 * 60
+STATS_DAY_RETENTION = 365 * 24 * 60 * 60
+STATS_DOWNSAMPLE_INTERVAL = 24 * 60 * 60
+# On demand photo thumbnails, /media/r/<width>x<height>/<photo pk>. Only these sizes are served,
+# and generated thumbnails are cached on local disk within PHOTO_THUMBNAIL_CACHE_BYTES.
+PHOTO_THUMBNAIL_SIZES = [(160, 160), (320, 320), (480, 360), (800, 800)]
+PHOTO_THUMBNAIL_CACHE_DIR = os.getenv("PHOTO_THUMBNAIL_CACHE_DIR", os.path.join(BASE_DIR, "cache", "thumbnails"))
+PHOTO_THUMBNAIL_CACHE_BYTES = int(os.getenv("PHOTO_THUMBNAIL_CACHE_BYTES", 1024 * 1024 * 1024))
+# Photos uploaded through the API in chunks, see gallery.models.UploadSession. Chunks are
+# written to PHOTO_UPLOAD_TEMP_DIR, and sessions expire PHOTO_UPLOAD_SESSION_TTL seconds
+# after their last chunk. Chunks must also fit in the proxy's client_max_body_size.
+PHOTO_UPLOAD_TEMP_DIR = os.getenv("PHOTO_UPLOAD_TEMP_DIR", os.path.join(BASE_DIR, "cache", "uploads"))
+PHOTO_UPLOAD_MAX_BYTES = int(os.getenv("PHOTO_UPLOAD_MAX_BYTES", 100 * 1024 * 1024))
+PHOTO_UPLOAD_CHUNK_MAX_BYTES = 8 * 1024 * 1024
+PHOTO_UPLOAD_SESSION_TTL = 24 * 60 * 60
+# Width and height of the square avatar copied from profile images, twice the largest size shown
+USER_AVATAR_SIZE = 96
+
 
 JAZZMIN_SETTINGS = {
     # title of the window
@@ -270,6 +350,18 @@ REST_FRAMEWORK = {
 }
 
 
+# ********************* #
+# ***  Job Queue    *** #
+# ********************* #
+# Background jobs are stored in the database and run by `python manage.py runworker`
+JOB_MAX_ATTEMPTS = 3
+# Seconds a worker may hold a job before it is handed to another worker
+JOB_VISIBILITY_TIMEOUT = 300
+# Seconds before the first retry of a failed job, doubled on every retry
+JOB_RETRY_DELAY = 30
+JOB_KEEP_DONE_DAYS = 7
+
+
 # ********************* #
 # ***    Support    *** #
 # ********************* #
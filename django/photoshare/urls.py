@@ -2,8 +2,22 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, re_path
+from gallery.views import photo_rendition, photo_thumbnail
 
-urlpatterns = static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns = [
+    # Before MEDIA_URL's static files, which would match it too
+    re_path(
+        rf"^{settings.MEDIA_URL.lstrip('/')}r/(?P<width>\d+)x(?P<height>\d+)/(?P<pk>\d+)$",
+        photo_thumbnail,
+        name="photo-thumbnail",
+    ),
+    re_path(
+        rf"^{settings.MEDIA_URL.lstrip('/')}r/(?P<label>[a-z_]+)/(?P<pk>\d+)$",
+        photo_rendition,
+        name="photo-rendition",
+    ),
+]
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 urlpatterns += [
     re_path(r"^admin/", admin.site.urls),
@@ -1,5 +1,6 @@
 import os
 import shutil
+from io import BytesIO
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -7,6 +8,7 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from gallery.models import *  # noqa
+from PIL import Image
 from rest_framework.reverse import reverse as api_reverse
 
 User = get_user_model()
@@ -17,6 +19,20 @@ TEST_MEDIA_ROOT = os.path.join(settings.BASE_DIR, "test_media/")
 TEST_IMAGE_DIR = os.path.join(PATH, "FakeImages/")
 
 
+def exif_jpeg(size=(300, 200), orientation=1):
+    """JPEG bytes with the EXIF a phone camera writes, taken in Paris on July 14th 2023"""
+    exif = Image.Exif()
+    exif[0x010F], exif[0x0110], exif[0x0112] = "Apple", "iPhone 13", orientation
+    exif[0x8769] = {0x9003: "2023:07:14 18:30:05", 0x9011: "+02:00", 0xA434: "iPhone 13 back camera 5.1mm f/1.6"}
+    exif[0x8825] = {1: "N", 2: (48.0, 51.0, 29.52), 3: "E", 4: (2.0, 17.0, 40.2)}
+    buffer = BytesIO()
+    image = Image.new("RGB", size, (200, 40, 40))
+    # Top left quarter marked, to tell how the image was turned
+    image.paste((20, 20, 220), (0, 0, size[0] // 2, size[1] // 2))
+    image.save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
+
+
 def override_setting_config():
     # Change django settings for testing
     global settings
@@ -118,6 +134,9 @@ class BaseObjectUtils(object):
         with open(path, "rb") as image_file:
             return SimpleUploadedFile(name=name + ".jpg", content=image_file.read(), content_type="image/jpeg")
 
+    def create_exif_image(self, name, **kwargs):
+        return SimpleUploadedFile(name=f"{name}.jpg", content=exif_jpeg(**kwargs), content_type="image/jpeg")
+
     def create_user(self, username="test_user_1", email="test_user_1@test.com", password="test_password"):
         user, _ = User.objects.get_or_create(username=username, email=email)
         user.set_password(password)
@@ -0,0 +1,25 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from gallery.models import Photo
+from tests.base_utils import BaseObjectUtils
+
+
+class TestBackfillPhotoMetadataCommand(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_metadata_is_backfilled(self):
+        photo = self.create_photo(self.test_gallery_1, title="backfill_image")
+        Photo.objects.filter(pk=photo.pk).update(
+            width=None, height=None, content_type="", file_size=None, content_hash=""
+        )
+
+        out = StringIO()
+        call_command("backfill_photo_metadata", stdout=out, stderr=StringIO())
+        photo.refresh_from_db()
+        self.assertEqual((photo.width, photo.height), (1280, 720))
+        self.assertEqual(photo.content_type, "image/jpeg")
+        self.assertEqual(len(photo.content_hash), 64)
+        # fixture photos have no image files
+        self.assertIn("Updated 1 photos, 2 failed", out.getvalue())
@@ -0,0 +1,60 @@
+import os
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from gallery.models import Photo, Rendition
+from PIL import Image
+from tests.base_utils import BaseObjectUtils
+
+
+class TestRerenderPhotosCommand(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        super().setUp()
+        # fixture photos have no image files
+        Photo.objects.all().delete()
+        self.photos = [self.create_photo(self.test_gallery_1, title=f"rerender_{index}") for index in range(3)]
+        self.checkpoint = os.path.join(self.photos[0].image.storage.location, "test.checkpoint")
+
+    def rerender(self, **options):
+        out = StringIO()
+        call_command(
+            "rerender_photos", workers=2, chunk_size=2, checkpoint=self.checkpoint, stdout=out, stderr=out, **options
+        )
+        return out.getvalue()
+
+    @override_settings(PHOTO_RENDITIONS={"small": (100, 100)})
+    def test_photos_are_rerendered_with_new_sizes(self):
+        output = self.rerender()
+        self.assertIn("Processed 3 photos, 0 failed", output)
+
+        for photo in self.photos:
+            rendition = photo.renditions.get(name="small")
+            self.assertEqual((rendition.width, rendition.height), (100, 56))
+            with Image.open(rendition.image.path) as image:
+                self.assertEqual(image.size, (100, 56))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_dry_run_does_not_render(self):
+        output = self.rerender(dry_run=True)
+        self.assertIn("3 photos", output)
+        self.assertFalse(Rendition.objects.filter(photo__in=self.photos).exists())
+
+    def test_resumes_from_checkpoint(self):
+        with open(self.checkpoint, "w") as checkpoint:
+            checkpoint.write(str(self.photos[0].pk))
+
+        output = self.rerender()
+        self.assertIn(f"Resuming after photo #{self.photos[0].pk}", output)
+        self.assertFalse(self.photos[0].renditions.exists())
+        self.assertTrue(self.photos[2].renditions.exists())
+
+    def test_unreadable_photos_are_reported_as_failures(self):
+        # photos with identical content share a file, this one has its own
+        photo = self.create_photo(self.test_gallery_1, title="unreadable", path="test_blank_image.jpg")
+        os.remove(photo.image.path)
+        output = self.rerender()
+        self.assertIn(f"Photo #{photo.pk} failed", output)
+        self.assertIn("Processed 3 photos, 1 failed", output)
@@ -0,0 +1,113 @@
+import os
+import re
+import shutil
+from io import StringIO
+
+from core.jobs import run_pending
+from core.management.commands.shard_media import Command
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase
+from gallery.models import Blob, Photo, Rendition
+from tests.base_utils import TEST_IMAGE_DIR, BaseObjectUtils
+from utils.methods import format_name, rendition_name
+
+SHARDED_NAME = re.compile(r"^(gallery|users)/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32,64}\.jpg$")
+
+
+class TestShardMediaCommand(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        super().setUp()
+        # fixture photos have no image files
+        Photo.objects.all().delete()
+
+    def flat_file(self, name):
+        """Store the test image under a name from before sharding"""
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(os.path.join(TEST_IMAGE_DIR, "test_image.jpg"), path)
+        return path
+
+    def shard_media(self):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("shard_media", stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_flat_photos_and_renditions_are_moved(self):
+        photo = self.create_photo(self.test_gallery_1, title="flat_photo")
+        run_pending()
+        # Move the photo back to the flat layout it had before sharding
+        Blob.objects.filter(name=photo.image.name).delete()
+        old_path = self.flat_file("gallery/flat_photo.jpg")
+        Photo.objects.filter(pk=photo.pk).update(image="gallery/flat_photo.jpg")
+        Blob.objects.create(name="gallery/flat_photo.jpg", ref_count=1)
+        for rendition in photo.renditions.all():
+            name = f"gallery/flat_photo_{rendition.name}.jpg"
+            shutil.copyfile(rendition.image.path, default_storage.path(name))
+            Rendition.objects.filter(pk=rendition.pk).update(image=name)
+
+        output = self.shard_media()
+        self.assertIn("Moved 1 photos, 0 failed", output)
+
+        photo.refresh_from_db()
+        self.assertRegex(photo.image.name, SHARDED_NAME)
+        self.assertTrue(os.path.exists(photo.image.path))
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(Blob.objects.get(name=photo.image.name).ref_count, 1)
+        for rendition in photo.renditions.all():
+            self.assertTrue(rendition.image.name.startswith(os.path.splitext(photo.image.name)[0]))
+            self.assertTrue(os.path.exists(rendition.image.path))
+            self.assertFalse(os.path.exists(default_storage.path(f"gallery/flat_photo_{rendition.name}.jpg")))
+
+        # Already sharded photos are skipped, so an interrupted run resumes where it stopped
+        self.assertIn("Moved 0 photos, 0 failed", self.shard_media())
+
+    def test_copies_are_deleted_when_the_image_was_replaced_meanwhile(self):
+        photo = self.create_photo(self.test_gallery_1, title="flat_photo")
+        run_pending()
+        sharded_name = photo.image.name
+        Blob.objects.filter(name=sharded_name).delete()
+        for path in [photo.image.path] + [rendition.image.path for rendition in photo.renditions.all()]:
+            os.remove(path)
+        self.flat_file("gallery/flat_photo.jpg")
+        Photo.objects.filter(pk=photo.pk).update(image="gallery/flat_photo.jpg")
+        for rendition in photo.renditions.all():
+            name = f"gallery/flat_photo_{rendition.name}.jpg"
+            shutil.copyfile(os.path.join(TEST_IMAGE_DIR, "test_image.jpg"), default_storage.path(name))
+            Rendition.objects.filter(pk=rendition.pk).update(image=name)
+        photo.refresh_from_db()
+
+        # Replaced by another upload while the command copies it
+        Photo.objects.filter(pk=photo.pk).update(image="gallery/replaced.jpg")
+        self.assertFalse(Command().move_photo(photo))
+
+        self.assertFalse(default_storage.exists(sharded_name))
+        for rendition in Rendition.objects.filter(photo=photo):
+            destination = rendition_name(sharded_name, rendition.name)
+            self.assertFalse(default_storage.exists(destination))
+            for image_format in settings.PHOTO_RENDITION_FORMATS:
+                self.assertFalse(default_storage.exists(format_name(destination, image_format)))
+
+    def test_flat_profile_images_are_moved(self):
+        old_path = self.flat_file("users/avatar.jpg")
+        self.test_user_1.image = "users/avatar.jpg"
+        self.test_user_1.save()
+
+        output = self.shard_media()
+        self.assertIn("Moved 1 users, 0 failed", output)
+        self.test_user_1.refresh_from_db()
+        self.assertRegex(self.test_user_1.image.name, SHARDED_NAME)
+        self.assertTrue(os.path.exists(self.test_user_1.image.path))
+        self.assertFalse(os.path.exists(old_path))
+
+    def test_missing_files_are_reported_as_failures(self):
+        photo = self.create_photo(self.test_gallery_1, title="missing_photo")
+        Photo.objects.filter(pk=photo.pk).update(image="gallery/missing_photo.jpg")
+
+        output = self.shard_media()
+        self.assertIn(f"Photo #{photo.pk} failed", output)
+        self.assertIn("Moved 0 photos, 1 failed", output)
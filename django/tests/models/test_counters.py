@@ -0,0 +1,280 @@
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from core.jobs import run_pending
+from core.models import Job
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from gallery import counters
+from gallery.models import DailyViewers, Gallery, Photo
+from gallery.tasks import schedule_view_count_flushing
+from model_bakery import baker
+from tests.base_utils import BaseObjectUtils
+
+
+def redis_available():
+    try:
+        import redis
+
+        return redis.Redis.from_url("redis://localhost:6379", socket_connect_timeout=0.2).ping()
+    except Exception:  # noqa: B902 - no server, no client library
+        return False
+
+
+class CounterTestCase(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        counters.pending.clear()
+        counters.viewers.clear()
+        counters.last_flush = time.monotonic()
+        self.addCleanup(counters.pending.clear)
+        self.addCleanup(counters.viewers.clear)
+        self.photos = list(Photo.objects.order_by("pk"))
+        self.views = {photo.pk: photo.views for photo in self.photos}
+
+    def assertViews(self, added):
+        for photo in Photo.objects.filter(pk__in=self.views):
+            self.assertEqual(photo.views, self.views[photo.pk] + added.get(photo.pk, 0))
+        for gallery in Gallery.objects.all():
+            self.assertEqual(gallery.total_views, sum(photo.views for photo in gallery.photos.all()))
+
+
+class TestViewCounter(CounterTestCase):
+    def test_views_are_written_when_flushed(self):
+        photo = self.photos[0]
+        updated = photo.updated
+        self.client.login(**self.user_1_cred)
+        for _ in range(3):
+            response = self.client.get(photo.get_absolute_url(), HTTP_USER_AGENT="Mozilla/5.0")
+            self.assertEqual(response.status_code, 200)
+        self.assertViews({})
+
+        self.assertEqual(counters.flush(), 3)
+        self.assertViews({photo.pk: 3})
+        # Not saved, so no post_save receiver ran
+        self.assertEqual(Photo.objects.get(pk=photo.pk).updated, updated)
+        self.assertGreater(Gallery.objects.get(pk=photo.gallery_id).trending_score, 0)
+        self.assertEqual(counters.flush(), 0)
+
+    def test_views_are_flushed_after_the_interval(self):
+        counters.count_view(self.photos[0].pk)
+        self.assertViews({})
+        counters.last_flush -= 61
+        counters.count_view(self.photos[0].pk)
+        self.assertViews({self.photos[0].pk: 2})
+
+    @override_settings(PHOTO_VIEW_FLUSH_MAX=2)
+    def test_views_are_flushed_when_the_buffer_is_full(self):
+        counters.count_view(self.photos[0].pk)
+        self.assertViews({})
+        counters.count_view(self.photos[1].pk, count=4)
+        self.assertViews({self.photos[0].pk: 1, self.photos[1].pk: 4})
+
+    def test_flush_queries_do_not_grow_with_views(self):
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(200):
+                for photo in self.photos:
+                    counters.count_view(photo.pk)
+        self.assertEqual(len(queries), 0)
+
+        # Photos and galleries with the same count share an UPDATE
+        with CaptureQueriesContext(connection) as queries:
+            counters.flush()
+        flushed = len(queries)
+        self.assertViews({photo.pk: 200 for photo in self.photos})
+
+        # Nor with the number of photos and galleries viewed, as long as their counts are the same
+        self.assertEqual({photo.gallery_id for photo in self.photos}, {self.test_gallery_1.pk})
+        per_gallery = len(self.photos)
+        for index in range(20):
+            gallery = baker.make(Gallery, name=f"more_{index}", user=self.test_user_1, category=self.test_category)
+            self.photos += baker.make(Photo, gallery=gallery, _quantity=per_gallery)
+        for _ in range(1000):
+            for photo in self.photos:
+                counters.count_view(photo.pk)
+        with self.assertNumQueries(flushed):
+            counters.flush()
+        self.assertEqual(Photo.objects.get(pk=self.photos[-1].pk).views, 1000)
+
+    def test_job_flushes_views_and_reschedules_itself(self):
+        counters.count_view(self.photos[0].pk, count=3)
+        schedule_view_count_flushing()
+        schedule_view_count_flushing()
+        self.assertEqual(run_pending(), 1)
+        self.assertViews({self.photos[0].pk: 3})
+        job = Job.objects.get(task="gallery.flush_view_counts", status=Job.PENDING)
+        self.assertGreater(job.run_at, timezone.now())
+
+    def test_failed_flushes_keep_the_views(self):
+        counters.count_view(self.photos[0].pk, count=2)
+        with mock.patch.object(counters, "write", side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            counters.flush()
+        counters.flush()
+        self.assertViews({self.photos[0].pk: 2})
+
+    @override_settings(PHOTO_VIEW_FLUSH_MAX=1)
+    def test_failed_flush_does_not_fail_the_page_view(self):
+        photo = self.photos[0]
+        with mock.patch.object(counters, "write", side_effect=DatabaseError), self.assertLogs("gallery.counters"):
+            response = self.client.get(photo.get_absolute_url(), HTTP_USER_AGENT="Mozilla/5.0")
+        self.assertEqual(response.status_code, 200)
+        self.assertViews({})
+        counters.flush()
+        self.assertViews({photo.pk: 1})
+
+    def test_command_flushes_views(self):
+        counters.count_view(self.photos[0].pk, count=5)
+        out = StringIO()
+        call_command("flush_view_counts", stdout=out)
+        self.assertIn("Flushed 5 photo views", out.getvalue())
+        self.assertViews({self.photos[0].pk: 5})
+
+    def test_concurrent_views_and_flushes_count_every_view_once(self):
+        written, written_lock = Counter(), threading.Lock()
+
+        def write(counts):
+            with written_lock:
+                written.update(counts)
+            return sum(counts.values())
+
+        def view(index):
+            for number in range(2000):
+                counters.count_view(self.photos[(index + number) % len(self.photos)].pk)
+                if number % 250 == 0:
+                    counters.flush()
+
+        threads = [threading.Thread(target=view, args=(index,)) for index in range(8)]
+        started = time.perf_counter()
+        with mock.patch.object(counters, "write", side_effect=write):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            counters.flush()
+        elapsed = time.perf_counter() - started
+
+        expected = Counter(
+            self.photos[(index + number) % len(self.photos)].pk for index in range(8) for number in range(2000)
+        )
+        self.assertEqual(written, expected)
+        # Counting a view is a dictionary update, far from a database write
+        self.assertLess(elapsed, 10)
+
+
+class TestUniqueViewers(CounterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = self.photos[0]
+        self.url = self.photo.get_absolute_url()
+        self.today = timezone.localdate()
+        self.client.defaults["HTTP_USER_AGENT"] = "Mozilla/5.0 (X11; Linux x86_64) Firefox/115.0"
+
+    def test_viewers_are_counted_once_a_day(self):
+        for _ in range(3):
+            self.client.get(self.url)
+        self.client.login(**self.user_1_cred)
+        self.client.get(self.url)
+        self.client.get(self.url)
+        # A third viewer, without a session
+        self.client.logout()
+        self.client.get(self.url, REMOTE_ADDR="10.0.0.7")
+        counters.flush()
+
+        self.assertViews({self.photo.pk: 6})
+        row = DailyViewers.objects.get(photo=self.photo, day=self.today)
+        self.assertEqual((row.gallery_id, row.viewers), (self.photo.gallery_id, 3))
+        gallery_row = DailyViewers.objects.get(gallery=self.photo.gallery_id, photo=None, day=self.today)
+        self.assertEqual(gallery_row.viewers, 3)
+
+        # Sketches are merged into the stored ones, viewers seen today already are not counted again
+        self.client.login(**self.user_1_cred)
+        self.client.get(self.url)
+        counters.flush()
+        self.assertEqual(DailyViewers.objects.get(photo=self.photo, day=self.today).viewers, 3)
+
+    def test_viewer_queries_do_not_grow_with_photos(self):
+        def flush_viewers(photos):
+            for photo in photos:
+                counters.count_view(photo.pk, viewer="session:1")
+            with CaptureQueriesContext(connection) as queries:
+                counters.write_viewers(counters.viewers)
+            counters.viewers.clear()
+            return len(queries)
+
+        # First flush of the day creates the rows, the second updates them
+        first = flush_viewers(self.photos[:1])
+        photos = self.photos + baker.make(Photo, gallery=self.photo.gallery, _quantity=10)
+        self.assertEqual(flush_viewers(photos), first)
+        self.assertEqual(flush_viewers(photos), first)
+        self.assertEqual(DailyViewers.objects.filter(day=self.today, photo__isnull=False).count(), len(photos))
+        self.assertEqual(DailyViewers.objects.get(gallery=self.photo.gallery_id, photo=None, day=self.today).viewers, 1)
+
+    def test_bots_are_not_counted(self):
+        for user_agent in ("Googlebot/2.1 (+http://www.google.com/bot.html)", "python-requests/2.31", ""):
+            self.assertEqual(self.client.get(self.url, HTTP_USER_AGENT=user_agent).status_code, 200)
+        counters.flush()
+        self.assertViews({})
+        self.assertFalse(DailyViewers.objects.exists())
+
+    def test_unique_viewers_over_a_range_of_days(self):
+        yesterday = self.today - timedelta(days=1)
+        for day, viewers in ((yesterday, range(0, 300)), (self.today, range(200, 400))):
+            with mock.patch("gallery.counters.timezone.localdate", return_value=day):
+                for viewer in viewers:
+                    counters.count_view(self.photo.pk, viewer=f"session:{viewer}")
+                    counters.count_view(self.photos[1].pk, viewer=f"session:{viewer + 1000}")
+        counters.flush()
+
+        def unique(start, end, **kwargs):
+            return DailyViewers.objects.unique_viewers(start, end, **kwargs)
+
+        self.assertAlmostEqual(unique(yesterday, yesterday, photo=self.photo), 300, delta=15)
+        self.assertAlmostEqual(unique(yesterday, self.today, photo=self.photo), 400, delta=20)
+        gallery = self.photo.gallery
+        expected = 400 * Photo.objects.filter(pk__in=[self.photo.pk, self.photos[1].pk], gallery=gallery).count()
+        self.assertAlmostEqual(unique(yesterday, self.today, gallery=gallery), expected, delta=expected * 0.05)
+        self.assertEqual(unique(self.today + timedelta(days=1), self.today + timedelta(days=9), photo=self.photo), 0)
+
+
+@skipUnless(redis_available(), "Needs a Redis server on localhost:6379")
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": "redis://localhost:6379/15",
+            "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
+        }
+    }
+)
+class TestRedisViewCounter(CounterTestCase):
+    def setUp(self):
+        super().setUp()
+        counters.redis_connection().delete(counters.KEY)
+
+    def test_views_are_buffered_in_redis(self):
+        counters.count_view(self.photos[0].pk)
+        counters.count_view(self.photos[0].pk, count=2)
+        self.assertEqual(counters.pending, Counter())
+        # Page views never flush the Redis buffer, the gallery.flush_view_counts job does
+        counters.last_flush -= 61
+        counters.count_view(self.photos[0].pk, viewer="session:1")
+        self.assertViews({})
+        self.assertEqual(counters.flush(), 4)
+        self.assertViews({self.photos[0].pk: 4})
+
+    def test_views_are_buffered_in_memory_while_redis_is_down(self):
+        with mock.patch.object(counters, "redis_connection") as redis_connection:
+            redis_connection.return_value.pipeline.side_effect = counters.RedisError
+            counters.count_view(self.photos[0].pk)
+        self.assertEqual(counters.pending, Counter({self.photos[0].pk: 1}))
+        counters.flush()
+        self.assertViews({self.photos[0].pk: 1})
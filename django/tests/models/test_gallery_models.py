@@ -0,0 +1,112 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from gallery.models import Gallery, Photo
+from tests.base_utils import BaseObjectUtils
+
+
+class TestGalleryCounters(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+
+    def assertCounters(self, gallery):
+        """The gallery's stored counters and cover match its photos"""
+        gallery.refresh_from_db()
+        photos = gallery.photos.all()
+        self.assertEqual(gallery.photo_count, len(photos))
+        self.assertEqual(gallery.total_views, sum(photo.views for photo in photos))
+        self.assertEqual(gallery.total_downloads, sum(photo.downloads for photo in photos))
+        self.assertEqual(gallery.cover, photos.filter(is_cover=True).order_by("pk").first())
+
+    def test_fixtures_are_counted(self):
+        for gallery in Gallery.objects.all():
+            self.assertCounters(gallery)
+        self.assertGreater(self.test_gallery_1.photo_count, 0)
+
+    def test_photos_are_counted_as_they_are_created_and_deleted(self):
+        gallery = Gallery.objects.create(name="counted_gallery", user=self.test_user_1, category=self.test_category)
+        first = self.create_photo(gallery, title="first_image")
+        self.assertCounters(gallery)
+        self.assertEqual(gallery.cover, first)
+
+        second = Photo.objects.create(title="second_image", image=first.image.name, gallery=gallery, views=5)
+        self.assertCounters(gallery)
+        self.assertEqual((gallery.photo_count, gallery.total_views), (2, 5))
+
+        first.delete()
+        self.assertCounters(gallery)
+        self.assertIsNone(gallery.cover)
+        second.delete()
+        self.assertCounters(gallery)
+
+    def test_views_and_downloads_are_counted(self):
+        photo = self.create_photo(self.test_gallery_1, title="counted_image")
+        photo.views += 3
+        photo.save(update_fields=["views"])
+        self.assertCounters(self.test_gallery_1)
+
+        response = self.client.get(photo.get_download_url())
+        b"".join(response.streaming_content)
+        self.assertCounters(self.test_gallery_1)
+
+    def test_cover_is_toggled(self):
+        photo = self.create_photo(self.test_gallery_1, title="cover_image")
+        photo.is_cover = True
+        photo.save()
+        self.assertCounters(self.test_gallery_1)
+        self.assertEqual(self.test_gallery_1.cover, photo)
+
+        photo.is_cover = False
+        photo.save()
+        self.assertCounters(self.test_gallery_1)
+        self.assertIsNone(self.test_gallery_1.cover)
+
+    def test_transferred_photos_move_between_galleries(self):
+        photo = self.create_photo(self.test_gallery_1, title="moved_image")
+        photo.views, photo.downloads, photo.is_cover = 7, 2, True
+        photo.save(update_fields=["views", "downloads", "is_cover"])
+
+        self.client.login(**self.user_1_cred)
+        self.client.post(
+            reverse("gallery:photo-transfer", kwargs={"pk": photo.pk}), {"gallery": self.test_gallery_2.pk}
+        )
+        for gallery in (self.test_gallery_1, self.test_gallery_2):
+            self.assertCounters(gallery)
+        self.assertIsNone(self.test_gallery_1.cover)
+        self.assertEqual(self.test_gallery_2.cover, photo)
+
+    def test_saving_a_loaded_photo_keeps_its_counters(self):
+        photo = self.create_photo(self.test_gallery_1, title="counted_image")
+        stale = Photo.objects.get(pk=photo.pk)
+        Photo.objects.filter(pk=photo.pk).update(views=5, downloads=2)
+        Gallery.objects.count_photos(self.test_gallery_1.pk, views=5, downloads=2)
+
+        stale.is_cover = True
+        stale.save()
+        self.assertEqual(Photo.objects.values_list("views", "downloads").get(pk=photo.pk), (5, 2))
+        self.assertCounters(self.test_gallery_1)
+        stale.gallery = self.test_gallery_2
+        stale.save()
+        for gallery in (self.test_gallery_1, self.test_gallery_2):
+            self.assertCounters(gallery)
+        self.assertEqual(self.test_gallery_2.total_views, 5)
+
+    def test_saving_a_gallery_keeps_its_counters(self):
+        stale = Gallery.objects.get(pk=self.test_gallery_1.pk)
+        self.create_photo(self.test_gallery_1, title="added_image")
+        stale.name = "renamed_gallery"
+        stale.save()
+        self.assertCounters(self.test_gallery_1)
+        self.assertEqual(self.test_gallery_1.name, "renamed_gallery")
+
+    def test_recount_command_repairs_counters(self):
+        Gallery.objects.update(photo_count=99, total_views=0, total_downloads=0, cover=None)
+        out = StringIO()
+        call_command("recount_galleries", chunk_size=1, stdout=out)
+        self.assertIn(f"Recounted {Gallery.objects.count()} galleries", out.getvalue())
+        for gallery in Gallery.objects.all():
+            self.assertCounters(gallery)
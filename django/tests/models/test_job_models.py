@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+from core import jobs
+from core.models import Job
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+CALLS = []
+
+
+@jobs.task("tests.record")
+def record(value):
+    CALLS.append(value)
+
+
+@jobs.task("tests.fail")
+def fail():
+    raise ValueError("task failed")
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=30, JOB_VISIBILITY_TIMEOUT=60)
+class TestJobQueue(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueued_job_runs_once(self):
+        job = jobs.enqueue("tests.record", value=1)
+        self.assertEqual(job.status, Job.PENDING)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(CALLS, [1])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+
+    def test_enqueue_unknown_task_raises(self):
+        with self.assertRaises(KeyError):
+            jobs.enqueue("tests.does_not_exist")
+
+    def test_delayed_job_waits_for_run_at(self):
+        jobs.enqueue("tests.record", run_at=timezone.now() + timedelta(minutes=5), value=1)
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(CALLS, [])
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        job = jobs.enqueue("tests.fail")
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertIn("task failed", job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        # retry is due
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        jobs.enqueue("tests.record", value=1)
+        self.assertIsNotNone(jobs.claim_job())
+        self.assertIsNone(jobs.claim_job())
+
+    def test_job_is_reclaimed_after_visibility_timeout(self):
+        job = jobs.enqueue("tests.record", value=1)
+        claimed = jobs.claim_job()
+        self.assertEqual(claimed.pk, job.pk)
+
+        # worker died without finishing the job
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = jobs.claim_job()
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+
+        # out of attempts
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(jobs.claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_outcome_of_a_reclaimed_job_is_left_to_its_new_worker(self):
+        job = jobs.enqueue("tests.fail")
+        stale = jobs.claim_job()
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = jobs.claim_job()
+
+        # The first worker finishes late, the job is still running under the second
+        self.assertFalse(jobs.run_job(stale))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), (Job.RUNNING, ""))
+
+        jobs.run_job(reclaimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("task failed", job.last_error)
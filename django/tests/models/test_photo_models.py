@@ -0,0 +1,322 @@
+import os
+
+from core.api.serializers import PhotoSerializer
+from core.jobs import run_pending
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from gallery.models import Blob, Photo, Rate, User
+from PIL import Image
+from tests.base_utils import TEST_IMAGE_DIR, BaseObjectUtils
+
+
+class TestPhotoRenditions(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_renditions_are_created_on_upload(self):
+        photo = self.create_photo(self.test_gallery_1, title="rendition_image")
+        self.assertFalse(photo.renditions.exists())
+        run_pending()
+
+        renditions = {rendition.name: rendition for rendition in photo.renditions.all()}
+        self.assertEqual(set(renditions), set(settings.PHOTO_RENDITIONS))
+
+        for name, (width, height) in settings.PHOTO_RENDITIONS.items():
+            rendition = renditions[name]
+            self.assertLessEqual(rendition.width, width)
+            self.assertLessEqual(rendition.height, height)
+            with Image.open(rendition.image.path) as image:
+                self.assertEqual(image.size, (rendition.width, rendition.height))
+
+    def test_original_image_is_not_resized(self):
+        photo = self.create_photo(self.test_gallery_1, title="original_image")
+        run_pending()
+        with Image.open(photo.image.path) as image:
+            self.assertEqual(image.size, (1280, 720))
+
+    def test_rendition_url_falls_back_to_original_image(self):
+        photo = self.create_photo(self.test_gallery_1, title="fallback_image")
+        run_pending()
+        card = photo.renditions.get(name="card")
+        self.assertEqual(photo.rendition_url("card"), card.get_absolute_url())
+
+        photo.renditions.all().delete()
+        self.assertEqual(photo.rendition_url("card"), photo.image.url)
+
+
+class TestPhotoMetadata(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_image_metadata_is_stored_on_upload(self):
+        photo = self.create_photo(self.test_gallery_1, title="metadata_image")
+        photo.refresh_from_db()
+        self.assertEqual((photo.width, photo.height), (1280, 720))
+        self.assertEqual(photo.content_type, "image/jpeg")
+        self.assertEqual(photo.file_size, photo.image.size)
+        self.assertEqual(len(photo.content_hash), 64)
+        self.assertEqual(photo.mime_type(), "image/jpeg")
+        self.assertEqual(photo.dimension(), "720 X 1280")
+
+    def test_photo_detail_renders_without_the_image_file(self):
+        photo = self.create_photo(self.test_gallery_1, title="missing_file_image")
+        os.remove(photo.image.path)
+
+        self.client.login(**self.user_1_cred)
+        response = self.client.get(photo.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "image/jpeg")
+        self.assertContains(response, "720 X 1280")
+
+    @override_settings(PHOTO_MAX_DECODE_BYTES=1280 * 720 * 4 - 1)
+    def test_upload_over_the_decode_ceiling_is_rejected(self):
+        photo = Photo(title="too_large", gallery=self.test_gallery_1, image=self.create_fake_image("too_large"))
+        with self.assertRaisesMessage(ValidationError, "resolution is too large"):
+            photo.full_clean()
+
+
+class TestPhotoStorage(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        second = self.create_photo(self.test_gallery_2, title="second_upload")
+        other = self.create_photo(self.test_gallery_1, title="other_upload", path="test_blank_image.jpg")
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(
+            first.image.name, f"gallery/{first.content_hash[:2]}/{first.content_hash[2:4]}/{first.content_hash}.jpg"
+        )
+        self.assertEqual(Blob.objects.get(name=first.image.name).ref_count, 2)
+
+    def test_stored_extension_follows_the_image_format(self):
+        with open(os.path.join(TEST_IMAGE_DIR, "test_image.jpg"), "rb") as image_file:
+            content = image_file.read()
+        names = []
+        for index, name in enumerate(["upper.JPG", "long.jpeg", "wrong.png"]):
+            image = SimpleUploadedFile(name=name, content=content, content_type="image/jpeg")
+            names.append(
+                Photo.objects.create(title=f"upload_{index}", image=image, gallery=self.test_gallery_1).image.name
+            )
+
+        self.assertEqual(len(set(names)), 1)
+        self.assertTrue(names[0].endswith(".jpg"))
+        self.assertEqual(Blob.objects.get(name=names[0]).ref_count, 3)
+
+    def test_file_uploaded_again_while_unused_is_kept(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        name = first.image.name
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        # The same content is uploaded again before the deletion runs
+        second = self.create_photo(self.test_gallery_2, title="second_upload")
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(os.path.exists(second.image.path))
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+
+    def test_file_is_deleted_with_the_last_photo_using_it(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        run_pending()
+        second = self.create_photo(self.test_gallery_2, title="second_upload")
+        paths = [first.image.path] + [rendition.image.path for rendition in first.renditions.all()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        self.assertEqual(Blob.objects.get(name=second.image.name).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertFalse(Blob.objects.filter(name=second.image.name).exists())
+
+    def test_duplicate_upload_reuses_renditions(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        run_pending()
+        second = self.create_photo(self.test_gallery_2, title="second_upload")
+
+        self.assertEqual(run_pending(), 0)
+        self.assertEqual(
+            sorted(second.renditions.values_list("name", "image")),
+            sorted(first.renditions.values_list("name", "image")),
+        )
+
+    def test_photo_set_to_another_stored_image_is_processed_again(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        other = self.create_photo(self.test_gallery_1, title="other_upload", path="test_blank_image.jpg")
+        run_pending()
+        first.refresh_from_db()
+        previous = other.image.name
+
+        other.image = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        # Reuses the renditions and preview of the now identical photo
+        self.assertEqual(run_pending(), 0)
+        other.refresh_from_db()
+        self.assertEqual((other.content_hash, other.phash), (first.content_hash, first.phash))
+        self.assertEqual(
+            sorted(other.renditions.values_list("name", "image")),
+            sorted(first.renditions.values_list("name", "image")),
+        )
+        self.assertEqual(Blob.objects.get(name=first.image.name).ref_count, 2)
+        self.assertFalse(Blob.objects.filter(name=previous).exists())
+
+        # Saving it again changes nothing
+        other.title = "renamed_upload"
+        other.save()
+        self.assertEqual(other.renditions.count(), len(settings.PHOTO_RENDITIONS))
+        self.assertEqual(run_pending(), 0)
+
+
+class TestPhotoPerceptualHash(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_perceptual_hash_is_computed_with_renditions(self):
+        photo = self.create_photo(self.test_gallery_1, title="hashed_image")
+        run_pending()
+        photo.refresh_from_db()
+        self.assertEqual(len(photo.phash), 16)
+        self.assertEqual(photo.phash_0, int(photo.phash[:4], 16))
+        self.assertEqual(photo.phash_3, int(photo.phash[12:], 16))
+
+    def test_duplicate_upload_copies_the_perceptual_hash(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        run_pending()
+        second = self.create_photo(self.test_gallery_2, title="second_upload")
+        second.refresh_from_db()
+        first.refresh_from_db()
+        self.assertEqual(second.phash, first.phash)
+        self.assertEqual(first.near_duplicates(distance=0), [(second, 0)])
+
+    def test_admin_action_lists_near_duplicates(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        run_pending()
+        second = self.create_photo(self.test_gallery_2, title="second_upload")
+        User.objects.filter(pk=self.test_user_1.pk).update(is_staff=True, is_superuser=True)
+
+        self.client.login(**self.user_1_cred)
+        response = self.client.post(
+            reverse("admin:gallery_photo_changelist"),
+            {"action": "find_near_duplicates", "_selected_action": [first.pk]},
+        )
+        self.assertRedirects(response, f"{reverse('admin:gallery_photo_changelist')}?id__in={first.pk},{second.pk}")
+
+
+class TestPhotoPlaceholders(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_placeholders_are_computed_with_renditions(self):
+        photo = self.create_photo(self.test_gallery_1, title="placeholder_image")
+        run_pending()
+        photo.refresh_from_db()
+        self.assertEqual(len(photo.blurhash), 28)
+        self.assertRegex(photo.dominant_color, r"^#[0-9a-f]{6}$")
+
+        data = PhotoSerializer(photo).data
+        self.assertEqual(data["blurhash"], photo.blurhash)
+        self.assertEqual(data["dominant_color"], photo.dominant_color)
+
+    def test_duplicate_upload_copies_the_placeholders(self):
+        first = self.create_photo(self.test_gallery_1, title="first_upload")
+        run_pending()
+        second = self.create_photo(self.test_gallery_2, title="second_upload")
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((second.blurhash, second.dominant_color), (first.blurhash, first.dominant_color))
+
+    def test_placeholder_style_tag(self):
+        template = Template("{% load gallery_extras %}{% placeholder_style photo %}")
+        photo = self.create_photo(self.test_gallery_1, title="placeholder_image")
+        self.assertEqual(template.render(Context({"photo": photo})), "")
+        self.assertEqual(template.render(Context({"photo": None})), "")
+
+        run_pending()
+        photo.refresh_from_db()
+        style = template.render(Context({"photo": photo}))
+        self.assertIn(f"background-color:{photo.dominant_color}", style)
+        self.assertIn("background-image:url(data:image/png;base64,", style)
+
+
+class TestPhotoExifMetadata(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_exif_is_stored_on_upload(self):
+        photo = Photo.objects.create(
+            title="phone_photo", gallery=self.test_gallery_1, image=self.create_exif_image("phone", orientation=6)
+        )
+        photo.refresh_from_db()
+        self.assertEqual((photo.camera_make, photo.camera_model), ("Apple", "iPhone 13"))
+        self.assertEqual((photo.width, photo.height), (200, 300))
+        self.assertEqual(photo.taken_at.isoformat(), "2023-07-14T16:30:05+00:00")
+        self.assertQuerysetEqual(Photo.objects.filter(taken_at__year=2023), [photo])
+
+        run_pending()
+        grid = photo.renditions.get(name="grid")
+        self.assertEqual((grid.width, grid.height), (200, 300))
+
+    def test_location_is_only_visible_to_the_owner(self):
+        photo = Photo.objects.create(
+            title="phone_photo", gallery=self.test_gallery_1, image=self.create_exif_image("phone")
+        )
+        self.assertTrue(photo.location_visible_to(self.test_gallery_1.user))
+        self.assertFalse(photo.location_visible_to(self.test_user_2))
+        with override_settings(PHOTO_PUBLIC_LOCATION=True):
+            self.assertTrue(photo.location_visible_to(self.test_user_2))
+
+
+class TestPhotoRates(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        self.photo, self.other_photo = self.test_gallery_1.photos.order_by("pk")
+
+    def assertCounts(self, photo, likes, stars):
+        photo = Photo.objects.get(pk=photo.pk)
+        self.assertEqual((photo.like_count, photo.star_count), (likes, stars))
+        self.assertEqual((photo.total_likes(), photo.total_stars()), (likes, stars))
+
+    def test_rating_is_an_idempotent_upsert(self):
+        for _ in range(2):
+            rate = Rate.objects.rate(self.test_user_2, self.photo, like=True)
+        self.assertCounts(self.photo, 1, 0)
+        Rate.objects.rate(self.test_user_1, self.photo, like=True, star=True)
+        Rate.objects.rate(self.test_user_2, self.photo, star=True)
+        self.assertCounts(self.photo, 2, 2)
+
+        for _ in range(2):
+            Rate.objects.rate(self.test_user_2, self.photo, like=False)
+        self.assertCounts(self.photo, 1, 2)
+        self.assertEqual(Rate.objects.filter(photo=self.photo).count(), 2)
+        rate.refresh_from_db()
+        self.assertEqual((rate.like, rate.star), (False, True))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rate.objects.create(user=self.test_user_2, photo=self.photo, like=True)
+
+    def test_counts_follow_edited_and_deleted_rates(self):
+        rate = Rate.objects.rate(self.test_user_2, self.photo, like=True, star=True)
+        rate.photo = self.other_photo
+        rate.star = False
+        rate.save()
+        self.assertCounts(self.photo, 0, 0)
+        self.assertCounts(self.other_photo, 1, 0)
+        rate.delete()
+        self.assertCounts(self.other_photo, 0, 0)
+
+    def test_saving_a_loaded_photo_keeps_its_counts(self):
+        photo = Photo.objects.get(pk=self.photo.pk)
+        Rate.objects.rate(self.test_user_2, self.photo, like=True)
+        photo.title = "renamed_photo"
+        photo.save()
+        self.assertCounts(self.photo, 1, 0)
+        self.assertEqual(Photo.objects.recount_rates(), Photo.objects.count())
+        self.assertCounts(self.photo, 1, 0)
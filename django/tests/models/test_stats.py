@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+
+from core.jobs import run_pending
+from core.models import Job
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from gallery import counters
+from gallery.models import Photo, StatsBucket
+from gallery.tasks import downsample_stats
+from tests.base_utils import BaseObjectUtils
+
+
+def hour(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class TestStatsBuckets(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        counters.pending.clear()
+        counters.viewers.clear()
+        self.addCleanup(counters.pending.clear)
+        self.addCleanup(counters.viewers.clear)
+        self.photo_1, self.photo_2 = self.test_gallery_1.photos.order_by("pk")
+        self.gallery_id = self.test_gallery_1.pk
+
+    def bucket(self, period, start, photo=None):
+        return StatsBucket.objects.get(period=period, start=start, photo=photo, gallery_id=self.gallery_id)
+
+    def test_counts_are_added_to_photo_and_gallery_buckets_of_the_hour(self):
+        when = hour(2021, 6, 1, 10, 25)
+        StatsBucket.objects.add({(self.photo_1.pk, self.gallery_id): (3, 1)}, when=when)
+        StatsBucket.objects.add(
+            {(self.photo_1.pk, self.gallery_id): (2, 0), (self.photo_2.pk, self.gallery_id): (2, 0)}, when=when
+        )
+        start = hour(2021, 6, 1, 10)
+        self.assertEqual(StatsBucket.objects.count(), 3)
+        bucket = self.bucket(StatsBucket.HOUR, start, self.photo_1)
+        self.assertEqual((bucket.views, bucket.downloads), (5, 1))
+        bucket = self.bucket(StatsBucket.HOUR, start)
+        self.assertEqual((bucket.views, bucket.downloads), (7, 1))
+
+    def test_flushed_views_and_downloads_are_counted(self):
+        counters.count_view(self.photo_1.pk, count=4)
+        counters.flush()
+        photo = self.create_photo(self.test_gallery_1, title="downloaded_photo")
+        run_pending()
+        self.client.login(**self.user_1_cred)
+        self.client.get(reverse("gallery:photo-download", kwargs={"pk": photo.pk}))
+
+        start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.assertEqual(self.bucket(StatsBucket.HOUR, start, self.photo_1).views, 4)
+        self.assertEqual(self.bucket(StatsBucket.HOUR, start, photo).downloads, 1)
+        bucket = self.bucket(StatsBucket.HOUR, start)
+        self.assertEqual((bucket.views, bucket.downloads), (4, 1))
+
+    def test_old_buckets_are_downsampled(self):
+        key = (self.photo_1.pk, self.gallery_id)
+        StatsBucket.objects.add({key: (1, 0)}, when=hour(2021, 6, 1, 9))
+        StatsBucket.objects.add({key: (2, 1)}, when=hour(2021, 6, 1, 23))
+        StatsBucket.objects.add({key: (4, 0)}, when=hour(2021, 6, 2, 0))
+
+        self.assertEqual(StatsBucket.objects.downsample(StatsBucket.HOUR, StatsBucket.DAY, hour(2021, 6, 2)), 4)
+        self.assertFalse(StatsBucket.objects.filter(period=StatsBucket.HOUR, start__lt=hour(2021, 6, 2)).exists())
+        bucket = self.bucket(StatsBucket.DAY, hour(2021, 6, 1), self.photo_1)
+        self.assertEqual((bucket.views, bucket.downloads), (3, 1))
+        self.assertEqual(self.bucket(StatsBucket.DAY, hour(2021, 6, 1)).views, 3)
+
+        # Buckets downsampled later add up with those downsampled before
+        StatsBucket.objects.add({key: (5, 0)}, when=hour(2021, 6, 1, 12))
+        StatsBucket.objects.downsample(StatsBucket.HOUR, StatsBucket.DAY, hour(2021, 6, 2))
+        self.assertEqual(self.bucket(StatsBucket.DAY, hour(2021, 6, 1), self.photo_1).views, 8)
+
+        StatsBucket.objects.downsample(StatsBucket.DAY, StatsBucket.MONTH, hour(2021, 7, 1))
+        self.assertEqual(self.bucket(StatsBucket.MONTH, hour(2021, 6, 1), self.photo_1).views, 8)
+        self.assertEqual(self.bucket(StatsBucket.HOUR, hour(2021, 6, 2), self.photo_1).views, 4)
+
+    def test_series_sums_finer_buckets(self):
+        key = (self.photo_1.pk, self.gallery_id)
+        StatsBucket.objects.add({key: (1, 0)}, when=hour(2021, 6, 1, 9))
+        StatsBucket.objects.downsample(StatsBucket.HOUR, StatsBucket.DAY, hour(2021, 6, 2))
+        StatsBucket.objects.add({key: (2, 0)}, when=hour(2021, 6, 1, 10))
+        StatsBucket.objects.add({key: (3, 1)}, when=hour(2021, 6, 3, 10))
+        StatsBucket.objects.add({(self.photo_2.pk, self.gallery_id): (1, 0)}, when=hour(2021, 6, 3, 11))
+
+        series = StatsBucket.objects.series(
+            StatsBucket.DAY, hour(2021, 6, 1), hour(2021, 6, 4), gallery=self.test_gallery_1
+        )
+        self.assertEqual(series, [(hour(2021, 6, 1), 3, 0), (hour(2021, 6, 3), 4, 1)])
+        series = StatsBucket.objects.series(StatsBucket.HOUR, hour(2021, 6, 3), hour(2021, 6, 4), photo=self.photo_1)
+        self.assertEqual(series, [(hour(2021, 6, 3, 10), 3, 1)])
+        series = StatsBucket.objects.series(StatsBucket.MONTH, hour(2021, 6, 1), hour(2021, 7, 1), photo=self.photo_1)
+        self.assertEqual(series, [(hour(2021, 6, 1), 6, 1)])
+
+    def test_gallery_buckets_outlive_their_photos(self):
+        StatsBucket.objects.add({(self.photo_1.pk, self.gallery_id): (3, 0)}, when=hour(2021, 6, 1, 9))
+        Photo.objects.filter(pk=self.photo_1.pk).delete()
+        self.assertEqual(self.bucket(StatsBucket.HOUR, hour(2021, 6, 1, 9)).views, 3)
+        self.assertFalse(StatsBucket.objects.filter(photo__isnull=False).exists())
+
+    def test_downsampling_job_reschedules_itself(self):
+        run_pending()
+        old = timezone.now() - timedelta(days=30)
+        StatsBucket.objects.add({(self.photo_1.pk, self.gallery_id): (1, 0)}, when=old)
+        StatsBucket.objects.add({(self.photo_1.pk, self.gallery_id): (1, 0)})
+        downsample_stats()
+        self.assertEqual(
+            set(StatsBucket.objects.filter(photo=self.photo_1).values_list("period", flat=True)),
+            {StatsBucket.HOUR, StatsBucket.DAY},
+        )
+        job = Job.objects.get(task="gallery.downsample_stats")
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(run_pending(), 0)
@@ -0,0 +1,118 @@
+from datetime import timedelta
+from io import StringIO
+
+from core.jobs import run_pending
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from gallery import counters, trending
+from gallery.models import Category, Gallery, GalleryFeed, Photo, Rate, TrendingEpoch
+from gallery.tasks import build_gallery_feed
+from tests.base_utils import BaseObjectUtils
+
+DAY = 24 * 60 * 60
+
+
+@override_settings(TRENDING_HALF_LIFE=DAY, TRENDING_WEIGHTS={"view": 1, "download": 3, "like": 5})
+class TestTrendingScores(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        Gallery.objects.update(trending_score=0)
+        Category.objects.update(trending_score=0)
+        # Views buffered by other tests
+        counters.pending.clear()
+        self.epoch = trending.current_epoch()
+
+    def score(self, gallery, now):
+        gallery.refresh_from_db()
+        return gallery.trending_score * trending.decay_factor(now)
+
+    def test_events_decay_by_half_every_half_life(self):
+        now = self.epoch.started + timedelta(days=10)
+        trending.record_event(self.test_gallery_1.pk, "view", count=4, when=now)
+        trending.record_event(self.test_gallery_1.pk, "download", when=now)
+        self.assertAlmostEqual(self.score(self.test_gallery_1, now), 7)
+        self.assertAlmostEqual(self.score(self.test_gallery_1, now + timedelta(days=1)), 3.5)
+        self.test_category.refresh_from_db()
+        self.assertAlmostEqual(self.test_category.trending_score, self.test_gallery_1.trending_score)
+
+        # A like today outranks 4 views and a download 2 days ago, without rewriting the older score
+        trending.record_event(self.test_gallery_2.pk, "like", when=now + timedelta(days=2))
+        ranking = Gallery.objects.order_by("-trending_score").values_list("pk", flat=True)
+        self.assertEqual(list(ranking[:2]), [self.test_gallery_2.pk, self.test_gallery_1.pk])
+
+    def test_events_of_several_galleries_add_up_in_their_categories(self):
+        now = self.epoch.started + timedelta(days=1)
+        self.test_gallery_2.category = self.test_gallery_1.category
+        self.test_gallery_2.save()
+        with self.assertNumQueries(4):
+            trending.record_events("view", {self.test_gallery_1.pk: 3, self.test_gallery_2.pk: 3}, when=now)
+        trending.record_events("view", {self.test_gallery_2.pk: 1}, when=now)
+
+        self.assertAlmostEqual(self.score(self.test_gallery_1, now), 3)
+        self.assertAlmostEqual(self.score(self.test_gallery_2, now), 4)
+        category = Category.objects.get(pk=self.test_gallery_1.category_id)
+        self.assertAlmostEqual(category.trending_score * trending.decay_factor(now), 7)
+
+    def test_rebase_keeps_decayed_scores(self):
+        now = self.epoch.started + timedelta(days=30)
+        trending.record_event(self.test_gallery_1.pk, "like", when=now)
+        trending.record_event(self.test_gallery_2.pk, "view", when=now)
+        stored = Gallery.objects.get(pk=self.test_gallery_1.pk).trending_score
+        self.assertAlmostEqual(stored, 5 * 2**30)
+
+        trending.rebase(now)
+        self.assertEqual(trending.current_epoch().started, now)
+        self.assertAlmostEqual(self.score(self.test_gallery_1, now), 5)
+        self.assertAlmostEqual(self.score(self.test_gallery_2, now), 1)
+        self.assertAlmostEqual(Gallery.objects.get(pk=self.test_gallery_1.pk).trending_score, 5)
+        self.assertEqual(TrendingEpoch.objects.count(), 1)
+
+    def test_rebase_command(self):
+        out = StringIO()
+        call_command("rebase_trending", stdout=out)
+        self.assertIn("Trending scores rebased", out.getvalue())
+
+    def test_feed_job_rebases_old_epochs(self):
+        TrendingEpoch.objects.update(started=timezone.now() - timedelta(days=8))
+        build_gallery_feed()
+        self.assertGreater(trending.current_epoch().started, timezone.now() - timedelta(minutes=1))
+        self.assertTrue(GalleryFeed.objects.exists())
+
+    def test_views_downloads_and_likes_are_recorded(self):
+        photo = self.create_photo(self.test_gallery_1, title="trending_photo")
+        run_pending()
+        self.client.login(**self.user_1_cred)
+        self.client.get(photo.get_absolute_url(), HTTP_USER_AGENT="Mozilla/5.0")
+        counters.flush()
+        self.client.get(reverse("gallery:photo-download", kwargs={"pk": photo.pk}))
+        Rate.objects.create(photo=photo, user=self.test_user_2, like=True)
+        self.assertAlmostEqual(self.score(self.test_gallery_1, timezone.now()), 9, places=3)
+        self.assertEqual(Gallery.objects.get(pk=self.test_gallery_2.pk).trending_score, 0)
+
+    def test_toggling_a_like_counts_it_once(self):
+        photo = self.create_photo(self.test_gallery_1, title="toggled_photo")
+        now = timezone.now()
+        rate = Rate.objects.rate(self.test_user_2, photo, like=True)
+        liked = self.score(self.test_gallery_1, now)
+        self.assertAlmostEqual(liked, 5, places=3)
+        for _ in range(3):
+            Rate.objects.rate(self.test_user_2, photo, like=False)
+            Rate.objects.rate(self.test_user_2, photo, like=True)
+        rate.like = False
+        rate.save()
+        rate.like = True
+        rate.save()
+
+        self.assertAlmostEqual(self.score(self.test_gallery_1, now), liked)
+        self.assertEqual(Photo.objects.get(pk=photo.pk).like_count, 1)
+
+    def test_gallery_list_shows_trending_galleries_and_categories(self):
+        trending.record_event(self.test_gallery_1.pk, "like")
+        response = self.client.get(reverse("gallery:gallery-list"))
+        self.assertEqual(response.context["trending_galleries"][0], self.test_gallery_1)
+        self.assertEqual(response.context["top_category"][0], self.test_gallery_1.category)
+        self.assertContains(response, "Trending Galleries")
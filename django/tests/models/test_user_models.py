@@ -0,0 +1,48 @@
+import os
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from PIL import Image
+from tests.base_utils import BaseObjectUtils
+from users.models import User
+
+
+class TestUserAvatar(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+
+    def test_avatar_is_created_with_the_profile_image(self):
+        self.test_user_1.image = self.create_fake_image("profile")
+        self.test_user_1.save()
+        with Image.open(self.test_user_1.avatar.path) as avatar:
+            self.assertEqual((avatar.format, avatar.size), ("JPEG", (96, 96)))
+        self.assertEqual(self.test_user_1.get_avatar_url(), self.test_user_1.avatar.url)
+
+        avatar_path = self.test_user_1.avatar.path
+        self.test_user_1.image = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.test_user_1.save()
+        self.assertFalse(self.test_user_1.avatar)
+        self.assertFalse(os.path.exists(avatar_path))
+        self.assertEqual(self.test_user_1.get_avatar_url(), self.test_user_1.get_profile_pic())
+
+    def test_saving_without_a_new_image_keeps_the_avatar(self):
+        self.test_user_1.image = self.create_fake_image("profile")
+        self.test_user_1.save()
+        avatar = self.test_user_1.avatar.name
+        self.test_user_1.first_name = "renamed"
+        self.test_user_1.save()
+        self.assertEqual(User.objects.get(pk=self.test_user_1.pk).avatar.name, avatar)
+
+    def test_create_avatars_command(self):
+        self.test_user_1.image = self.create_fake_image("profile")
+        self.test_user_1.save()
+        User.objects.filter(pk=self.test_user_1.pk).update(avatar=None)
+
+        out = StringIO()
+        call_command("create_avatars", stdout=out)
+        self.assertIn("Created 1 avatars, 0 failed", out.getvalue())
+        self.assertTrue(os.path.exists(User.objects.get(pk=self.test_user_1.pk).avatar.path))
@@ -40,6 +40,14 @@ class TestUrls(SimpleTestCase):
         url = reverse("gallery:photo-transfer", kwargs={"pk": 1})
         self.assertEqual(resolve(url).func, photo_transfer)
 
+    def test_gallery_download_url_is_resolved(self):
+        url = reverse("gallery:gallery-download", kwargs={"pk": 1})
+        self.assertEqual(resolve(url).func, gallery_download)
+
+    def test_photo_download_url_is_resolved(self):
+        url = reverse("gallery:photo-download", kwargs={"pk": 1})
+        self.assertEqual(resolve(url).func, photo_download)
+
     def test_photo_cover_update_url_is_resolved(self):
         url = reverse("gallery:photo-cover-update", kwargs={"pk": 1})
         self.assertEqual(resolve(url).func, photo_cover_update)
@@ -47,3 +55,9 @@ class TestUrls(SimpleTestCase):
     def test_category_detail_url_is_resolved(self):
         url = reverse("gallery:category-detail", kwargs={"slug": "some-category"})
         self.assertEqual(resolve(url).func.view_class, CategoryDetailView)
+
+    def test_photo_rendition_url_is_resolved(self):
+        url = reverse("photo-rendition", kwargs={"label": "grid", "pk": 1})
+        self.assertEqual(url, "/media/r/grid/1")
+        self.assertEqual(resolve(url).func, photo_rendition)
+        self.assertEqual(resolve("/media/r/320x320/1").func, photo_thumbnail)
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase
+from utils.disk_cache import RECORD, DiskCache
+
+
+class TestDiskCache(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def writer(self, size, calls=None):
+        def create(path):
+            if calls is not None:
+                calls.append(path)
+                time.sleep(0.05)
+            with open(f"{path}.tmp", "wb") as file:
+                file.write(b"x" * size)
+            os.replace(f"{path}.tmp", path)
+
+        return create
+
+    def test_missing_files_are_created_once(self):
+        cache = DiskCache(self.directory.name, max_bytes=1000)
+        calls = []
+        threads = [threading.Thread(target=cache.get_or_create, args=("key", self.writer(10, calls))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get_or_create("key", self.writer(10, calls)), calls[0])
+        self.assertEqual(len(calls), 1)
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = DiskCache(self.directory.name, max_bytes=300)
+        first = cache.get_or_create("first", self.writer(100))
+        second = cache.get_or_create("second", self.writer(100))
+        third = cache.get_or_create("third", self.writer(100))
+        # Reading `first` makes `second` the least recently used
+        cache.get_or_create("first", self.writer(100))
+        fourth = cache.get_or_create("fourth", self.writer(100))
+
+        self.assertTrue(all(os.path.exists(path) for path in (first, third, fourth)))
+        self.assertFalse(os.path.exists(second))
+        self.assertEqual(cache.total_bytes, 300)
+
+    def test_returned_file_is_not_evicted(self):
+        cache = DiskCache(self.directory.name, max_bytes=100)
+        first = cache.get_or_create("first", self.writer(50))
+        # Over max_bytes on its own, still readable by the caller
+        large = cache.get_or_create("large", self.writer(150))
+
+        self.assertTrue(os.path.exists(large))
+        self.assertFalse(os.path.exists(first))
+        # Evicted by the next call instead
+        cache.get_or_create("second", self.writer(50))
+        self.assertFalse(os.path.exists(large))
+
+    def test_processes_share_the_index(self):
+        cache = DiskCache(self.directory.name, max_bytes=200)
+        other_process = DiskCache(self.directory.name, max_bytes=200)
+        first = cache.get_or_create("first", self.writer(100))
+        other_process.get_or_create("second", self.writer(100))
+        other_process.get_or_create("third", self.writer(100))
+
+        self.assertFalse(os.path.exists(first))
+        cache.sync()
+        self.assertEqual(cache.total_bytes, 200)
+        self.assertEqual(len(cache.entries), 2)
+
+    def test_index_is_compacted(self):
+        cache = DiskCache(self.directory.name, max_bytes=1000)
+        for _ in range(2000):
+            cache.get_or_create("key", self.writer(10))
+        self.assertLess(os.path.getsize(cache.index_path), 1100 * RECORD.size)
+
+        other_process = DiskCache(self.directory.name, max_bytes=1000)
+        other_process.sync()
+        self.assertEqual(other_process.total_bytes, 10)
@@ -0,0 +1,38 @@
+from django.test import SimpleTestCase
+from utils.hyperloglog import HyperLogLog
+
+
+class TestHyperLogLog(SimpleTestCase):
+    def sketch(self, values):
+        sketch = HyperLogLog()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_counts_are_within_the_standard_error(self):
+        for size in (0, 1, 10, 1000, 20000):
+            with self.subTest(size=size):
+                sketch = self.sketch(f"viewer-{index}" for index in range(size))
+                # 3 standard errors, 1.6% each at the default precision
+                self.assertAlmostEqual(sketch.count(), size, delta=max(size * 0.05, 1))
+
+    def test_repeated_values_are_counted_once(self):
+        sketch = self.sketch(["session:a", "session:b"] * 500)
+        self.assertEqual(sketch.count(), 2)
+        self.assertFalse(sketch.add("session:a"))
+        self.assertTrue(sketch.add("session:c"))
+
+    def test_merged_sketches_count_the_union(self):
+        monday = self.sketch(f"viewer-{index}" for index in range(0, 3000))
+        tuesday = self.sketch(f"viewer-{index}" for index in range(2000, 5000))
+        both = self.sketch(f"viewer-{index}" for index in range(0, 5000))
+        self.assertEqual(monday.merge(tuesday).registers, both.registers)
+        with self.assertRaises(ValueError):
+            monday.merge(HyperLogLog(precision=10))
+
+    def test_sketches_are_stored_compactly(self):
+        sketch = self.sketch(f"viewer-{index}" for index in range(50))
+        data = sketch.to_bytes()
+        self.assertLess(len(data), 500)
+        self.assertEqual(HyperLogLog.from_bytes(memoryview(data)).registers, sketch.registers)
+        self.assertEqual(HyperLogLog.from_bytes(data).count(), sketch.count())
@@ -0,0 +1,210 @@
+import os
+import random
+import tempfile
+from datetime import datetime, timezone
+from io import BytesIO
+
+from django.test import SimpleTestCase
+from PIL import Image
+from tests.base_utils import exif_jpeg
+from utils.methods import (
+    ImageTooLarge,
+    blurhash,
+    blurhash_image,
+    dhash,
+    dominant_color,
+    exif_metadata,
+    fit_size,
+    format_name,
+    hamming_distance,
+    image_metadata,
+    open_image,
+    phash_chunks,
+    phash_lookups,
+    resizeScale,
+    save_renditions,
+    weighted_shuffle,
+)
+
+
+class TestImagePipeline(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def make_image(self, name, size, image_format, mode="RGB"):
+        path = os.path.join(self.directory.name, name)
+        Image.new(mode, size, "red").save(path, format=image_format)
+        return path
+
+    def test_fit_size_keeps_aspect_ratio_and_never_upscales(self):
+        self.assertEqual(fit_size((4000, 3000), (400, 400)), (400, 300))
+        self.assertEqual(fit_size((300, 200), (400, 400)), (300, 200))
+
+    def test_jpeg_is_decoded_at_reduced_resolution(self):
+        path = self.make_image("large.jpg", (4000, 3000), "JPEG")
+        with open_image(path, (400, 400)) as image:
+            # decoder scaled by 1/8, still larger than the 400x300 target
+            self.assertEqual(image.size, (500, 375))
+
+    def test_png_is_decoded_at_full_resolution(self):
+        path = self.make_image("large.png", (2000, 1500), "PNG")
+        with open_image(path, (400, 400)) as image:
+            self.assertEqual(image.size, (2000, 1500))
+        with open_image(path, (400, 400)) as image:
+            self.assertEqual(resizeScale(image, 400, 400).size, (400, 300))
+
+    def test_images_over_the_memory_ceiling_are_rejected_before_decoding(self):
+        path = self.make_image("large.png", (2000, 1500), "PNG")
+        with self.assertRaises(ImageTooLarge):
+            open_image(path, max_bytes=2000 * 1500 * 4 - 1)
+
+        # JPEG ceiling applies to the reduced decode size
+        path = self.make_image("large.jpg", (4000, 3000), "JPEG")
+        with open_image(path, (400, 400), max_bytes=500 * 375 * 4) as image:
+            self.assertEqual(image.size, (500, 375))
+
+    def test_save_renditions_writes_every_size(self):
+        path = self.make_image("photo.jpg", (4000, 3000), "JPEG")
+        renditions = {
+            "small": ((200, 200), os.path.join(self.directory.name, "photo_small.jpg")),
+            "large": ((1000, 1000), os.path.join(self.directory.name, "photo_large.jpg")),
+        }
+        results = save_renditions(path, renditions)
+        self.assertEqual(results["small"][:2], (200, 150))
+        self.assertEqual(results["large"][:2], (1000, 750))
+        with Image.open(renditions["large"][1]) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (1000, 750)))
+
+    def test_save_renditions_writes_other_formats_without_metadata(self):
+        path = os.path.join(self.directory.name, "photo.jpg")
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        Image.new("RGB", (1200, 900), (40, 120, 200)).save(path, format="JPEG", exif=exif)
+        destination = os.path.join(self.directory.name, "photo_grid.jpg")
+        options = {"JPEG": {"quality": 80, "progressive": True}, "WEBP": {"quality": 70}}
+
+        results = save_renditions(path, {"grid": ((600, 600), destination)}, options=options, formats=["NOPE", "WEBP"])
+        self.assertEqual(results["grid"][3], ("WEBP",))
+        with Image.open(destination) as image:
+            self.assertTrue(image.info.get("progressive"))
+            self.assertNotIn("exif", image.info)
+        with Image.open(format_name(destination, "WEBP")) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (600, 450)))
+            self.assertNotIn("exif", image.info)
+
+    def test_save_renditions_output_format(self):
+        path = self.make_image("photo.jpg", (800, 600), "JPEG")
+        destination = os.path.join(self.directory.name, "thumbnail")
+        results = save_renditions(path, {"thumbnail": ((400, 400), destination)}, output_format="WEBP")
+        self.assertEqual(results["thumbnail"][3], ())
+        with Image.open(destination) as image:
+            self.assertEqual(image.format, "WEBP")
+
+
+class TestPerceptualHash(SimpleTestCase):
+    def test_dhash_survives_scaling_and_recompression(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "FakeImages", "test_image.jpg")
+        with Image.open(path) as image:
+            original = dhash(image)
+            with tempfile.TemporaryFile() as file:
+                image.resize((320, 180)).save(file, format="JPEG", quality=40)
+                with Image.open(file) as copy:
+                    self.assertLessEqual(hamming_distance(original, dhash(copy)), 4)
+            self.assertGreater(hamming_distance(original, dhash(image.transpose(Image.FLIP_LEFT_RIGHT))), 16)
+
+    def test_lookups_find_every_hash_within_distance(self):
+        rng = random.Random(7)
+        for distance in (0, 3, 6, 11):
+            value = rng.getrandbits(64)
+            lookups = phash_lookups(value, distance)
+            for _ in range(200):
+                other = value
+                for bit in rng.sample(range(64), rng.randint(0, distance)):
+                    other ^= 1 << bit
+                chunks = phash_chunks(other)
+                self.assertTrue(any(chunk in lookup for chunk, lookup in zip(chunks, lookups)))
+
+    def test_distance_beyond_the_index_radius_is_rejected(self):
+        with self.assertRaises(ValueError):
+            phash_lookups(0, 12)
+
+
+class TestPlaceholders(SimpleTestCase):
+    def test_blurhash_round_trips_the_average_colour(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "FakeImages", "test_image.jpg")
+        with Image.open(path) as image:
+            value = blurhash(image)
+            average = image.convert("RGB").resize((1, 1), Image.BOX).getpixel((0, 0))
+        self.assertEqual(len(value), 28)
+        decoded = blurhash_image(value, 32, 32).resize((1, 1), Image.BOX).getpixel((0, 0))
+        for channel, expected in zip(decoded, average):
+            self.assertAlmostEqual(channel, expected, delta=16)
+
+    def test_solid_image(self):
+        image = Image.new("RGB", (60, 40), (200, 30, 90))
+        self.assertEqual(dominant_color(image), "#c81e5a")
+        decoded = blurhash_image(blurhash(image), 4, 3).getpixel((2, 1))
+        for channel, expected in zip(decoded, (200, 30, 90)):
+            self.assertAlmostEqual(channel, expected, delta=6)
+
+    def test_dominant_colour_is_the_largest_area(self):
+        image = Image.new("RGB", (100, 100), (0, 0, 255))
+        image.paste((255, 255, 0), (0, 0, 100, 30))
+        self.assertEqual(dominant_color(image), "#0000ff")
+
+    def test_invalid_blurhash_is_rejected(self):
+        with self.assertRaises(ValueError):
+            blurhash_image("LODyF81DNF", 4, 3)
+
+
+class TestExifMetadata(SimpleTestCase):
+    def test_camera_capture_time_and_position_are_read(self):
+        with Image.open(BytesIO(exif_jpeg())) as image:
+            metadata = exif_metadata(image)
+        self.assertEqual((metadata["camera_make"], metadata["camera_model"]), ("Apple", "iPhone 13"))
+        self.assertEqual(metadata["lens_model"], "iPhone 13 back camera 5.1mm f/1.6")
+        self.assertEqual(metadata["taken_at"], datetime(2023, 7, 14, 16, 30, 5, tzinfo=timezone.utc))
+        self.assertAlmostEqual(metadata["latitude"], 48.8582, places=4)
+        self.assertAlmostEqual(metadata["longitude"], 2.2945, places=4)
+
+    def test_images_without_exif(self):
+        with Image.new("RGB", (10, 10)) as image:
+            metadata = exif_metadata(image)
+        self.assertEqual(metadata["orientation"], 1)
+        self.assertIsNone(metadata["taken_at"])
+        self.assertEqual(metadata["camera_model"], "")
+
+    def test_rotated_images_report_their_displayed_size(self):
+        metadata = image_metadata(BytesIO(exif_jpeg(orientation=6)))
+        self.assertEqual((metadata["width"], metadata["height"]), (200, 300))
+        self.assertNotIn("orientation", metadata)
+
+    def test_renditions_are_turned_upright(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rotated.jpg")
+            with open(path, "wb") as file:
+                file.write(exif_jpeg(orientation=6))
+            destination = os.path.join(directory, "rotated_small.jpg")
+            results = save_renditions(path, {"small": ((150, 150), destination)})
+            self.assertEqual(results["small"][:2], (100, 150))
+            with Image.open(destination) as image:
+                self.assertNotIn(0x0112, image.getexif())
+                # Turned 90 degrees clockwise, the marked top left quarter is now top right
+                red, green, blue = image.convert("RGB").getpixel((75, 20))
+                self.assertGreater(blue, red)
+
+
+class TestWeightedShuffle(SimpleTestCase):
+    def test_every_item_is_kept(self):
+        items = list(range(100))
+        shuffled = weighted_shuffle(items, [1] * 100, random.Random(1))
+        self.assertEqual(sorted(shuffled), items)
+        self.assertNotEqual(shuffled, items)
+        self.assertEqual(weighted_shuffle(items, [1] * 100, random.Random(1)), shuffled)
+
+    def test_heavier_items_tend_to_come_first(self):
+        rng = random.Random(2)
+        firsts = [weighted_shuffle(["light", "heavy"], [1, 9], rng)[0] for _ in range(1000)]
+        # P(heavy first) = 9 / 10
+        self.assertAlmostEqual(firsts.count("heavy") / 1000, 0.9, delta=0.03)
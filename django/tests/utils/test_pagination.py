@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.db.models import F
+from django.test import TestCase
+from django.utils import timezone
+from gallery.models import Gallery
+from tests.base_utils import BaseObjectUtils
+from utils.pagination import InvalidCursor, encode_cursor, keyset_page, offset_page
+
+
+class TestKeysetPage(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        created = timezone.now() - timedelta(days=1)
+        for index in range(12):
+            gallery = Gallery.objects.create(name=f"page_gallery_{index}", user=self.test_user_2)
+            # Pairs of galleries created at the same time
+            Gallery.objects.filter(pk=gallery.pk).update(created=created - timedelta(minutes=index // 2))
+        self.queryset = Gallery.objects.all()
+        self.ordered = list(self.queryset.order_by("-created", "-pk").values_list("pk", flat=True))
+
+    def walk(self, ordering=("-created", "-pk"), page_size=5):
+        """Pages forward from the first page, then back from the last one"""
+        pages, page = [], keyset_page(self.queryset, None, page_size, ordering)
+        pages.append([gallery.pk for gallery in page])
+        while page.has_next():
+            page = keyset_page(self.queryset, page.next_cursor, page_size, ordering)
+            pages.append([gallery.pk for gallery in page])
+
+        backwards = [[gallery.pk for gallery in page]]
+        while page.has_previous():
+            page = keyset_page(self.queryset, page.previous_cursor, page_size, ordering)
+            backwards.insert(0, [gallery.pk for gallery in page])
+        return pages, backwards
+
+    def test_pages_follow_the_ordering_through_ties(self):
+        pages, backwards = self.walk()
+        self.assertEqual(sum(pages, []), self.ordered)
+        self.assertTrue(all(len(page) == 5 for page in pages[:-1]))
+        self.assertEqual(backwards, pages)
+
+    def test_nullable_sort_fields_are_paged_nulls_last(self):
+        Gallery.objects.filter(pk__in=self.ordered[::3]).update(category=self.test_category)
+        pages, backwards = self.walk(ordering=("category_id", "pk"), page_size=4)
+        ordered = self.queryset.order_by(F("category_id").asc(nulls_last=True), "pk").values_list("pk", flat=True)
+        self.assertEqual(sum(pages, []), list(ordered))
+        self.assertEqual(backwards, pages)
+
+    def test_cursor_keeps_its_position_when_rows_are_added(self):
+        first = keyset_page(self.queryset, None, 5)
+        Gallery.objects.create(name="newest_gallery", user=self.test_user_2)
+        second = keyset_page(self.queryset, first.next_cursor, 5)
+        self.assertEqual([gallery.pk for gallery in second], self.ordered[5:10])
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ("not a cursor", encode_cursor([1]), encode_cursor({"v": [1]}), encode_cursor({"v": ["x", 1]})):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                keyset_page(self.queryset, cursor, 5)
+
+    def test_page_links_keep_the_other_parameters(self):
+        page = keyset_page(self.queryset, None, 5, params=self.client.get("/", {"q": "page"}).wsgi_request.GET)
+        self.assertFalse(page.has_previous())
+        self.assertIsNone(page.previous_query)
+        self.assertEqual(page.next_query, f"q=page&cursor={page.next_cursor}")
+
+
+class TestOffsetPage(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def test_pages_by_position(self):
+        queryset = Gallery.objects.order_by("pk")
+        first = offset_page(queryset, None, 1)
+        second = offset_page(queryset, first.next_cursor, 1)
+        self.assertEqual(list(first) + list(second), list(queryset))
+        self.assertFalse(second.has_next())
+        self.assertEqual(list(offset_page(queryset, second.previous_cursor, 1)), list(first))
+        with self.assertRaises(InvalidCursor):
+            offset_page(queryset, encode_cursor({"o": -1}), 1)
@@ -1,10 +1,23 @@
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+
+from core.jobs import run_pending
+from core.models import Job
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.shortcuts import get_object_or_404
+from django.test import override_settings
 from django.urls import reverse
-from gallery.models import Gallery
+from django.utils import timezone
+from gallery.models import Gallery, Photo, Rate, StatsBucket, UploadSession
 from model_bakery import baker
+from PIL import Image
 from rest_framework.test import APIClient, APITestCase
-from tests.base_utils import BaseObjectUtils
+from tests.base_utils import TEST_IMAGE_DIR, BaseObjectUtils
 
 User = get_user_model()
 
@@ -36,6 +49,22 @@ class TestGalleryViews(BaseObjectUtils, APITestCase):
         # Test total numbers of Gallery available
         self.assertEqual(len(results_pks), 1)
 
+    def test_galleries_are_paged_by_cursor(self):
+        for index in range(30):
+            Gallery.objects.create(name=f"api_gallery_{index}", user=self.test_user_2, category=self.test_category)
+        url = reverse("api:gallery-list")
+        self.client.logout()
+        first = self.client.get(url, format="json").data
+        self.assertNotIn("count", first)
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"], format="json").data
+        self.assertIsNone(second["next"])
+        galleries = Gallery.objects.filter(public=True).order_by("-created", "-pk").values_list("pk", flat=True)
+        self.assertEqual([gallery["id"] for gallery in first["results"] + second["results"]], list(galleries))
+        self.assertEqual(self.client.get(second["previous"], format="json").data["results"], first["results"])
+
+        self.assertEqual(self.client.get(url, {"cursor": "nonsense"}, format="json").status_code, 404)
+
     def test_gallery_lookup_404_if_object_not_exist(self):
         url = reverse("api:gallery-detail", kwargs={"pk": "100000000"})
         client = APIClient()
@@ -170,6 +199,278 @@ class TestGalleryViews(BaseObjectUtils, APITestCase):
         response = client.delete(url, format="json")
         self.assertEqual(response.status_code, 403)
 
+    def test_gallery_stats_are_read_from_buckets(self):
+        photo = self.test_gallery_1.photos.first()
+        now = timezone.now()
+        StatsBucket.objects.add({(photo.pk, self.test_gallery_1.pk): (5, 2)}, when=now)
+        StatsBucket.objects.add({(photo.pk, self.test_gallery_1.pk): (3, 0)}, when=now - timedelta(days=3))
+        url = reverse("api:gallery-stats", kwargs={"pk": self.test_gallery_1.pk})
+
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(point["views"], point["downloads"]) for point in response.data["series"]], [(3, 0), (5, 2)])
+        self.assertEqual(response.data["totals"], {"views": 8, "downloads": 2, "unique_viewers": 0})
+
+        response = self.client.get(url, {"period": "hour", "photo": photo.pk}, format="json")
+        self.assertEqual(response.data["totals"]["views"], 5)
+        start = (timezone.localdate() - timedelta(days=1)).isoformat()
+        response = self.client.get(url, {"period": "month", "start": start}, format="json")
+        self.assertEqual(response.data["totals"]["views"], 5)
+
+        for params in ({"period": "week"}, {"start": "yesterday"}, {"start": "2021-06-02", "end": "2021-06-01"}):
+            self.assertEqual(self.client.get(url, params, format="json").status_code, 400)
+        self.assertEqual(self.client.get(url, {"photo": 100000000}, format="json").status_code, 400)
+
+        client = APIClient()
+        self.assertEqual(client.get(url, format="json").status_code, 401)
+        client.login(**self.user_2_cred)
+        self.assertEqual(client.get(url, format="json").status_code, 403)
+
+
+class TestPhotoViews(BaseObjectUtils, APITestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_test_objects()
+
+    def test_photos_filter_and_sort_by_image_metadata(self):
+        small = self.create_photo(self.test_gallery_1, title="small_image", path="test_blank_image.jpg")
+        large = self.create_photo(self.test_gallery_1, title="large_image")
+        url = reverse("api:photo-list")
+
+        response = self.client.get(url, {"min_width": 1000})
+        self.assertEqual([photo["id"] for photo in response.data["results"]], [large.pk])
+
+        response = self.client.get(url, {"max_width": 1000, "content_type": "image/png"})
+        self.assertEqual([photo["id"] for photo in response.data["results"]], [small.pk])
+
+        response = self.client.get(url, {"min_size": 1, "ordering": "-file_size"})
+        self.assertEqual([photo["id"] for photo in response.data["results"]], [small.pk, large.pk])
+        self.assertEqual(response.data["results"][0]["width"], 584)
+
+    def test_invalid_metadata_filter_is_rejected(self):
+        response = self.client.get(reverse("api:photo-list"), {"min_width": "wide"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_photos_are_filtered_by_capture_metadata(self):
+        phone = Photo.objects.create(
+            title="phone_photo", gallery=self.test_gallery_1, image=self.create_exif_image("phone")
+        )
+        self.client.login(**self.user_1_cred)
+        response = self.client.get(reverse("api:photo-list"), {"taken_year": 2023, "camera_model": "iPhone 13"})
+        self.assertEqual([photo["id"] for photo in response.data["results"]], [phone.pk])
+        self.assertEqual(response.data["results"][0]["lens_model"], "iPhone 13 back camera 5.1mm f/1.6")
+        self.assertAlmostEqual(response.data["results"][0]["latitude"], 48.8582, places=4)
+        self.assertEqual(self.client.get(reverse("api:photo-list"), {"taken_year": 2022}).data["results"], [])
+
+        # Only the owner sees where the photo was taken
+        self.client.logout()
+        response = self.client.get(reverse("api:photo-detail", kwargs={"pk": phone.pk}))
+        self.assertEqual(response.data["camera_model"], "iPhone 13")
+        self.assertIsNone(response.data["latitude"])
+        self.assertIsNone(response.data["longitude"])
+
+    def test_similar_photos_are_listed_by_distance(self):
+        original = self.create_photo(self.test_gallery_1, title="original_image")
+        other = self.create_photo(self.test_gallery_1, title="other_image", path="test_blank_image.jpg")
+        with Image.open(original.image.path) as image:
+            buffer = BytesIO()
+            image.resize((640, 360)).save(buffer, format="JPEG", quality=50)
+        copy = Photo.objects.create(
+            title="recompressed_image",
+            gallery=self.test_gallery_1,
+            image=SimpleUploadedFile("copy.jpg", buffer.getvalue(), content_type="image/jpeg"),
+        )
+        run_pending()
+
+        response = self.client.get(reverse("api:photo-similar", kwargs={"pk": original.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([photo["id"] for photo in response.data], [copy.pk])
+        self.assertLessEqual(response.data[0]["distance"], settings.PHOTO_SIMILAR_DISTANCE)
+        self.assertNotIn(other.pk, [photo["id"] for photo in response.data])
+
+        response = self.client.get(reverse("api:photo-similar", kwargs={"pk": original.pk}), {"distance": 64})
+        self.assertEqual(response.status_code, 400)
+
+    def test_photos_are_liked_and_starred_idempotently(self):
+        photo = self.test_gallery_1.photos.first()
+        url = reverse("api:photo-rate", kwargs={"pk": photo.pk})
+        self.assertEqual(self.client.put(url, {"like": True}).status_code, 401)
+
+        self.client.login(**self.user_2_cred)
+        for _ in range(2):
+            response = self.client.put(url, {"like": True})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.data, {"photo": photo.pk, "like": True, "star": False, "like_count": 1, "star_count": 0}
+            )
+        response = self.client.put(url, {"star": True})
+        self.assertEqual((response.data["like"], response.data["star_count"]), (True, 1))
+        response = self.client.put(url, {"like": False})
+        self.assertEqual((response.data["like"], response.data["like_count"]), (False, 0))
+        self.assertEqual(self.client.put(url, {}).status_code, 400)
+
+        # Private gallery photos can't be rated by others
+        private = self.create_photo(self.test_gallery_2, title="private_photo")
+        response = self.client.put(reverse("api:photo-rate", kwargs={"pk": private.pk}), {"like": True})
+        self.assertEqual(response.status_code, 404)
+
+    def test_rates_of_a_page_of_photos_in_one_query(self):
+        photos = list(self.test_gallery_1.photos.order_by("pk"))
+        private = self.create_photo(self.test_gallery_2, title="private_photo")
+        Rate.objects.rate(self.test_user_2, photos[0], like=True)
+        Rate.objects.rate(self.test_user_1, photos[0], like=True, star=True)
+        url = reverse("api:photo-rates")
+        ids = ",".join(str(pk) for pk in [photos[0].pk, photos[1].pk, private.pk])
+
+        self.client.force_authenticate(user=self.test_user_2)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"ids": ids})
+        rates = {rate["photo"]: rate for rate in response.data}
+        self.assertEqual(set(rates), {photos[0].pk, photos[1].pk})
+        self.assertEqual(
+            rates[photos[0].pk], {"photo": photos[0].pk, "like": True, "star": False, "like_count": 2, "star_count": 1}
+        )
+        self.assertFalse(rates[photos[1].pk]["like"])
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get(url, {"ids": ids})
+        self.assertEqual(
+            [(rate["like"], rate["like_count"]) for rate in response.data if rate["photo"] == photos[0].pk],
+            [(False, 2)],
+        )
+        self.assertEqual(self.client.get(url, {"ids": "1,two"}).status_code, 400)
+
+
+class TestUploadSessionViews(BaseObjectUtils, APITestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.login(**self.user_1_cred)
+        self.create_test_objects()
+        upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(upload_dir.cleanup)
+        settings_override = override_settings(PHOTO_UPLOAD_TEMP_DIR=upload_dir.name, PHOTO_UPLOAD_CHUNK_MAX_BYTES=20000)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        with open(os.path.join(TEST_IMAGE_DIR, "test_image.jpg"), "rb") as image:
+            self.content = image.read()
+
+    def create_session(self, **data):
+        data = {
+            "gallery": self.test_gallery_1.pk,
+            "title": "chunked_photo",
+            "filename": "holiday.jpg",
+            "size": len(self.content),
+            "sha256": hashlib.sha256(self.content).hexdigest(),
+            **data,
+        }
+        return self.client.post(reverse("api:upload-list"), data)
+
+    def put_chunk(self, session_id, first, last):
+        return self.client.put(
+            reverse("api:upload-detail", kwargs={"pk": session_id}),
+            self.content[first : last + 1],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {first}-{last}/{len(self.content)}",
+        )
+
+    def upload(self, session_id, start=0, chunk_size=20000):
+        for first in range(start, len(self.content), chunk_size):
+            response = self.put_chunk(session_id, first, min(first + chunk_size, len(self.content)) - 1)
+            self.assertEqual(response.status_code, 200)
+
+    def test_photo_is_uploaded_in_chunks(self):
+        response = self.create_session()
+        self.assertEqual(response.status_code, 201)
+        session_id = response.data["id"]
+        self.assertEqual(response.data["offset"], 0)
+
+        response = self.put_chunk(session_id, 0, 19999)
+        self.assertEqual(response.data["offset"], 20000)
+        # A chunk sent again after a dropped connection, or skipping ahead, is refused with the offset to resume from
+        for first, last in [(0, 19999), (30000, 39999)]:
+            response = self.put_chunk(session_id, first, last)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.data["offset"], 20000)
+        self.assertEqual(self.client.get(reverse("api:upload-detail", kwargs={"pk": session_id})).data["offset"], 20000)
+
+        self.upload(session_id, start=20000)
+        session = UploadSession.objects.get(pk=session_id)
+        self.assertEqual(session.offset, len(self.content))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("api:upload-finalize", kwargs={"pk": session_id}))
+        self.assertEqual(response.status_code, 201)
+        photo = Photo.objects.get(pk=response.data["id"])
+        self.assertEqual((photo.title, photo.gallery), ("chunked_photo", self.test_gallery_1))
+        self.assertEqual(photo.content_hash, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual((photo.width, photo.height), (1280, 720))
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.path))
+
+        run_pending()
+        self.assertTrue(photo.renditions.exists())
+
+    def test_incomplete_or_corrupted_uploads_are_not_finalized(self):
+        session_id = self.create_session(sha256=hashlib.sha256(b"other file").hexdigest()).data["id"]
+        url = reverse("api:upload-finalize", kwargs={"pk": session_id})
+        self.put_chunk(session_id, 0, 999)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("incomplete", response.data[0])
+
+        self.upload(session_id, start=1000)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("sha256", response.data[0])
+        # Uploaded again from the start
+        self.assertEqual(UploadSession.objects.get(pk=session_id).offset, 0)
+        self.assertFalse(Photo.objects.filter(title="chunked_photo").exists())
+
+    def test_invalid_sessions_and_chunks_are_rejected(self):
+        self.assertIn("gallery", self.create_session(gallery=self.test_gallery_2.pk).data)
+        self.assertIn("size", self.create_session(size=settings.PHOTO_UPLOAD_MAX_BYTES + 1).data)
+        self.assertIn("sha256", self.create_session(sha256="not a digest").data)
+        self.assertIn("title", self.create_session(title=Photo.objects.first().title).data)
+
+        session_id = self.create_session().data["id"]
+        response = self.put_chunk(session_id, 0, 20000)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(
+            reverse("api:upload-detail", kwargs={"pk": session_id}), b"data", content_type="application/octet-stream"
+        )
+        self.assertIn("Content-Range", response.data)
+
+        # Sessions are private to the user who created them
+        self.client.login(**self.user_2_cred)
+        self.assertEqual(self.put_chunk(session_id, 0, 999).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.create_session().status_code, 401)
+
+    def test_stale_sessions_expire(self):
+        session_id = self.create_session().data["id"]
+        job = Job.objects.get(task="gallery.expire_upload_session")
+        self.assertEqual(job.run_at, UploadSession.objects.get(pk=session_id).expires_at)
+        self.put_chunk(session_id, 0, 999)
+        session = UploadSession.objects.get(pk=session_id)
+
+        # Chunks received since the session was created extended it
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_pending()
+        self.assertTrue(UploadSession.objects.filter(pk=session_id).exists())
+        job = Job.objects.get(task="gallery.expire_upload_session", status=Job.PENDING)
+
+        UploadSession.objects.filter(pk=session_id).update(expires_at=timezone.now())
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(self.put_chunk(session_id, 1000, 1999).status_code, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        self.assertFalse(UploadSession.objects.filter(pk=session_id).exists())
+        self.assertFalse(os.path.exists(session.path))
+
 
 class TestUserViews(BaseObjectUtils, APITestCase):
     fixtures = ["test_fixtures"]
@@ -1,11 +1,28 @@
+import os
+import re
+import tempfile
+import tracemalloc
+import zipfile
+from io import BytesIO
+from unittest import mock
+
+from allauth.socialaccount.models import SocialAccount
+from core.jobs import run_pending
+from core.models import Job
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
-from django.test import Client, RequestFactory, TestCase
+from django.db import connection
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from gallery.models import Gallery, Photo
-from gallery.views import GalleryListView
+from gallery.models import Gallery, GalleryFeed, Photo, Rendition
+from gallery.views import GalleryDetailView, GalleryListView
 from model_bakery import baker
+from PIL import Image
 from tests.base_utils import BaseObjectUtils
+from utils.methods import save_renditions
 
 User = get_user_model()
 
@@ -338,3 +355,474 @@ class TestGalleryViews(BaseObjectUtils, TestCase):
         # test photo was transferred to NFL Gallery
         photo.refresh_from_db()
         self.assertEqual(photo.gallery, NFL_gallery)
+
+
+class TestGalleryFeed(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        for index in range(40):
+            Gallery.objects.create(name=f"feed_gallery_{index}", user=self.test_user_2, category=self.test_category)
+        self.public = set(Gallery.objects.filter(public=True).values_list("pk", flat=True))
+        self.url = reverse("gallery:gallery-list")
+
+    def page(self, query="", client=None):
+        """Gallery pks on the page at `query`, and the query of the next page"""
+        page = (client or self.client).get(f"{self.url}?{query}").context["page_obj"]
+        return [gallery.pk for gallery in page], page.next_query
+
+    def test_galleries_are_listed_newest_first_until_the_feed_is_built(self):
+        self.client.get(self.url)
+        newest = list(Gallery.objects.filter(public=True).order_by("-created").values_list("pk", flat=True)[:25])
+        self.assertEqual(self.page()[0], newest)
+        self.assertEqual(Job.objects.filter(task="gallery.build_gallery_feed").count(), 1)
+
+        run_pending()
+        feed = GalleryFeed.objects.get()
+        self.assertEqual((feed.size, feed.variants), (len(self.public), 8))
+        self.assertEqual(feed.entries.count(), 8 * len(self.public))
+        # Rebuilt again later
+        self.assertEqual(Job.objects.filter(task="gallery.build_gallery_feed", status=Job.PENDING).count(), 1)
+
+    def test_pages_are_stable_for_a_session(self):
+        GalleryFeed.objects.build(variants=8)
+        first, next_query = self.page()
+        second, last_query = self.page(next_query)
+        self.assertEqual(len(first), 25)
+        self.assertIsNone(last_query)
+        self.assertEqual(set(first) | set(second), self.public)
+        self.assertEqual(len(first) + len(second), len(self.public))
+        self.assertEqual(self.page()[0], first)
+
+        # A rebuild does not reshuffle the pages of a session paging through the feed
+        GalleryFeed.objects.build(variants=8)
+        self.assertEqual(self.page(next_query)[0], second)
+        self.assertEqual(self.client.session["gallery_feed"], GalleryFeed.objects.order_by("pk").first().pk)
+        # Its next first page is from the new feed
+        first, next_query = self.page()
+        second = self.page(next_query)[0]
+        self.assertEqual(set(first) | set(second), self.public)
+        self.assertEqual(self.client.session["gallery_feed"], GalleryFeed.objects.latest("pk").pk)
+
+        # Galleries made private since are left out
+        Gallery.objects.filter(pk=second[0]).update(public=False)
+        self.assertNotIn(second[0], self.page(next_query)[0])
+
+    def test_sessions_page_through_different_shuffles(self):
+        GalleryFeed.objects.build(variants=8)
+        orders = set()
+        for seed in range(8):
+            client = Client()
+            client.get(self.url)
+            session = client.session
+            session["gallery_feed_seed"] = seed
+            session.save()
+            orders.add(tuple(self.page(client=client)[0]))
+        self.assertGreater(len(orders), 1)
+
+    def test_owners_private_galleries_are_listed_first(self):
+        GalleryFeed.objects.build(variants=8)
+        self.client.login(**self.user_1_cred)
+        private = Gallery.objects.get(name="private_gallery")
+        first, next_query = self.page()
+        second = self.page(next_query)[0]
+        self.assertEqual(first[0], private.pk)
+        self.assertEqual(set(first) | set(second), self.public | {private.pk})
+
+    def test_search_results_are_paged_by_cursor(self):
+        GalleryFeed.objects.build(variants=8)
+        first = self.client.get(self.url, {"q": "feed_gallery"}).context["page_obj"]
+        self.assertEqual(first.next_query, f"q=feed_gallery&cursor={first.next_cursor}")
+        second = self.client.get(f"{self.url}?{first.next_query}").context["page_obj"]
+        found = Gallery.objects.filter(name__startswith="feed_gallery").order_by("-created", "-pk")
+        self.assertEqual(list(first) + list(second), list(found))
+        self.assertFalse(second.has_next())
+        self.assertEqual(list(self.client.get(f"{self.url}?{second.previous_query}").context["page_obj"]), list(first))
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get(self.url, {"cursor": "nonsense"}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"q": "feed", "cursor": "nonsense"}).status_code, 404)
+
+    def test_gallery_photos_are_paged_by_cursor(self):
+        photos = [self.create_photo(self.test_gallery_1, title=f"paged_image_{index}") for index in range(3)]
+        url = self.test_gallery_1.get_absolute_url()
+        with mock.patch.object(GalleryDetailView, "paginate_by", 2):
+            response = self.client.get(url)
+            first = response.context["page_obj"]
+            self.assertContains(response, f'href="?{first.next_query}"')
+            second = self.client.get(f"{url}?{first.next_query}").context["page_obj"]
+            third = self.client.get(f"{url}?{second.next_query}").context["page_obj"]
+        self.assertEqual(list(first), photos[:0:-1])
+        self.assertFalse(third.has_next())
+        ordered = list(self.test_gallery_1.photos.order_by("-created", "-pk"))
+        self.assertEqual(list(first) + list(second) + list(third), ordered)
+
+
+class TestGalleryCardQueries(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        SocialAccount.objects.create(
+            user=self.test_user_2, provider="google", uid="1", extra_data={"picture": "https://example.com/face.jpg"}
+        )
+        self.url = reverse("gallery:gallery-list")
+
+    def add_galleries(self, count):
+        for index in range(count):
+            gallery = Gallery.objects.create(
+                name=f"card_gallery_{Gallery.objects.count()}", user=self.test_user_2, category=self.test_category
+            )
+            if index % 2:
+                self.create_photo(gallery, title=f"card_image_{gallery.pk}")
+
+    def queries(self, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(*args, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cards_are_rendered_without_queries(self):
+        self.add_galleries(6)
+        with self.assertNumQueries(3):
+            galleries = list(Gallery.objects.for_cards().filter(public=True))
+            html = Template("{% include 'gallery/snippets/gallery_cards.html' %}").render(
+                Context({"galleries": galleries})
+            )
+        self.assertIn("https://example.com/face.jpg", html)
+        covered = [gallery for gallery in galleries if gallery.cover]
+        self.assertGreaterEqual(len(covered), 3)
+        self.assertIn(covered[0].cover.image.url, html)
+
+    def test_list_queries_do_not_grow_with_the_page(self):
+        self.add_galleries(2)
+        GalleryFeed.objects.build(variants=1)
+        few = [self.queries(self.url), self.queries(self.url, {"q": "card"})]
+        self.add_galleries(20)
+        GalleryFeed.objects.build(variants=1)
+        self.assertEqual([self.queries(self.url), self.queries(self.url, {"q": "card"})], few)
+
+        self.client.login(**self.user_1_cred)
+        few = self.queries(self.url)
+        self.add_galleries(2)
+        GalleryFeed.objects.build(variants=1)
+        self.assertEqual(self.queries(self.url), few)
+
+    def test_related_gallery_queries_do_not_grow(self):
+        self.test_gallery_1.refresh_from_db()
+        url = self.test_gallery_1.get_absolute_url()
+        self.add_galleries(2)
+        few = self.queries(url)
+        self.add_galleries(10)
+        self.assertEqual(self.queries(url), few)
+
+
+class TestPhotoDownloadView(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        self.photo = self.create_photo(self.test_gallery_1, title="download image")
+        self.url = self.photo.get_download_url()
+        with open(self.photo.image.path, "rb") as image:
+            self.content = image.read()
+
+    def test_download_streams_the_original_as_an_attachment(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Content-Disposition"], f'attachment; filename="{self.photo.get_download_title()}"')
+        self.assertEqual(response["ETag"], f'"{self.photo.content_hash}"')
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.downloads, 1)
+
+    def test_range_request_resumes_the_download(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=100-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.content[100:])
+        self.assertEqual(response["Content-Range"], f"bytes 100-{len(self.content) - 1}/{len(self.content)}")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-10")
+        self.assertEqual(b"".join(response.streaming_content), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response.status_code, 416)
+
+        # Resumed parts are not counted as downloads
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.downloads, 0)
+
+    def test_stale_if_range_returns_the_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=100-", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get_is_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.downloads, 1)
+
+    def test_private_photos_are_not_found(self):
+        private_gallery = Gallery.objects.get(name="private_gallery")
+        Photo.objects.filter(pk=self.photo.pk).update(gallery=private_gallery)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(PHOTO_DOWNLOAD_ACCEL="nginx")
+    def test_download_is_handed_to_the_proxy(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.photo.image.name}")
+        self.assertEqual(response.content, b"")
+        self.assertIn("attachment", response["Content-Disposition"])
+
+
+class TestGalleryDownloadView(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        self.client.login(**self.user_1_cred)
+        # fixture photos have no image files
+        Photo.objects.all().delete()
+        self.gallery = self.create_gallery(self.test_user_1, name="zip_gallery")
+
+    def add_photos(self, count):
+        for index in range(self.gallery.photos.count(), count):
+            self.create_photo(self.gallery, title=f"zip photo {index}")
+
+    def download(self):
+        response = self.client.get(self.gallery.get_download_url())
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_gallery_is_streamed_as_a_stored_zip(self):
+        self.add_photos(3)
+        response = self.download()
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="zip_gallery.zip"')
+
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertIsNone(archive.testzip())
+            photos = self.gallery.photos.order_by("pk")
+            self.assertEqual(
+                archive.namelist(), [f"zip-photo-{index}-{photo.pk}.jpg" for index, photo in enumerate(photos)]
+            )
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+            with open(photos[0].image.path, "rb") as image:
+                self.assertEqual(archive.read(archive.namelist()[0]), image.read())
+
+    def test_only_the_owner_can_download(self):
+        self.client.login(**self.user_2_cred)
+        self.assertEqual(self.client.get(self.gallery.get_download_url()).status_code, 404)
+
+    @override_settings(GALLERY_ZIP_MAX_CONCURRENT=1)
+    def test_concurrent_downloads_are_limited_per_user(self):
+        self.add_photos(1)
+        first = self.download()
+        self.assertEqual(self.client.get(self.gallery.get_download_url()).status_code, 429)
+
+        first.close()
+        self.download().close()
+
+    def test_peak_memory_does_not_grow_with_gallery_size(self):
+        def peak_memory(photo_count):
+            self.add_photos(photo_count)
+            response = self.download()
+            tracemalloc.start()
+            size = sum(len(chunk) for chunk in response.streaming_content)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            response.close()
+            return size, peak
+
+        small_size, small_peak = peak_memory(5)
+        large_size, large_peak = peak_memory(40)
+        self.assertGreater(large_size, small_size * 7)
+        # A buffered archive would need at least large_size bytes
+        self.assertLess(large_peak, large_size / 4)
+        self.assertLess(large_peak, small_peak * 2)
+
+
+class TestPhotoThumbnailView(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        self.photo = self.create_photo(self.test_gallery_1, title="thumbnail image")
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(PHOTO_THUMBNAIL_CACHE_DIR=cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_thumbnail_is_generated_once_then_served_from_cache(self):
+        url = self.photo.get_thumbnail_url(320, 320)
+        self.assertEqual(url, f"/media/r/320x320/{self.photo.pk}")
+        with mock.patch("gallery.views.save_renditions", wraps=save_renditions) as render:
+            for _ in range(3):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                with Image.open(BytesIO(b"".join(response.streaming_content))) as image:
+                    self.assertEqual(image.size, (320, 180))
+            self.assertEqual(render.call_count, 1)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_thumbnail_format_follows_accept(self):
+        url = self.photo.get_thumbnail_url(320, 320)
+        response = self.client.get(url, HTTP_ACCEPT="image/webp,*/*")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(response["Vary"], "Accept")
+        with Image.open(BytesIO(b"".join(response.streaming_content))) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (320, 180)))
+
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_sizes_outside_the_allow_list_are_not_found(self):
+        self.assertEqual(self.client.get(self.photo.get_thumbnail_url(321, 320)).status_code, 404)
+
+    def test_private_photos_are_not_found(self):
+        Photo.objects.filter(pk=self.photo.pk).update(gallery=Gallery.objects.get(name="private_gallery"))
+        self.assertEqual(self.client.get(self.photo.get_thumbnail_url(320, 320)).status_code, 404)
+
+
+BROWSER_ACCEPT = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+
+
+class TestPhotoRenditionView(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        self.photo = self.create_photo(self.test_gallery_1, title="rendition image")
+        run_pending()
+        self.rendition = self.photo.renditions.get(name="grid")
+        self.url = self.rendition.get_view_url()
+
+    def test_best_accepted_format_is_served(self):
+        self.assertIn("WEBP", self.rendition.formats.split(","))
+        response = self.client.get(self.url, HTTP_ACCEPT=BROWSER_ACCEPT)
+        self.assertEqual(response.status_code, 200)
+        image_format = self.rendition.formats.split(",")[0]
+        self.assertEqual(response["Content-Type"], f"image/{image_format.lower()}")
+        self.assertEqual(response["Vary"], "Accept")
+        self.assertIn("max-age=2592000", response["Cache-Control"])
+        webp = b"".join(response.streaming_content)
+
+        response = self.client.get(self.url, HTTP_ACCEPT="image/*,*/*;q=0.8")
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Vary"], "Accept")
+        jpeg = b"".join(response.streaming_content)
+        self.assertLess(len(webp), len(jpeg))
+        with Image.open(BytesIO(jpeg)) as image:
+            self.assertTrue(image.info.get("progressive"))
+
+    def test_formats_refused_with_zero_quality_are_skipped(self):
+        response = self.client.get(self.url, HTTP_ACCEPT="image/avif;q=0,image/webp;q=0,image/*")
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url, HTTP_ACCEPT="image/webp")
+        response = self.client.get(self.url, HTTP_ACCEPT="image/webp", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Vary"], "Accept")
+        # Another format has another ETag
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+    def test_replaced_image_is_rendered_again(self):
+        phash = self.photo.phash
+        photo = Photo.objects.get(pk=self.photo.pk)
+        photo.image = self.create_fake_image("replacement", path="test_blank_image.jpg")
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.save()
+        self.assertFalse(photo.renditions.exists())
+        self.assertEqual(run_pending(), 1)
+
+        photo.refresh_from_db()
+        self.assertNotEqual(photo.phash, phash)
+        for rendition in photo.renditions.all():
+            self.assertTrue(rendition.image.name.startswith(photo.image.name.rsplit(".", 1)[0]))
+            response = self.client.get(rendition.get_view_url(), HTTP_ACCEPT=BROWSER_ACCEPT)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(photo.renditions.count(), len(settings.PHOTO_RENDITIONS))
+
+    @override_settings(PHOTO_DOWNLOAD_ACCEL="nginx")
+    def test_accel_redirect(self):
+        response = self.client.get(self.url, HTTP_ACCEPT="image/webp")
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.rendition.format_names()['WEBP']}")
+
+    def test_private_renditions_are_not_found(self):
+        Photo.objects.filter(pk=self.photo.pk).update(gallery=Gallery.objects.get(name="private_gallery"))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_unknown_rendition_is_not_found(self):
+        self.assertEqual(self.client.get(f"/media/r/huge/{self.photo.pk}").status_code, 404)
+
+
+class TestResponsiveImages(BaseObjectUtils, TestCase):
+    fixtures = ["test_fixtures"]
+
+    def setUp(self):
+        self.create_test_objects()
+        self.client.login(**self.user_1_cred)
+        # fixture photos have no image files
+        Photo.objects.all().delete()
+        self.photo = self.create_photo(self.test_gallery_1, title="responsive image")
+        run_pending()
+
+    def rendition(self, name):
+        return self.photo.renditions.get(name=name)
+
+    def test_photo_detail_lists_every_rendition_width(self):
+        response = self.client.get(self.photo.get_absolute_url())
+        card, grid, detail = self.rendition("card"), self.rendition("grid"), self.rendition("detail")
+        stem = os.path.splitext(self.photo.image.url)[0]
+        self.assertContains(response, f'src="{detail.get_absolute_url()}"')
+        # "detail" and "full" are both 1280 pixels wide, only one of them is listed
+        self.assertRegex(
+            response.content.decode(),
+            rf'srcset="{re.escape(card.get_absolute_url())} 480w, '
+            rf'{re.escape(grid.get_absolute_url())} 640w, {re.escape(stem)}_(detail|full)\.jpg 1280w"',
+        )
+        self.assertContains(response, 'sizes="(min-width: 640px) 50vw, 100vw" width="1280" height="720"')
+        self.assertContains(response, 'loading="eager"')
+
+    def test_gallery_grid_is_lazy_loaded(self):
+        response = self.client.get(self.test_gallery_1.get_absolute_url())
+        grid = self.rendition("grid")
+        self.assertContains(response, f'src="{grid.get_absolute_url()}"')
+        self.assertContains(response, 'width="640" height="360" loading="lazy" decoding="async"')
+
+    def test_prefetched_photos_render_without_queries(self):
+        template = Template('{% load gallery_extras %}{% responsive_img photo sizes="100vw" %}')
+        photo = Photo.objects.select_related("gallery").prefetch_related("renditions").get(pk=self.photo.pk)
+        with self.assertNumQueries(0):
+            html = template.render(Context({"photo": photo}))
+        self.assertIn(f'src="{self.rendition("grid").get_absolute_url()}"', html)
+
+    def test_public_renditions_are_served_as_files(self):
+        grid = self.rendition("grid")
+        self.assertEqual(grid.get_absolute_url(), grid.image.url)
+        self.assertTrue(grid.get_absolute_url().startswith(settings.MEDIA_URL))
+
+        Gallery.objects.filter(pk=self.test_gallery_1.pk).update(public=False)
+        grid = Rendition.objects.get(pk=grid.pk)
+        self.assertEqual(grid.get_absolute_url(), grid.get_view_url())
+        response = self.client.get(self.photo.get_absolute_url())
+        self.assertContains(response, f'src="{self.rendition("detail").get_view_url()}"')
+
+    def test_photos_without_renditions_fall_back_to_the_original(self):
+        self.photo.renditions.all().delete()
+        template = Template('{% load gallery_extras %}{% responsive_img photo sizes="100vw" alt=alt %}')
+        html = template.render(Context({"photo": self.photo, "alt": "a <b>"}))
+        self.assertIn(f'src="{self.photo.image.url}"', html)
+        self.assertIn('width="1280" height="720"', html)
+        self.assertIn('alt="a &lt;b&gt;"', html)
+        self.assertNotIn("srcset", html)
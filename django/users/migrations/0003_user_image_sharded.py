@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 19:23
+
+import users.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_alter_user_id"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="image",
+            field=models.ImageField(
+                blank=True, help_text="user profile image ", null=True, upload_to=users.models.user_image_upload_to
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 19:37
+
+import users.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_user_image_sharded"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="avatar",
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to=users.models.user_image_upload_to),
+        ),
+    ]
@@ -1,9 +1,22 @@
+import io
+import os
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.core.files.base import ContentFile
 from django.db import models
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
+from PIL import Image, ImageOps
+from utils.methods import open_image, shard_name
+
+
+def user_image_upload_to(instance, filename):
+    """Store profile images in sharded sub directories, e.g: "users/3f/9a/3f9a....jpg" """
+    return shard_name("users", uuid.uuid4().hex, os.path.splitext(filename)[1])
 
 
 class User(AbstractUser):
@@ -11,29 +24,62 @@ class User(AbstractUser):
 
     REQUIRED_FIELDS = ["email"]
     image = models.ImageField(
-        upload_to="users",
+        upload_to=user_image_upload_to,
         help_text=_("user profile image "),
         blank=True,
         null=True,
     )
+    # Small square copy of `image`, see create_avatar
+    avatar = models.ImageField(upload_to=user_image_upload_to, blank=True, null=True, editable=False)
     slug = models.SlugField(editable=False)
 
     def save(self, **kwargs):
         self.slug = slugify(self.username)
+        if not self.image:
+            self.avatar = None
+        elif not self.image._committed:
+            self.avatar = self.create_avatar()
         return super().save(**kwargs)
 
+    def create_avatar(self):
+        """Square settings.USER_AVATAR_SIZE JPEG of the profile image, or None if it can't be read"""
+        size = settings.USER_AVATAR_SIZE
+        try:
+            self.image.seek(0)
+            # Decoded at a fraction of its size, still large enough to crop any aspect ratio
+            with open_image(self.image, (size * 8, size * 8), settings.PHOTO_MAX_DECODE_BYTES) as image:
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                avatar = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return None
+        finally:
+            self.image.seek(0)
+        buffer = io.BytesIO()
+        avatar.save(buffer, format="JPEG", quality=85)
+        return ContentFile(buffer.getvalue(), name="avatar.jpg")
+
+    def get_google_account(self):
+        """The user's Google SocialAccount or None, prefetched as `google_accounts` by GalleryManager.for_cards"""
+        if hasattr(self, "google_accounts"):
+            return next(iter(self.google_accounts), None)
+        return self.socialaccount_set.filter(provider="google").first()
+
     def get_profile_pic(self):
-        google_account = self.socialaccount_set.filter(provider="google")
         default_image = static("assets/defaults/default_user.jpg")
         if getattr(self, "image", None):
             return self.image.url
-        elif google_account.exists():
-            google_account = google_account.first()
-            image = google_account.extra_data.get("picture", default_image)
-            return image
+        google_account = self.get_google_account()
+        if google_account is not None:
+            return google_account.extra_data.get("picture", default_image)
 
         return default_image
 
+    def get_avatar_url(self):
+        """Url of the small avatar, falling back to get_profile_pic"""
+        if self.avatar:
+            return self.avatar.url
+        return self.get_profile_pic()
+
     def get_update_url(self):
         return reverse("user:user-update", kwargs={"slug": self.slug})
 
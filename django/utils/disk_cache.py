@@ -0,0 +1,145 @@
+import hashlib
+import os
+import struct
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.files import locks
+
+from .methods import shard_name
+
+# Index record: operation, sha1 digest of the key, file size
+RECORD = struct.Struct("<c20sQ")
+ADD, DELETE = b"A", b"D"
+# Number of lock files keys are spread over when creating files
+LOCK_STRIPES = 256
+
+
+class DiskCache:
+    """Size bounded cache of generated files on local disk, evicting the least recently used
+
+    Usage is tracked in an append only index of 29 byte records, one per file added, read
+    or evicted, shared by every process using the cache directory. Each process replays
+    the records appended since it last looked before deciding what to evict, and the index
+    is compacted once most of its records are stale.
+
+    Files are created under a lock striped by key, so concurrent requests for the same
+    missing file wait for a single `create` call instead of each generating it.
+
+        cache = DiskCache("/var/cache/thumbnails", max_bytes=1024 ** 3)
+        path = cache.get_or_create("photo-1-320x320", render)
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index")
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.records = 0
+        self.offset = 0
+        self.index_id = None
+
+    def path(self, digest):
+        return os.path.join(self.directory, shard_name("files", digest.hex()))
+
+    def get_or_create(self, key, create):
+        """Return the path of the cached file for `key`, calling create(path) to write it if missing
+
+        `create` must write the file atomically, e.g. to a temporary file moved into place.
+        """
+        digest = hashlib.sha1(key.encode()).digest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            with self.lock(f"create-{digest[0] % LOCK_STRIPES}"):
+                # Another process may have created it while this one waited for the lock
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    create(path)
+
+        with self.lock("index", locks.LOCK_SH):
+            self.write([(ADD, digest, os.path.getsize(path))])
+            self.sync()
+        if self.total_bytes > self.max_bytes or self.is_stale():
+            # The file is returned to be read, it is evicted by a later call if need be
+            self.evict(keep=digest)
+        return path
+
+    @contextmanager
+    def lock(self, name, flags=locks.LOCK_EX):
+        """Lock shared by every process using the cache directory"""
+        os.makedirs(os.path.join(self.directory, "locks"), exist_ok=True)
+        with open(os.path.join(self.directory, "locks", name), "wb") as lock_file:
+            locks.lock(lock_file, flags)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def write(self, records):
+        # Small O_APPEND writes, records from concurrent processes never interleave
+        with open(self.index_path, "ab") as index:
+            index.write(b"".join(RECORD.pack(*record) for record in records))
+
+    def sync(self):
+        """Replay the index records appended since the last sync, by this process or others"""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        if (stat.st_dev, stat.st_ino) != self.index_id or stat.st_size < self.offset:
+            # New or compacted index, replay it from the start
+            self.entries, self.total_bytes, self.records, self.offset = OrderedDict(), 0, 0, 0
+            self.index_id = (stat.st_dev, stat.st_ino)
+        if stat.st_size <= self.offset:
+            return
+
+        with open(self.index_path, "rb") as index:
+            index.seek(self.offset)
+            data = index.read(stat.st_size - self.offset)
+        data = data[: len(data) - len(data) % RECORD.size]
+        for operation, digest, size in RECORD.iter_unpack(data):
+            self.total_bytes -= self.entries.pop(digest, 0)
+            if operation == ADD:
+                self.entries[digest] = size
+                self.total_bytes += size
+        self.records += len(data) // RECORD.size
+        self.offset += len(data)
+
+    def is_stale(self):
+        """Whether most index records are for files read again or evicted since"""
+        return self.records > 2 * len(self.entries) + 1024
+
+    def evict(self, keep=None):
+        """Delete least recently used files until the cache fits in max_bytes, then compact the index
+
+        The file with digest `keep` is never deleted, even when it alone is over max_bytes.
+        """
+        with self.lock("index"):
+            self.sync()
+            evicted, remaining = [], self.total_bytes
+            for digest, size in self.entries.items():
+                if remaining <= self.max_bytes:
+                    break
+                if digest == keep:
+                    continue
+                try:
+                    os.remove(self.path(digest))
+                except FileNotFoundError:
+                    pass
+                evicted.append((DELETE, digest, size))
+                remaining -= size
+            if evicted:
+                self.write(evicted)
+                self.sync()
+            if self.is_stale():
+                self.compact()
+
+    def compact(self):
+        """Rewrite the index with one record per cached file, least recently used first"""
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "wb") as index:
+            index.write(b"".join(RECORD.pack(ADD, digest, size) for digest, size in self.entries.items()))
+        os.replace(temp_path, self.index_path)
+        self.index_id = None
+        self.sync()
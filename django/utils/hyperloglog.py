@@ -0,0 +1,66 @@
+"""HyperLogLog sketches, approximate counts of distinct values in a few kilobytes
+
+A sketch keeps, for each of 2 ** precision registers, the longest run of leading zero
+bits seen in the hashes of the values sent to it. The count estimate has a relative
+standard error of 1.04 / sqrt(2 ** precision), 1.6% at the default precision, whatever
+the number of values. Sketches of the same precision merge losslessly, the merge of two
+sketches is the sketch of both sets of values, so daily sketches add up to the sketch of
+any range of days.
+
+    sketch = HyperLogLog()
+    sketch.add("session:abc")
+    sketch.merge(HyperLogLog.from_bytes(stored))
+    sketch.count()
+"""
+import hashlib
+import math
+import zlib
+
+PRECISION = 12
+
+
+class HyperLogLog:
+    def __init__(self, precision=PRECISION, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        """Count `value`, a str or bytes. Returns True when the sketch changed"""
+        if isinstance(value, str):
+            value = value.encode()
+        hashed = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        # Position of the first 1 bit in the rest of the hash
+        rest = (hashed << self.precision) & ((1 << 64) - 1)
+        rank = min(64 - rest.bit_length(), 64 - self.precision) + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        """Add the values counted by `other` to this sketch"""
+        if other.precision != self.precision:
+            raise ValueError("Sketches of different precisions can't be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimated number of distinct values added"""
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0**-register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Few values, linear counting of the registers still empty is more accurate
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        """Precision byte and compressed registers, small while few registers are set"""
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(data[0], zlib.decompress(data[1:]))
@@ -1,24 +1,526 @@
-from PIL import Image
+import hashlib
+import math
+import os
+import random
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image, ImageOps
+
+try:
+    # Registers an AVIF encoder with Pillow, which has none built in
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Pillow image formats that can not store an alpha channel
+NO_ALPHA_FORMATS = ("JPEG", "BMP")
+# Bytes read at a time when hashing files
+CHUNK_SIZE = 64 * 1024
+# Perceptual hashes are split in PHASH_CHUNKS chunks of PHASH_CHUNK_BITS, each indexed separately
+PHASH_CHUNKS = 4
+PHASH_CHUNK_BITS = 16
+# Searches enumerate chunk values up to 2 bits away, enough for any distance below 12
+PHASH_MAX_DISTANCE = PHASH_CHUNKS * 3 - 1
+# BlurHash components across and down, the hash is 4 + 2 * x * y characters long
+BLURHASH_COMPONENTS = (4, 3)
+# Images are shrunk to fit this square before computing BlurHash and dominant colours
+PLACEHOLDER_SAMPLE_SIZE = 32
+# EXIF tags read at upload, see https://exiftool.org/TagNames/EXIF.html
+EXIF_MAKE, EXIF_MODEL, EXIF_ORIENTATION = 0x010F, 0x0110, 0x0112
+EXIF_IFD, EXIF_GPS_IFD = 0x8769, 0x8825
+EXIF_DATETIME_ORIGINAL, EXIF_OFFSET_TIME_ORIGINAL, EXIF_LENS_MODEL = 0x9003, 0x9011, 0xA434
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+# EXIF orientations displaying the image turned by 90 degrees, swapping its width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def rendition_name(name, label):
+    """Build a rendition's filename next to its original
+
+    e.g: rendition_name("gallery/kobe.jpg", "grid") -> "gallery/kobe_grid.jpg"
+    """
+    root, ext = os.path.splitext(name)
+    return f"{root}_{label}{ext}"
+
+
+def shard_name(directory, key, extension=""):
+    """Spread files over two levels of sub directories named after their key's first characters
+
+    e.g: shard_name("users", "3f9a1c...", ".jpg") -> "users/3f/9a/3f9a1c....jpg"
+    With hex keys, no directory ever holds more than 256 sub directories and each leaf
+    directory 1/65536th of the files.
+    """
+    return f"{directory}/{key[:2]}/{key[2:4]}/{key}{extension.lower()}"
+
+
+def image_metadata(file, content_hash=None):
+    """Read an image's dimensions, type, size and sha256 hash
+
+    Only the image header is parsed, the pixels are never decoded.
+
+    Args:
+        file: readable and seekable binary file object
+        content_hash (str): the file's sha256 digest when already known, skips hashing
+
+    Returns:
+        dict: width, height, content_type, file_size and content_hash
+    """
+    if content_hash:
+        file_size = file.seek(0, os.SEEK_END)
+    else:
+        file.seek(0)
+        digest = hashlib.sha256()
+        file_size = 0
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            file_size += len(chunk)
+        content_hash = digest.hexdigest()
+
+    file.seek(0)
+    with Image.open(file) as image:
+        width, height = image.size
+        content_type = image.get_format_mimetype() or ""
+        exif = exif_metadata(image)
+    file.seek(0)
+    if exif.pop("orientation") in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return {
+        "width": width,
+        "height": height,
+        "content_type": content_type,
+        "file_size": file_size,
+        "content_hash": content_hash,
+        **exif,
+    }
+
+
+def exif_text(value, max_length=100):
+    """EXIF string value without padding, e.g: b"Canon\\x00" -> "Canon" """
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return str(value or "").replace("\x00", "").strip()[:max_length]
+
+
+def exif_datetime(value, offset=None):
+    """Parse an EXIF "YYYY:MM:DD HH:MM:SS" time, timezone aware when its UTC offset ("+02:00") is known"""
+    try:
+        taken = datetime.strptime(exif_text(value), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    match = re.match(r"^([+-])(\d{2}):(\d{2})$", exif_text(offset))
+    if match:
+        sign, hours, minutes = match.groups()
+        delta = timedelta(hours=int(hours), minutes=int(minutes))
+        taken = taken.replace(tzinfo=timezone(-delta if sign == "-" else delta))
+    return taken
+
+
+def exif_coordinate(value, reference):
+    """Decimal degrees from EXIF (degrees, minutes, seconds), negative south and west"""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    coordinate = degrees + minutes / 60 + seconds / 3600
+    if exif_text(reference).upper() in ("S", "W"):
+        coordinate = -coordinate
+    return round(coordinate, 6)
+
+
+def exif_metadata(image):
+    """Orientation, camera, lens, capture time and GPS position from a Pillow image's EXIF
+
+    Only the image header is read. Missing or malformed values are left empty.
+
+    Returns:
+        dict: orientation, camera_make, camera_model, lens_model, taken_at, latitude, longitude
+    """
+    metadata = {
+        "orientation": 1,
+        "camera_make": "",
+        "camera_model": "",
+        "lens_model": "",
+        "taken_at": None,
+        "latitude": None,
+        "longitude": None,
+    }
+    try:
+        exif = image.getexif()
+        details, gps = exif.get_ifd(EXIF_IFD), exif.get_ifd(EXIF_GPS_IFD)
+    except Exception:  # noqa: B902 - EXIF written by any device, any error means no metadata
+        return metadata
+
+    orientation = exif.get(EXIF_ORIENTATION)
+    metadata["orientation"] = orientation if orientation in range(1, 9) else 1
+    metadata["camera_make"] = exif_text(exif.get(EXIF_MAKE))
+    metadata["camera_model"] = exif_text(exif.get(EXIF_MODEL))
+    metadata["lens_model"] = exif_text(details.get(EXIF_LENS_MODEL))
+    metadata["taken_at"] = exif_datetime(details.get(EXIF_DATETIME_ORIGINAL), details.get(EXIF_OFFSET_TIME_ORIGINAL))
+    latitude = exif_coordinate(gps.get(GPS_LATITUDE), gps.get(GPS_LATITUDE_REF))
+    longitude = exif_coordinate(gps.get(GPS_LONGITUDE), gps.get(GPS_LONGITUDE_REF))
+    if latitude is not None and longitude is not None and abs(latitude) <= 90 and abs(longitude) <= 180:
+        metadata["latitude"], metadata["longitude"] = latitude, longitude
+    return metadata
+
+
+class ImageTooLarge(ValueError):
+    """Image would need more memory to decode than allowed"""
+
+
+def fit_size(size, box):
+    """Largest size with the aspect ratio of `size` that fits within `box`, never upscaled"""
+    width, height = size
+    ratio = min(box[0] / width, box[1] / height, 1)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def decoded_size(image):
+    """Estimate the bytes Pillow needs to hold an image's decoded pixels
+
+    Pillow stores single band images with 1 byte per pixel and everything else,
+    including RGB, with 4 bytes per pixel.
+    """
+    bytes_per_pixel = 1 if image.mode in ("1", "L", "P") else 4
+    return image.width * image.height * bytes_per_pixel
+
+
+def open_image(path, box=None, max_bytes=None):
+    """Open and decode an image at no more than the resolution needed to fit `box`
+
+    JPEG images are decoded straight to 1/2, 1/4 or 1/8 of their size by the decoder
+    (Pillow's draft mode), so a 50 megapixel photo never needs to be held in memory at
+    full resolution. Other formats are decoded in full. Either way, the image's decoded
+    size is checked against `max_bytes` before any pixels are decoded, which rejects
+    decompression bombs from the header alone.
+
+    Raises:
+        ImageTooLarge: decoding would need more than `max_bytes`
+    """
+    image = Image.open(path)
+    try:
+        if box:
+            # No-op for formats other than JPEG
+            image.draft(image.mode, fit_size(image.size, box))
+        if max_bytes and decoded_size(image) > max_bytes:
+            raise ImageTooLarge(
+                f"{image.width}x{image.height} {image.mode} image needs {decoded_size(image)} bytes "
+                f"to decode, the limit is {max_bytes} bytes"
+            )
+        image.load()
+    except Exception:
+        image.close()
+        raise
+    return image
 
 
 def resizeScale(image, width=400, height=300):
-    """Resize large uploaded image
-
-     Scaling images will help reduce load time on the server and client.
-     Pros:
-        - Reduce client side load time. Images will load faster in client's browser.
-        - Reduce storage's costs using cloud base services such as AWS S3 Bucket.
-        - Improve overall UI Deign, making images uniformed throughout the entire website.
-    Cons:
-        - Slight tradeoff in load time, being that all image will be rescaled on every upload.
-          This would add an additional load on the server, but the end results will highly
-          outweights this small computation time.
+    """Scale a Pillow image down to fit within width x height
+
+    The aspect ratio is kept and images that already fit are returned as is.
+    Large reductions are first box-reduced by an integer factor, which is cheap,
+    before the final resampling.
+    """
+    size = fit_size(image.size, (width, height))
+    if size == image.size:
+        return image
+    return image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+
+def format_name(name, image_format):
+    """Name of the copy of a file encoded in another format
+
+    e.g: format_name("gallery/kobe_grid.jpg", "WEBP") -> "gallery/kobe_grid.webp"
+    """
+    return f"{os.path.splitext(name)[0]}.{image_format.lower()}"
+
+
+def mime_type(image_format):
+    """Mime type of a Pillow image format, e.g: "WEBP" -> "image/webp" """
+    Image.init()
+    return Image.MIME.get(image_format)
+
+
+def encodable_formats(formats):
+    """The Pillow formats in `formats` this Pillow build can write, AVIF needs a plugin"""
+    Image.init()
+    return [image_format for image_format in formats if image_format in Image.SAVE]
+
+
+def save_image(image, path, image_format, options=None):
+    """Write a Pillow image through a temporary file, dropping EXIF and keeping the colour profile"""
+    temp_path = f"{path}.tmp"
+    image.save(temp_path, format=image_format, exif=b"", icc_profile=image.info.get("icc_profile"), **(options or {}))
+    os.replace(temp_path, path)
+
+
+def save_renditions(path, renditions, max_bytes=None, options=None, formats=(), output_format=None):
+    """Decode an image once and write each of its scaled renditions to disk
+
+    Renditions keep the original's format, so the original upload is never touched,
+    and can also be written in other formats next to it, see format_name. They are
+    turned according to the original's EXIF orientation, which they don't keep. The
+    image is decoded only at the resolution the largest rendition needs and sizes are
+    processed largest first, each rendition being scaled from the previous one. Files
+    are written to a temporary file and moved into place, so a rendition being served
+    is never partial.
+
+    Args:
+        path (str): path of the original image
+        renditions (dict): rendition label -> ((width, height), destination path)
+        max_bytes (int): refuse images needing more memory to decode, see open_image
+        options (dict): encoder options by Pillow format, see settings.PHOTO_ENCODER_OPTIONS
+        formats (iterable): other Pillow formats to write each rendition in, skipped when
+            this Pillow build can't encode them
+        output_format (str): Pillow format of the destination files, instead of the original's
+
+    Returns:
+        dict: rendition label -> (width, height, file size, other formats written)
+    """
+    options = options or {}
+    ordered = sorted(renditions.items(), key=lambda item: item[1][0][0] * item[1][0][1], reverse=True)
+    largest = ordered[0][1][0]
+    with open_image(path, largest, max_bytes) as original:
+        image_format = output_format or original.format or "JPEG"
+        others = tuple(other for other in encodable_formats(formats) if other != image_format)
+        image = original
+        if exif_metadata(original)["orientation"] != 1:
+            # Renditions carry no EXIF, the pixels are turned the way the photo is displayed
+            image = ImageOps.exif_transpose(original)
+        if image_format in NO_ALPHA_FORMATS and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        results = {}
+        for label, ((width, height), destination) in ordered:
+            image = resizeScale(image, width, height)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            save_image(image, destination, image_format, options.get(image_format))
+            for other in others:
+                save_image(image, format_name(destination, other), other, options.get(other))
+            results[label] = (image.width, image.height, os.path.getsize(destination), others)
+    return results
+
+
+def dhash(image):
+    """64 bit difference hash of a Pillow image
+
+    Each bit tells whether a pixel is brighter than its right neighbour in a 9x8
+    grayscale thumbnail, so the hash survives re-compression, scaling and small crops.
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left, right = pixels[row * 9 + column], pixels[row * 9 + column + 1]
+            value = value << 1 | (left > right)
+    return value
+
+
+def srgb_to_linear(value):
+    value = value / 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def linear_to_srgb(value):
+    value = min(max(value, 0), 1)
+    value = value * 12.92 if value <= 0.0031308 else 1.055 * value ** (1 / 2.4) - 0.055
+    return int(value * 255 + 0.5)
+
+
+SRGB_TO_LINEAR = [srgb_to_linear(value) for value in range(256)]
+
+
+def encode_base83(value, length):
+    return "".join(BASE83[value // 83 ** (length - index - 1) % 83] for index in range(length))
+
+
+def decode_base83(value):
+    result = 0
+    for character in value:
+        result = result * 83 + BASE83.index(character)
+    return result
+
+
+def blurhash(image, components=BLURHASH_COMPONENTS):
+    """BlurHash of a Pillow image, a short string clients decode into a blurred preview
+
+    Encodes the average colour and the lowest cosine frequencies of the image, see
+    https://github.com/woltapp/blurhash. The image is first shrunk to a few hundred
+    pixels, which leaves the low frequencies unchanged.
     """
+    x_components, y_components = components
+    sample = image.convert("RGB")
+    sample.thumbnail((PLACEHOLDER_SAMPLE_SIZE, PLACEHOLDER_SAMPLE_SIZE), Image.BILINEAR)
+    width, height = sample.size
+    pixels = [tuple(SRGB_TO_LINEAR[channel] for channel in pixel) for pixel in sample.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        rows = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            columns = [math.cos(math.pi * i * x / width) for x in range(width)]
+            red = green = blue = 0
+            for y, row in enumerate(rows):
+                for x, column in enumerate(columns):
+                    basis = row * column
+                    pixel = pixels[y * width + x]
+                    red += basis * pixel[0]
+                    green += basis * pixel[1]
+                    blue += basis * pixel[2]
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            factors.append((red * scale, green * scale, blue * scale))
+
+    dc, ac = factors[0], factors[1:]
+    value = encode_base83(x_components - 1 + (y_components - 1) * 9, 1)
+    maximum = 1
+    if ac:
+        quantised = max(0, min(82, int(max(abs(channel) for factor in ac for channel in factor) * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+        value += encode_base83(quantised, 1)
+    else:
+        value += encode_base83(0, 1)
+    value += encode_base83(sum(linear_to_srgb(channel) << shift for channel, shift in zip(dc, (16, 8, 0))), 4)
+    for factor in ac:
+        red, green, blue = (
+            max(0, min(18, int(math.copysign(abs(channel / maximum) ** 0.5, channel) * 9 + 9.5))) for channel in factor
+        )
+        value += encode_base83(red * 19 * 19 + green * 19 + blue, 2)
+    return value
+
+
+def blurhash_image(value, width, height):
+    """Decode a BlurHash into a `width` x `height` Pillow image"""
+    size = decode_base83(value[0])
+    x_components, y_components = size % 9 + 1, size // 9 + 1
+    if len(value) != 4 + 2 * x_components * y_components:
+        raise ValueError("Invalid BlurHash length")
+    maximum = (decode_base83(value[1]) + 1) / 166
+    dc = decode_base83(value[2:6])
+    colors = [tuple(SRGB_TO_LINEAR[dc >> shift & 255] for shift in (16, 8, 0))]
+    for index in range(1, x_components * y_components):
+        ac = decode_base83(value[4 + index * 2 : 6 + index * 2])
+        colors.append(
+            tuple(
+                math.copysign(((quantised - 9) / 9) ** 2, quantised - 9) * maximum
+                for quantised in (ac // (19 * 19), ac // 19 % 19, ac % 19)
+            )
+        )
+
+    pixels = []
+    for y in range(height):
+        for x in range(width):
+            red = green = blue = 0
+            for j in range(y_components):
+                for i in range(x_components):
+                    basis = math.cos(math.pi * x * i / width) * math.cos(math.pi * y * j / height)
+                    color = colors[i + j * x_components]
+                    red += color[0] * basis
+                    green += color[1] * basis
+                    blue += color[2] * basis
+            pixels.append((linear_to_srgb(red), linear_to_srgb(green), linear_to_srgb(blue)))
+    image = Image.new("RGB", (width, height))
+    image.putdata(pixels)
+    return image
+
+
+def dominant_color(image):
+    """Most common colour of a Pillow image as "#rrggbb", after reducing it to a few colours"""
+    sample = image.convert("RGB")
+    sample.thumbnail((PLACEHOLDER_SAMPLE_SIZE, PLACEHOLDER_SAMPLE_SIZE), Image.BILINEAR)
+    paletted = sample.quantize(colors=5)
+    _, index = max(paletted.getcolors())
+    red, green, blue = paletted.getpalette()[index * 3 : index * 3 + 3]
+    return f"#{red:02x}{green:02x}{blue:02x}"
+
+
+def preview_metadata(renditions):
+    """Perceptual hash and placeholders of the smallest rendition written by save_renditions
+
+    The smallest rendition is much cheaper to decode than the original and still has far
+    more pixels than any of them need.
+
+    Returns:
+        dict: {"dhash": int, "blurhash": str, "dominant_color": str}
+    """
+    _, path = min(renditions.values(), key=lambda rendition: rendition[0][0] * rendition[0][1])
+    with Image.open(path) as image:
+        return {"dhash": dhash(image), "blurhash": blurhash(image), "dominant_color": dominant_color(image)}
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count("1")
+
+
+def phash_chunks(value):
+    """Split a perceptual hash in PHASH_CHUNKS integers, most significant first"""
+    mask = (1 << PHASH_CHUNK_BITS) - 1
+    return [value >> (PHASH_CHUNK_BITS * index) & mask for index in reversed(range(PHASH_CHUNKS))]
+
+
+def phash_lookups(value, distance):
+    """Chunk values to look up to find every hash within `distance` bits of `value`
+
+    Multi-index hashing: when two hashes differ by at most `distance` bits, at least one
+    of their PHASH_CHUNKS chunks differs by at most distance // PHASH_CHUNKS bits. Looking
+    up each chunk's neighbours in its own index finds every candidate without a full scan.
+
+    Returns:
+        list: for each chunk, the chunk values to match
+    """
+    if not 0 <= distance <= PHASH_MAX_DISTANCE:
+        raise ValueError(f"distance must be between 0 and {PHASH_MAX_DISTANCE}")
+    radius = distance // PHASH_CHUNKS
+    lookups = []
+    for chunk in phash_chunks(value):
+        variants = {chunk}
+        for _ in range(radius):
+            variants |= {variant ^ 1 << bit for variant in variants for bit in range(PHASH_CHUNK_BITS)}
+        lookups.append(sorted(variants))
+    return lookups
+
+
+def render_photo(task):
+    """Process pool entry point, see `gallery rerender_photos` command
+
+    Args:
+        task (tuple): (photo pk, original path, renditions, max bytes, options, formats) see save_renditions
+
+    Returns:
+        tuple: (photo pk, original file size, renditions or None, preview metadata or None, error or None)
+    """
+    pk, path, renditions, max_bytes, options, formats = task
     try:
-        image = Image.open(image.path)
-        if image.width > width or image.height > height:
-            output_size = (width, height)
-            image = image.resize(output_size, Image.ANTIALIAS)
-            image.save(image.path)
-    except:  # noqa
-        pass
+        results = save_renditions(path, renditions, max_bytes, options, formats)
+        return pk, os.path.getsize(path), results, preview_metadata(renditions), None
+    except Exception as error:  # noqa: B902 - reported back to the parent process
+        return pk, 0, None, None, f"{error.__class__.__name__}: {error}"
+
+
+def batches(counts):
+    """Keys of `counts` grouped by count, {n: [keys counted n times]}
+
+    e.g: batches({"a": 2, "b": 1, "c": 2}) -> {2: ["a", "c"], 1: ["b"]}, one UPDATE ... SET n = n + count
+    per group instead of one per key.
+    """
+    grouped = defaultdict(list)
+    for key, count in counts.items():
+        grouped[count].append(key)
+    return grouped
+
+
+def weighted_shuffle(items, weights, rng=random):
+    """Shuffle `items` so that heavier ones tend to come first
+
+    Weighted random sampling without replacement (Efraimidis-Spirakis): each item draws
+    the key random() ** (1 / weight) and items are sorted by key, highest first.
+
+    Args:
+        items (list): items to shuffle
+        weights (list): positive weight of each item
+        rng (random.Random): random number generator, for reproducible shuffles
+    """
+    keys = [rng.random() ** (1 / weight) for weight in weights]
+    return [item for _, item in sorted(zip(keys, items), key=lambda pair: pair[0], reverse=True)]
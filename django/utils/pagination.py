@@ -0,0 +1,183 @@
+"""Cursor pagination for lists too long for OFFSET and COUNT(*)
+
+Pages are linked by opaque cursor tokens instead of page numbers. A keyset cursor holds
+the sort values of the row a page starts after, so the next page is fetched with
+WHERE (created, pk) < (cursor values) from the ordering's index, and deep pages cost the
+same as the first. Nothing counts the whole list, pages only know whether they have
+neighbours.
+
+    page = keyset_page(Gallery.objects.all(), request.GET.get("cursor"), 25, params=request.GET)
+    page.has_next, page.next_query  # "cursor=eyJ2Ijpb..."
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.http import QueryDict
+
+CURSOR_PARAM = "cursor"
+
+
+class InvalidCursor(ValueError):
+    """Cursor token that was not made by this module, or for another list"""
+
+
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, ValueError) as error:
+        raise InvalidCursor(token) from error
+    if not isinstance(data, dict):
+        raise InvalidCursor(token)
+    return data
+
+
+class CursorPage:
+    """One page of a cursor paginated list, with the cursors of the pages around it"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, params=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def query(self, cursor):
+        """Query string of the current request's parameters with `cursor`"""
+        params = self.params.copy() if self.params is not None else QueryDict(mutable=True)
+        params[CURSOR_PARAM] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self.query(self.next_cursor) if self.has_next() else None
+
+    @property
+    def previous_query(self):
+        return self.query(self.previous_cursor) if self.has_previous() else None
+
+
+def sort_expressions(ordering, reverse=False):
+    """order_by expressions for `ordering` field names, NULLs last, or the exact opposite when `reverse`"""
+    expressions = []
+    for field in ordering:
+        descending = field.startswith("-") != reverse
+        nulls = {"nulls_first": True} if reverse else {"nulls_last": True}
+        expression = F(field.lstrip("-"))
+        expressions.append(expression.desc(**nulls) if descending else expression.asc(**nulls))
+    return expressions
+
+
+def keyset_filter(ordering, values, reverse=False):
+    """Rows sorted after the row with sort `values` in `ordering`, or before it when `reverse`
+
+    Lexicographic comparison of the sort values, as sort_expressions orders them with NULLs last.
+    """
+    condition, equal = Q(), Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") != reverse else "gt"
+        if value is None:
+            # Only rows with a value sort before a NULL, none after it
+            if reverse:
+                condition |= equal & Q(**{f"{name}__isnull": False})
+            equal &= Q(**{f"{name}__isnull": True})
+            continue
+        beyond = Q(**{f"{name}__{lookup}": value})
+        if not reverse:
+            beyond |= Q(**{f"{name}__isnull": True})
+        condition |= equal & beyond
+        equal &= Q(**{name: value})
+    return condition
+
+
+def sort_values(obj, ordering):
+    values = []
+    for field in ordering:
+        value = getattr(obj, field.lstrip("-"))
+        values.append(value.isoformat() if isinstance(value, (date, datetime)) else value)
+    return values
+
+
+def keyset_page(queryset, cursor, page_size, ordering=("-created", "-pk"), params=None):
+    """Page of `queryset` in `ordering` after, or before, the row a cursor points at
+
+    `ordering` must end with a unique field, so every row has a distinct position.
+
+    Raises:
+        InvalidCursor: the cursor is not a keyset cursor for `ordering`
+    """
+    data = decode_cursor(cursor) if cursor else {}
+    reverse = bool(data.get("r"))
+    if data:
+        values = data.get("v")
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise InvalidCursor(cursor)
+        opts = queryset.model._meta
+        try:
+            values = [
+                (opts.pk if field.lstrip("-") == "pk" else opts.get_field(field.lstrip("-"))).to_python(value)
+                for field, value in zip(ordering, values)
+            ]
+        except (ValidationError, TypeError, ValueError) as error:
+            raise InvalidCursor(cursor) from error
+        queryset = queryset.filter(keyset_filter(ordering, values, reverse))
+
+    rows = list(queryset.order_by(*sort_expressions(ordering, reverse))[: page_size + 1])
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+    # A page reached from a cursor has the cursor's row on its other side
+    has_next, has_previous = (True, more) if reverse else (more, bool(data))
+
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor({"v": sort_values(rows[-1], ordering)})
+    if rows and has_previous:
+        previous_cursor = encode_cursor({"v": sort_values(rows[0], ordering), "r": 1})
+    return CursorPage(rows, next_cursor, previous_cursor, params)
+
+
+def offset_page(sequence, cursor, page_size, params=None):
+    """Page of a sequence that is cheap to slice anywhere and count, by position
+
+    For lists already stored in order, e.g. gallery.views.FeedList, where the position of
+    a row is indexed and slicing does not skip rows like OFFSET does.
+
+    Raises:
+        InvalidCursor: the cursor is not an offset cursor
+    """
+    data = decode_cursor(cursor) if cursor else {}
+    start = data.get("o", 0)
+    if not isinstance(start, int) or start < 0:
+        raise InvalidCursor(cursor)
+
+    object_list = list(sequence[start : start + page_size])
+    next_cursor = encode_cursor({"o": start + page_size}) if start + page_size < sequence.count() else None
+    previous_cursor = encode_cursor({"o": max(start - page_size, 0)}) if start > 0 else None
+    return CursorPage(object_list, next_cursor, previous_cursor, params)
@@ -0,0 +1,80 @@
+import io
+import os
+import zipfile
+
+from .methods import CHUNK_SIZE
+
+
+class StreamBuffer(io.RawIOBase):
+    """Write only, unseekable file holding what zipfile writes until it is drained
+
+    zipfile writes archives to unseekable files with data descriptors after each entry,
+    so nothing is ever written back and the archive can be sent as it is produced.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ZipStream:
+    """Iterate over the bytes of a ZIP archive of files, built as it is read
+
+    Entries are stored, not deflated, since photos are already compressed. Only one
+    CHUNK_SIZE block of file data is held in memory at a time, whatever the archive size.
+    Files that can't be opened are left out of the archive.
+
+        ZipStream((name, path, modified datetime) for ...)
+
+    Args:
+        files (iterable): (name in archive, file path, modified datetime) tuples, consumed lazily
+        on_close (callable): called once when the stream is closed, finished or not
+    """
+
+    def __init__(self, files, on_close=None):
+        self.files = files
+        self.on_close = on_close
+
+    def __iter__(self):
+        buffer = StreamBuffer()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, path, modified in self.files:
+                try:
+                    source = open(path, "rb")
+                except OSError:
+                    continue
+                with source:
+                    info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+                    info.compress_type = zipfile.ZIP_STORED
+                    # Lets zipfile decide whether the entry needs zip64 headers
+                    info.file_size = os.fstat(source.fileno()).st_size
+                    with archive.open(info, "w") as entry:
+                        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                            entry.write(chunk)
+                            yield buffer.drain()
+                # Data descriptor
+                yield buffer.drain()
+        # Central directory
+        yield buffer.drain()
+
+    def close(self):
+        if self.on_close is not None:
+            self.on_close()
+            self.on_close = None